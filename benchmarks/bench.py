@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+''' End to end benchmark of copr-builder
+
+    Generates synthetic git repositories, starts a local fake Copr server
+    and times CoprBuilder.do_builds together with its phases (clone,
+    archive, rpmbuild, upload and watch) for different numbers of projects.
+'''
+
+import argparse
+import collections
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# pylint: disable=wrong-import-position
+from copr_builder.build_watcher import BuildWatcher
+from copr_builder.copr_builder import CoprBuilder
+from copr_builder.git_repo import GitWorktree
+from copr_builder.srpm_builder import SRPMBuilder
+
+from fake_copr import FakeCopr, FakeCoprServer
+from fixtures import make_projects
+
+
+# methods timed as the individual phases, times are summed over all projects
+PHASES = collections.OrderedDict([('clone', (GitWorktree, 'clone')),
+                                  ('archive', (SRPMBuilder, '_make_archive')),
+                                  ('rpmbuild', (SRPMBuilder, '_make_srpm')),
+                                  ('upload', (CoprBuilder, '_upload_srpm')),
+                                  ('watch', (BuildWatcher, 'watch'))])
+
+
+class PhaseTimer(object):
+    ''' Sum time spent in the PHASES methods '''
+
+    def __init__(self):
+        self.times = collections.defaultdict(float)
+        self.counts = collections.Counter()
+        self._lock = threading.Lock()
+
+    def _wrap(self, phase, method):
+        def timed(*args, **kwargs):
+            start = time.monotonic()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.times[phase] += time.monotonic() - start
+                    self.counts[phase] += 1
+        return timed
+
+    @contextmanager
+    def patch(self):
+        originals = []
+        for phase, (cls, name) in PHASES.items():
+            method = cls.__dict__[name]
+            originals.append((cls, name, method))
+            setattr(cls, name, self._wrap(phase, method))
+        try:
+            yield self
+        finally:
+            for cls, name, method in originals:
+                setattr(cls, name, method)
+
+
+def run_benchmark(sections, jobs=1, upload_jobs=1, build_duration=1.0, latency=0.0, **repo_args):
+    ''' Build @sections projects against a fresh fake Copr
+
+        returns (dict): results of the run
+    '''
+    with tempfile.TemporaryDirectory() as tmp:
+        copr = FakeCopr(build_duration=build_duration, latency=latency)
+        server = FakeCoprServer(copr)
+        server.start()
+
+        try:
+            start = time.monotonic()
+            config = make_projects(tmp, sections, copr, **repo_args)
+            setup = time.monotonic() - start
+
+            copr_config = os.path.join(tmp, 'copr')
+            server.write_config(copr_config)
+
+            builder = CoprBuilder(config, copr_config, jobs=jobs, upload_jobs=upload_jobs)
+
+            timer = PhaseTimer()
+            with timer.patch():
+                start = time.monotonic()
+                success = builder.do_builds(None)
+                total = time.monotonic() - start
+        finally:
+            server.stop()
+
+    return {'sections': sections,
+            'jobs': jobs,
+            'upload_jobs': upload_jobs,
+            'success': success,
+            'setup': setup,
+            'total': total,
+            'phases': {phase: {'time': timer.times[phase], 'count': timer.counts[phase]} for phase in PHASES},
+            'requests': sum(copr.requests.values()),
+            'requests_by_endpoint': {'%s %s' % k: v for k, v in sorted(copr.requests.items())},
+            'uploaded': copr.uploaded}
+
+
+def print_results(results):
+    header = ['sections', 'total'] + list(PHASES.keys()) + ['requests']
+    print(' '.join('%10s' % h for h in header))
+    for res in results:
+        row = ['%10d' % res['sections'], '%9.2fs' % res['total']]
+        row.extend('%9.2fs' % res['phases'][phase]['time'] for phase in PHASES)
+        row.append('%10d' % res['requests'])
+        print(' '.join(row))
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='copr-builder benchmark')
+    argparser.add_argument('-s', '--sections', nargs='+', type=int, default=[1, 50, 500],
+                           help='numbers of projects to benchmark with (defaults to 1 50 500)')
+    argparser.add_argument('-j', '--jobs', type=int, default=1, help='number of parallel SRPM jobs')
+    argparser.add_argument('--upload-jobs', type=int, default=1, help='number of parallel uploads')
+    argparser.add_argument('--build-duration', type=float, default=1.0,
+                           help='how long the fake Copr builds run (in seconds)')
+    argparser.add_argument('--latency', type=float, default=0.0,
+                           help='latency added to every fake Copr API request (in seconds)')
+    argparser.add_argument('--commits', type=int, default=1, help='number of commits in each git repository')
+    argparser.add_argument('--file-size', type=int, default=0,
+                           help='size of an additional file in each git repository (in bytes)')
+    argparser.add_argument('-o', '--output', help='save the results to this JSON file')
+    argparser.add_argument('-v', '--verbose', action='store_true', help='print copr-builder messages')
+    args = argparser.parse_args()
+
+    if not shutil.which('rpmbuild'):
+        print('rpmbuild is needed to run the benchmark.', file=sys.stderr)
+        return 1
+
+    logging.basicConfig(stream=sys.stderr, format='%(name)s: %(message)s')
+    logging.getLogger('copr.builder').setLevel(logging.INFO if args.verbose else logging.ERROR)
+
+    results = []
+    for sections in args.sections:
+        results.append(run_benchmark(sections, jobs=args.jobs, upload_jobs=args.upload_jobs,
+                                     build_duration=args.build_duration, latency=args.latency,
+                                     commits=args.commits, file_size=args.file_size))
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    return 0 if all(r['success'] for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
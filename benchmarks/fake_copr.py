@@ -0,0 +1,398 @@
+''' Local stand-in for the Copr API used by the benchmarks
+
+    Implements the parts of the Copr APIv3 copr-builder talks to: projects,
+    build lists, builds, build chroots and creating builds from uploaded
+    SRPMs, URLs, custom scripts or SCM. Builds "run" for @build_duration
+    seconds after they are submitted and then succeed (or fail with
+    @failure_rate probability). Latency, server errors and a rate limit
+    can be injected into the API requests.
+
+    Can be also started as a separate process (see --help) so it doesn't
+    share CPU time and memory with the measured copr-builder.
+'''
+
+import argparse
+import collections
+import email.parser
+import json
+import random
+import sys
+import threading
+import time
+import urllib.parse
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+COPR_CONFIG = '''[copr-cli]
+login = bench
+username = bench
+token = bench
+copr_url = {url}
+encrypted = False
+# expiration date: 2999-12-31
+'''
+
+API_PREFIX = '/api_3'
+
+
+def _split_nvr(srpm):
+    ''' Get name and version-release from an SRPM file name '''
+    nvr = srpm[:-len('.src.rpm')] if srpm.endswith('.src.rpm') else srpm
+    name, version, release = nvr.rsplit('-', 2)
+    return name, '%s-%s' % (version, release)
+
+
+class FakeCopr(object):
+    ''' State of the fake Copr instance
+
+        @duration_jitter -- build durations vary randomly by this fraction of @build_duration
+        @failure_rate -- fraction of builds that fail
+        @error_rate -- fraction of API requests failing with "503 Service Unavailable"
+        @rate_limit -- API requests allowed per second, requests over the limit get "429 Too Many Requests"
+        @auto_projects -- create unknown projects on the first request instead of returning 404
+    '''
+
+    def __init__(self, build_duration=1.0, latency=0.0, duration_jitter=0.0, failure_rate=0.0, error_rate=0.0,
+                 rate_limit=None, auto_projects=False, seed=None):
+        self.build_duration = build_duration
+        self.latency = latency
+        self.duration_jitter = duration_jitter
+        self.failure_rate = failure_rate
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.auto_projects = auto_projects
+
+        self.projects = {}
+        self.builds = {}
+
+        # number of requests per endpoint, bytes of uploaded SRPMs and rejected requests per status code
+        self.requests = collections.Counter()
+        self.uploaded = 0
+        self.rejected = collections.Counter()
+
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._random = random.Random(seed)
+
+        # token bucket for the rate limit
+        self._tokens = rate_limit
+        self._refilled = time.monotonic()
+
+    def record(self, method, endpoint):
+        with self._lock:
+            self.requests[(method, endpoint)] += 1
+
+    def admit(self):
+        ''' Decide whether to handle a request
+
+            returns (int): None or status code of an injected error
+        '''
+        with self._lock:
+            if self.rate_limit:
+                now = time.monotonic()
+                self._tokens = min(self.rate_limit, self._tokens + (now - self._refilled) * self.rate_limit)
+                self._refilled = now
+                if self._tokens < 1:
+                    self.rejected[429] += 1
+                    return 429
+                self._tokens -= 1
+
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.rejected[503] += 1
+                return 503
+
+        return None
+
+    def record_upload(self, size):
+        with self._lock:
+            self.uploaded += size
+
+    def add_project(self, ownername, projectname, chroots):
+        with self._lock:
+            self.projects[(ownername, projectname)] = {
+                'id': len(self.projects) + 1,
+                'name': projectname,
+                'ownername': ownername,
+                'full_name': '%s/%s' % (ownername, projectname),
+                'chroot_repos': {c: 'http://localhost/%s/%s/%s/' % (ownername, projectname, c) for c in chroots},
+            }
+
+    def _state(self, build):
+        if build['state'] in ('canceled', 'failed', 'succeeded', 'skipped'):
+            return build
+        now = time.time()
+        if now - build['_submitted'] >= build['_duration']:
+            build['state'] = build['_result']
+            build['started_on'] = build['submitted_on']
+            build['ended_on'] = int(now)
+        elif build['state'] == 'pending':
+            build['state'] = 'running'
+        return build
+
+    def _public(self, build):
+        return {k: v for k, v in self._state(build).items() if not k.startswith('_')}
+
+    def get_project(self, ownername, projectname):
+        if self.auto_projects and (ownername, projectname) not in self.projects:
+            self.add_project(ownername, projectname, ['fedora-rawhide-x86_64'])
+        with self._lock:
+            return self.projects.get((ownername, projectname))
+
+    def get_build(self, build_id):
+        with self._lock:
+            build = self.builds.get(build_id)
+            return self._public(build) if build else None
+
+    def list_builds(self, ownername, projectname, packagename=None, status=None, offset=0, limit=None,
+                    order_type='ASC'):
+        with self._lock:
+            builds = [self._public(b) for b in self.builds.values()
+                      if (b['ownername'], b['projectname']) == (ownername, projectname) and
+                      (not packagename or b['source_package']['name'] == packagename)]
+
+        if status:
+            builds = [b for b in builds if b['state'] == status]
+        builds.sort(key=lambda b: b['id'], reverse=order_type == 'DESC')
+
+        return builds[offset:offset + limit if limit else None]
+
+    def create_build(self, ownername, projectname, srpm_name=None, chroots=None, source_type='upload'):
+        project = self.get_project(ownername, projectname)
+        if project is None:
+            return None
+
+        name, version = _split_nvr(srpm_name) if srpm_name else (None, None)
+        with self._lock:
+            now = time.time()
+            jitter = self._random.uniform(-self.duration_jitter, self.duration_jitter)
+            failed = self.failure_rate and self._random.random() < self.failure_rate
+            build = {'id': self._next_id,
+                     'state': 'pending',
+                     'ownername': ownername,
+                     'projectname': projectname,
+                     'project_dirname': projectname,
+                     'chroots': sorted(chroots or project['chroot_repos'].keys()),
+                     'source_package': {'name': name, 'version': version,
+                                        'url': 'http://localhost/results/%s/%s/srpm-builds/%08d/%s' % (
+                                            ownername, projectname, self._next_id, srpm_name) if srpm_name else None},
+                     'source_type': source_type,
+                     'submitted_on': int(now),
+                     'started_on': None,
+                     'ended_on': None,
+                     '_submitted': now,
+                     '_duration': self.build_duration * (1 + jitter),
+                     '_result': 'failed' if failed else 'succeeded'}
+            self.builds[build['id']] = build
+            self._next_id += 1
+
+            return self._public(build)
+
+    def cancel_build(self, build_id):
+        with self._lock:
+            build = self.builds.get(build_id)
+            if build is None:
+                return None
+            if self._state(build)['state'] not in ('succeeded', 'failed'):
+                build['state'] = 'canceled'
+            return self._public(build)
+
+    def stats(self):
+        ''' Requests and builds handled so far
+
+            Builds are reported with the time they finish (or will finish) in Copr.
+        '''
+        with self._lock:
+            return {'requests': {'%s %s' % k: v for k, v in sorted(self.requests.items())},
+                    'rejected': {str(k): v for k, v in sorted(self.rejected.items())},
+                    'uploaded': self.uploaded,
+                    'builds': {b['id']: {'state': self._state(b)['state'], 'ended': b['_submitted'] + b['_duration']}
+                               for b in self.builds.values()}}
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def _reply(self, status, data, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _not_found(self, what):
+        self._reply(404, {'error': '%s not found' % what})
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _form(self, body):
+        ''' Get the JSON data and size of uploaded files from a multipart request '''
+        headers = b'Content-Type: ' + self.headers['Content-Type'].encode() + b'\r\n\r\n'
+        message = email.parser.BytesParser().parsebytes(headers + body)
+        data = {}
+        files = {}
+        for part in message.get_payload():
+            name = part.get_param('name', header='content-disposition')
+            if name == 'json':
+                data = json.loads(part.get_payload(decode=True))
+            else:
+                files[name] = (part.get_filename(), len(part.get_payload(decode=True)))
+        return data, files
+
+    def _handle(self, method):
+        copr = self.server.copr
+        url = urllib.parse.urlparse(self.path)
+        path = url.path[len(API_PREFIX):] if url.path.startswith(API_PREFIX) else url.path
+        query = {k: v[-1] for k, v in urllib.parse.parse_qs(url.query).items()}
+        body = self._body()
+
+        if method == 'GET' and path == '/_stats':
+            self._reply(200, copr.stats())
+            return
+
+        copr.record(method, '/'.join(p for p in path.split('/') if not p.isdigit()))
+        if copr.latency:
+            time.sleep(copr.latency)
+
+        error = copr.admit()
+        if error == 429:
+            self._reply(429, {'error': 'Too many requests'}, {'Retry-After': '1'})
+        elif error:
+            self._reply(error, {'error': 'Service unavailable'})
+        elif method == 'GET' and path == '/project':
+            project = copr.get_project(query.get('ownername'), query.get('projectname'))
+            if project is None:
+                self._not_found('Project')
+            else:
+                self._reply(200, project)
+        elif method == 'GET' and path == '/build/list':
+            builds = copr.list_builds(query.get('ownername'), query.get('projectname'), query.get('packagename'),
+                                      query.get('status'), int(query.get('offset', 0)),
+                                      int(query['limit']) if 'limit' in query else None,
+                                      query.get('order_type', 'ASC'))
+            self._reply(200, {'items': builds, 'meta': {'limit': query.get('limit'), 'offset': query.get('offset')}})
+        elif method == 'GET' and path.startswith('/build/'):
+            build = copr.get_build(int(path.split('/')[-1]))
+            if build is None:
+                self._not_found('Build')
+            else:
+                self._reply(200, build)
+        elif method == 'GET' and path == '/build-chroot':
+            build = copr.get_build(int(query.get('build_id', 0)))
+            if build is None:
+                self._not_found('Build')
+            else:
+                self._reply(200, {'name': query.get('chrootname'), 'state': build['state']})
+        elif method == 'POST' and path.startswith('/build/create/'):
+            source_type = path.split('/')[-1]
+            if source_type == 'upload':
+                data, files = self._form(body)
+                srpm_name, size = files.get('pkgs', (None, 0))
+                copr.record_upload(size)
+            else:
+                data = json.loads(body) if body else {}
+                srpm_name = None
+                for url_key in ('pkgs', 'url'):
+                    urls = data.get(url_key)
+                    if urls:
+                        urls = urls if isinstance(urls, list) else urls.split()
+                        srpm_name = urls[0].rstrip('/').split('/')[-1]
+                        break
+            build = copr.create_build(data.get('ownername'), data.get('projectname'), srpm_name,
+                                      data.get('chroots'), source_type)
+            if build is None:
+                self._not_found('Project')
+            elif source_type == 'url':
+                # one build for each URL
+                self._reply(200, {'items': [build], 'meta': {}})
+            else:
+                self._reply(200, build)
+        elif method == 'PUT' and path.startswith('/build/cancel/'):
+            build = copr.cancel_build(int(path.split('/')[-1]))
+            if build is None:
+                self._not_found('Build')
+            else:
+                self._reply(200, build)
+        else:
+            self._reply(404, {'error': 'Unknown endpoint %s %s' % (method, path)})
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self._handle('GET')
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        self._handle('POST')
+
+    def do_PUT(self):  # pylint: disable=invalid-name
+        self._handle('PUT')
+
+
+class FakeCoprServer(ThreadingHTTPServer):
+    ''' HTTP server for @copr (FakeCopr) on a random port on localhost '''
+
+    daemon_threads = True
+
+    def __init__(self, copr):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.copr = copr
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def write_config(self, path):
+        ''' Write Copr client config for this server to @path '''
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(COPR_CONFIG.format(url=self.url))
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Fake Copr server for copr-builder benchmarks')
+    argparser.add_argument('--build-duration', type=float, default=1.0, help='how long the builds run (in seconds)')
+    argparser.add_argument('--duration-jitter', type=float, default=0.0,
+                           help='build durations vary randomly by this fraction of the build duration')
+    argparser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of builds that fail')
+    argparser.add_argument('--latency', type=float, default=0.0,
+                           help='latency added to every API request (in seconds)')
+    argparser.add_argument('--error-rate', type=float, default=0.0,
+                           help='fraction of API requests failing with a server error')
+    argparser.add_argument('--rate-limit', type=float, help='API requests allowed per second')
+    argparser.add_argument('--seed', type=int, help='seed for the random failures')
+    args = argparser.parse_args()
+
+    copr = FakeCopr(build_duration=args.build_duration, latency=args.latency,
+                    duration_jitter=args.duration_jitter, failure_rate=args.failure_rate,
+                    error_rate=args.error_rate, rate_limit=args.rate_limit, auto_projects=True, seed=args.seed)
+    server = FakeCoprServer(copr)
+
+    # the URL is the first line of the output, statistics are available at /api_3/_stats
+    print(server.url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
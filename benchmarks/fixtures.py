@@ -0,0 +1,99 @@
+''' Synthetic git repositories and copr-builder configs for the benchmarks '''
+
+import os
+import subprocess
+
+
+SPEC = '''Name: {name}
+Version: 1.0
+Release: 1%{{?dist}}
+Summary: Synthetic package {name}
+License: MIT
+BuildArch: noarch
+
+Source0: {name}-1.0.tar.gz
+
+%description
+Synthetic package {name} for copr-builder benchmarks.
+
+%prep
+%setup -q
+
+%install
+mkdir -p %{{buildroot}}%{{_datadir}}/{name}
+cp README %{{buildroot}}%{{_datadir}}/{name}/
+
+%files
+%{{_datadir}}/{name}/README
+
+%changelog
+* Thu Jan 01 2015 Copr Builder <copr-builder@example.com> - 1.0-1
+- Initial package
+'''
+
+SECTION = '''[{section}]
+copr_user = {copr_user}
+copr_repo = {copr_repo}
+package = {name}
+git_url = {git_url}
+git_branch = main
+archive_cmd = git archive HEAD --prefix={name}-1.0/ -o {name}-1.0.tar.gz
+'''
+
+GIT_IDENTITY = ['-c', 'user.name=Benchmark', '-c', 'user.email=benchmark@example.com']
+
+
+def _git(cwd, *args):
+    subprocess.check_call(['git'] + GIT_IDENTITY + list(args), cwd=cwd, stdout=subprocess.DEVNULL)
+
+
+def make_repo(path, name, commits=1, file_size=0):
+    ''' Create git repository with a spec file for package @name at @path
+
+        @commits -- number of commits in the history
+        @file_size -- size of an additional binary file in the repository (bytes)
+    '''
+    os.makedirs(path)
+    _git(path, 'init', '-q', '-b', 'main')
+
+    with open(os.path.join(path, '%s.spec' % name), 'w', encoding='utf-8') as f:
+        f.write(SPEC.format(name=name))
+    if file_size:
+        with open(os.path.join(path, 'data.bin'), 'wb') as f:
+            f.write(os.urandom(file_size))
+
+    for i in range(commits):
+        with open(os.path.join(path, 'README'), 'w', encoding='utf-8') as f:
+            f.write('%s, commit %d\n' % (name, i))
+        _git(path, 'add', '.')
+        _git(path, 'commit', '-q', '-m', 'Commit %d' % i)
+
+
+def make_projects(directory, count, copr, copr_user='bench', projects_per_repo=1, chroots=None, **repo_args):
+    ''' Create @count projects with their git repositories in @directory and add their
+        Copr projects to @copr (FakeCopr, None if it creates the projects itself)
+
+        @projects_per_repo -- number of projects (in different Copr repositories) sharing one git repository
+
+        returns (str): path to the copr-builder config
+    '''
+    chroots = chroots or ['fedora-rawhide-x86_64']
+    sections = []
+
+    for i in range(count):
+        name = 'package%d' % (i // projects_per_repo)
+        git_url = os.path.join(directory, 'repos', name)
+        if not os.path.exists(git_url):
+            make_repo(git_url, name, **repo_args)
+
+        copr_repo = 'repo%d' % i
+        if copr is not None:
+            copr.add_project(copr_user, copr_repo, chroots)
+        sections.append(SECTION.format(section='project%d' % i, name=name, copr_user=copr_user,
+                                       copr_repo=copr_repo, git_url=git_url))
+
+    config = os.path.join(directory, 'copr-builder.conf')
+    with open(config, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(sections))
+
+    return config
@@ -0,0 +1,259 @@
+#!/usr/bin/python3
+''' Load test of the Copr submission and watch paths of copr-builder
+
+    Generates configs with thousands of projects, runs a fake Copr server
+    with configurable build durations, failure rates, latency, server errors
+    and rate limit in a separate process and submits one build of a small
+    SRPM for every project while a BuildWatcher waits for the builds, the
+    same way CoprBuilder.do_builds does. Git and rpmbuild are not involved,
+    see bench.py for the whole build.
+
+    Reported are Copr requests per build, CPU time of copr-builder per build
+    (the scheduling overhead), how late the watcher noticed finished builds
+    and peak memory.
+'''
+
+import argparse
+import concurrent.futures
+import json
+import logging
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# pylint: disable=wrong-import-position
+import copr_builder.copr_builder
+
+from copr_builder import COPR_USER_CONF, COPR_REPO_CONF
+from copr_builder.build_watcher import BuildWatcher, WatchedBuild
+from copr_builder.copr_builder import CoprBuilder
+from copr_builder.errors import CoprBuilderError
+
+from fake_copr import COPR_CONFIG
+from fixtures import make_projects
+
+
+FAKE_COPR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_copr.py')
+
+
+class FakeCoprProcess(object):
+    ''' Fake Copr server running in a separate process '''
+
+    def __init__(self, **options):
+        self.options = options
+        self.url = None
+        self._process = None
+
+    def __enter__(self):
+        command = [sys.executable, FAKE_COPR]
+        for name, value in self.options.items():
+            if value is not None:
+                command.extend(['--%s' % name.replace('_', '-'), str(value)])
+
+        self._process = subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True)
+        self.url = self._process.stdout.readline().strip()
+        if not self.url:
+            self._process.wait()
+            raise RuntimeError('Failed to start the fake Copr server')
+        return self
+
+    def __exit__(self, *args):
+        self._process.terminate()
+        self._process.wait()
+
+    def stats(self):
+        with urllib.request.urlopen(self.url + '/api_3/_stats') as response:
+            return json.load(response)
+
+    def write_config(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(COPR_CONFIG.format(url=self.url))
+
+
+def _cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def _submit(builder, watcher, section, srpm, expected_duration):
+    build = builder._do_copr_build(section, srpm)
+    watcher.add(WatchedBuild(build.id, builder.config[section][COPR_USER_CONF],
+                             builder.config[section][COPR_REPO_CONF],
+                             build.get('submitted_on') or time.time(), expected_duration, section))
+    return build.id
+
+
+def run_loadtest(sections, upload_jobs=4, min_interval=5, known_durations=False, srpm_size=65536,
+                 trace_memory=False, **copr_options):
+    ''' Submit and watch builds of @sections projects against a fresh fake Copr
+
+        returns (dict): results of the run
+    '''
+    if trace_memory:
+        tracemalloc.start()
+
+    with tempfile.TemporaryDirectory() as tmp, FakeCoprProcess(**copr_options) as copr:
+        copr_config = os.path.join(tmp, 'copr')
+        copr.write_config(copr_config)
+
+        # all projects share one repository, only the config size matters here
+        start = time.monotonic()
+        config = make_projects(tmp, sections, None, projects_per_repo=sections)
+        builder = CoprBuilder(config, copr_config, upload_jobs=upload_jobs,
+                              metrics_json=os.path.join(tmp, 'metrics.json'))
+        builder._check_projects_input(builder.config.sections())
+        config_time = time.monotonic() - start
+
+        srpm = os.path.join(tmp, 'package0-1.0-1.src.rpm')
+        with open(srpm, 'wb') as f:
+            f.write(os.urandom(srpm_size))
+
+        expected_duration = copr_options.get('build_duration') if known_durations else None
+        watcher = BuildWatcher(builder.copr.uncached, min_interval=min_interval, metrics=builder.metrics)
+        watch_thread = threading.Thread(target=watcher.watch, daemon=True)
+
+        cpu_start = _cpu_time()
+        start = time.monotonic()
+        watch_thread.start()
+
+        build_ids = {}
+        submit_errors = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=upload_jobs) as executor:
+            futures = {section: executor.submit(_submit, builder, watcher, section, srpm, expected_duration)
+                       for section in builder.config.sections()}
+            for section, future in futures.items():
+                try:
+                    build_ids[section] = future.result()
+                except CoprBuilderError:
+                    submit_errors += 1
+        submit_time = time.monotonic() - start
+
+        watcher.close()
+        watch_thread.join()
+        total = time.monotonic() - start
+        cpu = _cpu_time() - cpu_start
+
+        stats = copr.stats()
+
+    if trace_memory:
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    else:
+        traced_peak = None
+
+    # how long after the build finished in Copr the watcher noticed it
+    lags = []
+    outcomes = {}
+    for record in builder.metrics.records:
+        if record.phase != 'watch':
+            continue
+        outcomes[record.outcome] = outcomes.get(record.outcome, 0) + 1
+        build = stats['builds'][str(build_ids[record.project])]
+        lags.append(record.timestamp + record.duration - build['ended'])
+
+    builds = len(stats['builds'])
+    requests = sum(stats['requests'].values())
+    return {'sections': sections,
+            'upload_jobs': upload_jobs,
+            'builds': builds,
+            'submit_errors': submit_errors,
+            'outcomes': outcomes,
+            'config': config_time,
+            'submit': submit_time,
+            'total': total,
+            'cpu': cpu,
+            'cpu_per_build': cpu / builds if builds else 0.0,
+            'requests': requests,
+            'requests_per_build': requests / builds if builds else 0.0,
+            'requests_by_endpoint': stats['requests'],
+            'rejected': stats['rejected'],
+            'watch_lag_mean': statistics.mean(lags) if lags else 0.0,
+            'watch_lag_p95': _percentile(lags, 95),
+            'watch_lag_max': max(lags) if lags else 0.0,
+            # ru_maxrss is in KiB on Linux and it is the peak of the whole process, not only this run
+            'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            'traced_peak': traced_peak}
+
+
+def print_results(results):
+    header = ['sections', 'config', 'submit', 'total', 'req/build', 'cpu ms/b', 'lag p95', 'max rss',
+              'failed']
+    print(' '.join('%10s' % h for h in header))
+    for res in results:
+        row = ['%10d' % res['sections'], '%9.2fs' % res['config'], '%9.2fs' % res['submit'],
+               '%9.2fs' % res['total'], '%10.2f' % res['requests_per_build'],
+               '%10.2f' % (res['cpu_per_build'] * 1000), '%9.2fs' % res['watch_lag_p95'],
+               '%8.1fMi' % (res['max_rss'] / 2**20),
+               '%10d' % (res['outcomes'].get('failed', 0) + res['submit_errors'])]
+        print(' '.join(row))
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='copr-builder load test')
+    argparser.add_argument('-s', '--sections', nargs='+', type=int, default=[100, 1000],
+                           help='numbers of projects to test with (defaults to 100 1000)')
+    argparser.add_argument('--upload-jobs', type=int, default=4, help='number of parallel uploads')
+    argparser.add_argument('--build-duration', type=float, default=10.0,
+                           help='how long the fake Copr builds run (in seconds)')
+    argparser.add_argument('--duration-jitter', type=float, default=0.5,
+                           help='build durations vary randomly by this fraction of the build duration')
+    argparser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of builds that fail')
+    argparser.add_argument('--latency', type=float, default=0.0,
+                           help='latency added to every fake Copr API request (in seconds)')
+    argparser.add_argument('--error-rate', type=float, default=0.0,
+                           help='fraction of API requests failing with a server error')
+    argparser.add_argument('--rate-limit', type=float, help='API requests allowed per second')
+    argparser.add_argument('--retry-delay', type=float, default=1.0,
+                           help='delay before retrying failed Copr requests (in seconds)')
+    argparser.add_argument('--min-interval', type=float, default=5,
+                           help='minimal interval between checks of a Copr project by the watcher')
+    argparser.add_argument('--known-durations', action='store_true',
+                           help='let the watcher know how long the builds take (as with the state database)')
+    argparser.add_argument('--srpm-size', type=int, default=65536, help='size of the uploaded SRPM (in bytes)')
+    argparser.add_argument('--tracemalloc', action='store_true',
+                           help='measure peak of memory allocated by Python (slows the test down)')
+    argparser.add_argument('--seed', type=int, help='seed for the random build durations and failures')
+    argparser.add_argument('-o', '--output', help='save the results to this JSON file')
+    argparser.add_argument('-v', '--verbose', action='store_true', help='print copr-builder messages')
+    args = argparser.parse_args()
+
+    logging.basicConfig(stream=sys.stderr, format='%(name)s: %(message)s')
+    logging.getLogger('copr.builder').setLevel(logging.INFO if args.verbose else logging.ERROR)
+
+    copr_builder.copr_builder.UPLOAD_RETRY_DELAY = args.retry_delay
+
+    results = []
+    for sections in args.sections:
+        results.append(run_loadtest(sections, upload_jobs=args.upload_jobs, min_interval=args.min_interval,
+                                    known_durations=args.known_durations, srpm_size=args.srpm_size,
+                                    trace_memory=args.tracemalloc, build_duration=args.build_duration,
+                                    duration_jitter=args.duration_jitter, failure_rate=args.failure_rate,
+                                    latency=args.latency, error_rate=args.error_rate,
+                                    rate_limit=args.rate_limit, seed=args.seed))
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    return 0 if all(not r['submit_errors'] and r['builds'] == r['sections'] for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -18,7 +18,9 @@ BuildRequires: python3-pytest
 BuildRequires: python3-copr
 
 Requires: python3-copr
+Requires: python3-munch
 Requires: python3-packaging
+Requires: python3-requests
 
 %description
 A simple program for building RPM packages from Git repositories in Copr.
@@ -8,6 +8,18 @@ GIT_BRANCH_CONF = 'git_branch'
 GIT_MERGE_BRANCH_CONF = 'git_merge_branch'
 PRE_ARCHIVE_CMD_CONF = 'pre_archive_cmd'
 ARCHIVE_CMD_CONF = 'archive_cmd'
+ARCHIVE_GLOB_CONF = 'archive_glob'
+COMMAND_TIMEOUT_CONF = 'command_timeout'
+GIT_DEPTH_CONF = 'git_depth'
+GIT_FILTER_CONF = 'git_filter'
+GIT_SINGLE_BRANCH_CONF = 'git_single_branch'
+GIT_NO_TAGS_CONF = 'git_no_tags'
+BUILD_MODE_CONF = 'build_mode'
+SCM_BUILDDEPS_CONF = 'scm_builddeps'
+SCM_CHROOT_CONF = 'scm_chroot'
+CHROOT_DELTA_CONF = 'chroot_delta'
+CANCEL_OUTDATED_CONF = 'cancel_outdated'
+PRIORITY_CONF = 'priority'
 
 
 CoprBuilderVersion = namedtuple('CoprBuilderVersion', ['version', 'build', 'date', 'git_hash'])
@@ -0,0 +1,110 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from collections import namedtuple
+
+
+# states of saved builds that are trusted without asking Copr (see CoprProject._check_saved_state)
+RECORDED_STATES = ('succeeded', 'failed')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS builds (
+    project TEXT PRIMARY KEY,
+    copr_user TEXT,
+    copr_repo TEXT,
+    package TEXT,
+    git_hash TEXT,
+    version TEXT,
+    chroots TEXT,
+    build_id INTEGER,
+    state TEXT,
+    srpm_hash TEXT,
+    timings TEXT,
+    updated_on REAL
+)
+'''
+
+BuildState = namedtuple('BuildState', ['project', 'copr_user', 'copr_repo', 'package', 'git_hash', 'version',
+                                       'chroots', 'build_id', 'state', 'srpm_hash', 'timings', 'updated_on'])
+
+
+class BuildStateDB(object):
+    ''' Local SQLite database with the last known build of each project
+
+        Lets copr-builder decide that a project doesn't need a new build
+        without asking Copr for its build history. Records older than
+        @max_age seconds are considered stale and ignored.
+    '''
+
+    def __init__(self, path, max_age=None):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.max_age = max_age
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._db.execute(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def get(self, project):
+        ''' Get BuildState of @project or None if there is no current record for it '''
+        with self._lock:
+            row = self._db.execute('SELECT * FROM builds WHERE project = ?', (project,)).fetchone()
+
+        if row is None:
+            return None
+
+        state = BuildState(*row)
+        if self.max_age is not None and time.time() - state.updated_on > self.max_age:
+            return None
+
+        return state._replace(chroots=json.loads(state.chroots) if state.chroots else [],
+                              timings=json.loads(state.timings) if state.timings else {})
+
+    def timings(self, project):
+        ''' Get durations of the phases of the last build of @project, stale records included
+
+            returns (dict): phase -- duration in seconds
+        '''
+        with self._lock:
+            row = self._db.execute('SELECT timings FROM builds WHERE project = ?', (project,)).fetchone()
+
+        return json.loads(row[0]) if row and row[0] else {}
+
+    def update(self, project, **values):
+        ''' Update (or create) record of @project with @values '''
+        for key in ('chroots', 'timings'):
+            if key in values:
+                values[key] = json.dumps(values[key])
+        values['updated_on'] = time.time()
+
+        columns = ', '.join(values.keys())
+        placeholders = ', '.join('?' for _ in values)
+        updates = ', '.join('%s = excluded.%s' % (k, k) for k in values.keys())
+
+        with self._lock:
+            self._db.execute('INSERT INTO builds (project, %s) VALUES (?, %s) '
+                             'ON CONFLICT(project) DO UPDATE SET %s' % (columns, placeholders, updates),
+                             (project,) + tuple(values.values()))
+
+    def update_build(self, build_id, state, duration=None):
+        ''' Set state of the build with @build_id and save how long it took in Copr (if known) '''
+        with self._lock:
+            self._db.execute('UPDATE builds SET state = ?, updated_on = ? WHERE build_id = ?',
+                             (state, time.time(), build_id))
+            if duration is None:
+                return
+
+            for project, timings in self._db.execute('SELECT project, timings FROM builds WHERE build_id = ?',
+                                                     (build_id,)).fetchall():
+                timings = json.loads(timings) if timings else {}
+                timings['copr'] = duration
+                self._db.execute('UPDATE builds SET timings = ? WHERE project = ?', (json.dumps(timings), project))
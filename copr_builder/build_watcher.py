@@ -0,0 +1,253 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from collections import Counter, namedtuple
+
+from copr.v3 import CoprException, CoprNoResultException
+
+from .copr_cache import COPR_ERRORS, is_transient_error
+
+log = logging.getLogger("copr.builder")
+
+
+FINAL_STATES = ('skipped', 'failed', 'succeeded', 'canceled')
+
+WatchedBuild = namedtuple('WatchedBuild', ['build_id', 'ownername', 'projectname', 'submitted_on', 'expected_duration',
+                                           'project'])
+# name of the project (config section) is not known for builds saved by older versions
+WatchedBuild.__new__.__defaults__ = (None,)
+
+
+class BuildWatcher(object):
+    ''' Wait for Copr builds to finish
+
+        Builds are checked with one paginated build list request per Copr
+        project instead of one request per build. Projects are polled less
+        often the longer their builds run, builds with known duration of the
+        previous build are not polled much before they are expected to finish.
+    '''
+
+    def __init__(self, copr_client, min_interval=5, max_interval=300, page_size=50, state_db=None, metrics=None):
+        self.copr_client = copr_client
+        self.state_db = state_db
+        self.metrics = metrics
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.page_size = page_size
+
+        self.builds = {}
+
+        # outdated builds canceled by us as (build ID, project) tuples
+        self.canceled = []
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = threading.Event()
+
+    def add(self, build):
+        ''' Add a WatchedBuild to watch '''
+        with self._lock:
+            self.builds[build.build_id] = build
+        self._wakeup.set()
+
+    def add_canceled(self, build_id, project):
+        ''' Report outdated build with @build_id of @project canceled in favour of a watched build '''
+        with self._lock:
+            self.canceled.append((build_id, project))
+
+    def save(self, watch_file):
+        ''' Save builds that are still being watched to @watch_file so the watch can be
+            resumed later, builds already saved in the file are kept
+        '''
+        builds = {b.build_id: b for b in self.load(watch_file)}
+        with self._lock:
+            builds.update(self.builds)
+
+        watch_dir = os.path.dirname(os.path.abspath(watch_file))
+        os.makedirs(watch_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=watch_dir, delete=False, encoding='utf-8') as f:
+            json.dump([b._asdict() for b in builds.values()], f)
+        os.replace(f.name, watch_file)
+
+        log.info('%d build(s) saved to %s, use "--watch" to resume watching them.', len(builds), watch_file)
+
+    @staticmethod
+    def load(watch_file):
+        ''' Load builds saved by BuildWatcher.save from @watch_file '''
+        if not os.path.exists(watch_file):
+            return []
+
+        with open(watch_file, 'r', encoding='utf-8') as f:
+            return [WatchedBuild(**b) for b in json.load(f)]
+
+    def _interval(self, builds, now):
+        ''' How long to wait before checking @builds again '''
+        intervals = []
+        for build in builds:
+            age = now - build.submitted_on
+            if build.expected_duration and age < build.expected_duration:
+                # previous build took this long, no need to check much sooner
+                interval = (build.expected_duration - age) / 2
+            else:
+                interval = age / 10
+            intervals.append(interval)
+
+        return min(self.max_interval, max(self.min_interval, min(intervals)))
+
+    def _get_builds(self, ownername, projectname, build_ids):
+        ''' Get builds with @build_ids from the Copr project, newest builds first
+
+            returns (dict): build ID -- build, None for builds deleted from Copr, builds
+                            that couldn't be checked are missing
+        '''
+        found = {}
+        oldest = min(build_ids)
+        offset = 0
+
+        while True:
+            pagination = {'order': 'id', 'order_type': 'DESC', 'limit': self.page_size, 'offset': offset}
+            page = self.copr_client.build_proxy.get_list(ownername=ownername, projectname=projectname,
+                                                         pagination=pagination)
+            for build in page:
+                if build.id in build_ids:
+                    found[build.id] = build
+
+            if len(page) < self.page_size or page[-1].id <= oldest or len(found) == len(build_ids):
+                break
+            offset += self.page_size
+
+        # builds not found in the list for some reason, ask for them one by one
+        for build_id in build_ids:
+            if build_id in found:
+                continue
+            try:
+                found[build_id] = self.copr_client.build_proxy.get(build_id)
+            except CoprNoResultException:
+                found[build_id] = None
+            except COPR_ERRORS + (CoprException,) as e:
+                # check it again later
+                log.warning('Failed to check build %s: %s', build_id, str(e))
+
+        return found
+
+    def _print_chroot_states(self, build):
+        # pylint: disable=no-member
+        chroots = sorted(build.chroots)
+        for chroot in chroots:
+            try:
+                task = self.copr_client.build_chroot_proxy.get(build_id=build.id, chrootname=chroot)
+            except COPR_ERRORS as e:
+                log.warning('\tFailed to get state of chroot %s: %s', chroot, str(e))
+                continue
+            log.info('\tChroot %s finished: %s', task.name, task.state)
+
+    def close(self):
+        ''' No more builds will be added, watch returns when all builds finish '''
+        self._closed.set()
+        self._wakeup.set()
+
+    def _group(self, group):
+        with self._lock:
+            return [b for b in self.builds.values() if (b.ownername, b.projectname) == group]
+
+    def watch(self):
+        ''' Wait until all builds finish
+
+            New builds can be added from other threads while watching, the watch
+            ends only after close was called.
+
+            returns (bool): False if some of the builds failed
+        '''
+        success = True
+        finished = Counter()
+
+        # next check of each Copr project, builds added before the watch started are checked right away
+        with self._lock:
+            next_check = {(b.ownername, b.projectname): 0 for b in self.builds.values()}
+
+        while True:
+            now = time.time()
+
+            with self._lock:
+                if not self.builds and self._closed.is_set():
+                    break
+
+                for build in self.builds.values():
+                    group = (build.ownername, build.projectname)
+                    if group not in next_check:
+                        next_check[group] = now + self._interval([build], now)
+
+            wait = min(next_check.values()) - now if next_check else self.max_interval
+            if wait > 0:
+                # wake up sooner if new builds are added
+                self._wakeup.wait(wait)
+                self._wakeup.clear()
+                continue
+
+            for group, check in list(next_check.items()):
+                if check > now:
+                    continue
+
+                build_ids = [b.build_id for b in self._group(group)]
+                try:
+                    builds = self._get_builds(group[0], group[1], build_ids)
+                except COPR_ERRORS as e:
+                    if not is_transient_error(e):
+                        raise
+                    # Copr is overloaded or unavailable, check the builds later
+                    log.warning('Failed to check builds in %s/%s: %s', group[0], group[1], str(e))
+                    builds = {}
+
+                # pylint: disable=no-member
+                for build_id, build in builds.items():
+                    if build is None:
+                        # nothing to wait for, but the build didn't succeed either
+                        log.warning('Build %s was not found in Copr, it was probably deleted.', build_id)
+                        state = 'deleted'
+                        success = False
+                    elif build.state not in FINAL_STATES:
+                        continue
+                    else:
+                        log.info('Build of %s-%s (ID: %s) finished: %s',
+                                 build.source_package['name'], build.source_package['version'],
+                                 build.id, build.state)
+                        state = build.state
+                        if build.state == 'failed':
+                            success = False
+                            self._print_chroot_states(build)
+                        if self.state_db is not None:
+                            duration = None
+                            if build.get('started_on') and build.get('ended_on'):
+                                duration = build.ended_on - build.started_on
+                            self.state_db.update_build(build.id, build.state, duration)
+
+                    finished[state] += 1
+                    with self._lock:
+                        watched = self.builds.pop(build_id)
+                    if self.metrics is not None:
+                        self.metrics.record(watched.project or '%s/%s' % group, 'watch',
+                                            time.time() - watched.submitted_on, state,
+                                            timestamp=watched.submitted_on)
+
+                remaining = self._group(group)
+                if remaining:
+                    next_check[group] = now + self._interval(remaining, now)
+                else:
+                    del next_check[group]
+
+        self._log_summary(finished)
+
+        return success
+
+    def _log_summary(self, finished):
+        if finished:
+            log.info('Finished builds: %s.', ', '.join('%d %s' % (count, state)
+                                                       for state, count in sorted(finished.items())))
+        with self._lock:
+            canceled = list(self.canceled)
+        if canceled:
+            log.info('Canceled outdated builds: %s.', ', '.join('%s (%s)' % c for c in canceled))
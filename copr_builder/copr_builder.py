@@ -1,35 +1,169 @@
+import concurrent.futures
+import contextlib
 import datetime
+import heapq
 import logging
 import os
+import statistics
+import threading
 import time
 
 import configparser
 
-from copr.v3 import Client, CoprNoResultException, CoprRequestException
+from copr.v3 import Client, CoprException, CoprNoResultException
 
-from . import COPR_USER_CONF, COPR_REPO_CONF
-from .errors import CoprBuilderError, CoprBuilderAlreadyFailed
-from .copr_project import CoprProject
+from . import COPR_USER_CONF, COPR_REPO_CONF, PRIORITY_CONF
+from .build_state import BuildStateDB
+from .build_watcher import BuildWatcher, WatchedBuild
+from .errors import CoprBuilderError, CoprBuilderAlreadyFailed, CoprBuilderVersionUnknown
+from .copr_cache import COPR_ERRORS, CachedCoprClient, is_transient_error, retry_after
+from .copr_project import CoprProject, UrlSource
+from .git_cache import GitMirrorCache
+from .metrics import Metrics
+from .scm_build import SCRIPT_RESULTDIR, ScmSource
+from .srpm_cache import SRPMCache
+from .workspace import Workspace
+from .utils import buffered_log
 
 
 BUILD_URL_TEMPLATE = "%s/coprs/%s/%s/build/%s"
 COPR_CONFIG = os.path.expanduser('~/.config/copr')
+WATCH_FILE = os.path.expanduser('~/.cache/copr-builder/builds.json')
+
+
+# how many times to try Copr requests (e.g. uploading an SRPM) failing with transient errors
+# and how long to wait (doubled with every attempt)
+UPLOAD_ATTEMPTS = 4
+UPLOAD_RETRY_DELAY = 5
+
+# tolerated difference between our clock and the clock of the Copr server when looking
+# for builds created by failed requests
+CLOCK_SKEW = 60
+
+# how long to wait for Copr to publish an uploaded SRPM so it can be built in other projects
+# and how often to check it
+SRPM_URL_TIMEOUT = 300
+SRPM_URL_INTERVAL = 5
+
+# phases of the local work on a project saved in the state database (see CoprProject.timings)
+LOCAL_PHASES = ('prepare', 'archive', 'srpm')
 
 
 log = logging.getLogger("copr.builder")
 
 
+class _SharedSRPM(object):
+    ''' SRPM built in more Copr projects, uploaded only for the first one
+
+        The other projects are built from the SRPM Copr publishes for the
+        first build.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.uploaded = threading.Event()
+        self.build_id = None
+        self.url = None
+
+        # when to give up waiting for Copr to publish the SRPM and when it was checked last time
+        self.deadline = None
+        self.checked_on = None
+
+        self._claimed = False
+
+    def claim(self):
+        ''' Whether the caller is the first one and should upload the SRPM '''
+        with self.lock:
+            claimed = self._claimed
+            self._claimed = True
+        return not claimed
+
+
+class _SRPMNotPublished(Exception):
+    ''' SRPM uploaded for another project is not published by Copr yet '''
+
+
+class _SubmitQueue(object):
+    ''' Projects with SRPMs ready for submission, the project with the lowest key goes first
+
+        Projects waiting for an SRPM uploaded for another project (see _SharedSRPM)
+        are deferred and put back to the queue after SRPM_URL_INTERVAL seconds so
+        they don't block the upload jobs.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heap = []
+        self._deferred = []
+
+    def push(self, key, item):
+        with self._lock:
+            heapq.heappush(self._heap, (key, item))
+
+    def pop(self):
+        with self._lock:
+            return heapq.heappop(self._heap)
+
+    def defer(self, key, item):
+        with self._lock:
+            self._deferred.append((time.monotonic() + SRPM_URL_INTERVAL, key, item))
+
+    def requeue(self):
+        ''' Put deferred projects due for another try back to the queue
+
+            returns (tuple): number of projects put back and seconds until the next
+                             deferred project is due (None if there are no deferred projects)
+        '''
+        now = time.monotonic()
+        with self._lock:
+            due = [d for d in self._deferred if d[0] <= now]
+            self._deferred = [d for d in self._deferred if d[0] > now]
+            for _due, key, item in due:
+                heapq.heappush(self._heap, (key, item))
+            wait = max(0, min(d[0] for d in self._deferred) - now) if self._deferred else None
+
+        return len(due), wait
+
+
 class CoprBuilder(object):
 
-    def __init__(self, conf_file, copr_config=None):
+    def __init__(self, conf_file, copr_config=None, jobs=1, upload_jobs=1, cache_dir=None, copr_cache=None, copr_cache_ttl=None,
+                 state_db=None, state_max_age=None, srpm_cache=None, srpm_cache_size=None, metrics_json=None,
+                 metrics_textfile=None):
 
         self.config = configparser.ConfigParser()
-        self.config.read(conf_file)
+        if conf_file:
+            self.config.read(conf_file)
 
         self.copr_config = copr_config or COPR_CONFIG
 
+        if jobs < 1 or upload_jobs < 1:
+            raise CoprBuilderError('Number of jobs must be a positive number.')
+        self.jobs = jobs
+        self.upload_jobs = upload_jobs
+
+        # persistent cache of git mirrors, repositories are cloned from scratch without it
+        self.git_cache = GitMirrorCache(cache_dir) if cache_dir else None
+
+        # SRPMs generated by previous runs, SRPMs are always generated without it
+        self.srpm_cache = SRPMCache(srpm_cache, srpm_cache_size) if srpm_cache else None
+
+        # local database with the last builds, builds are always checked in Copr without it
+        self.state_db = BuildStateDB(state_db, max_age=state_max_age) if state_db else None
+
+        # duration, size and outcome of the build phases, saved to @metrics_json and @metrics_textfile
+        self.metrics_json = metrics_json
+        self.metrics_textfile = metrics_textfile
+        self.metrics = Metrics() if metrics_json or metrics_textfile else None
+
         self._check_copr_token()
-        self.copr = Client.create_from_config_file(path=self.copr_config)
+        # projects and build lists are cached for the whole run, @copr_cache allows
+        # reusing them in the next runs (for @copr_cache_ttl seconds)
+        self.copr = CachedCoprClient(Client.create_from_config_file(path=self.copr_config),
+                                     cache_file=copr_cache, ttl=copr_cache_ttl)
+
+        # IDs of the builds created by us
+        self._created_builds = set()
 
     def _check_copr_token(self):
         if not os.path.isfile(self.copr_config):
@@ -59,7 +193,24 @@ class CoprBuilder(object):
         if wrong:
             raise CoprBuilderError('Requested project(s) %s not found in config.' % wrong)
 
-    def do_builds(self, projects):
+    def do_builds(self, projects, watch_file=None, workspace=None, watcher=None, done=None):
+        ''' Build SRPMs for @projects (all projects from config if not set), start the Copr
+            builds and wait for them to finish
+
+            Build of each project is started as soon as its SRPM is ready and builds are
+            watched while SRPMs for other projects are still being generated. Projects are
+            processed in the order given by _schedule.
+
+            If @watch_file is set, don't wait for the builds and save them to the file
+            instead, watching them can be resumed later using watch.
+
+            A @workspace and a running @watcher can be reused between calls, builds
+            are only added to the @watcher and this doesn't wait for them.
+
+            Projects with a submitted build or found up to date are added to @done (set).
+
+            returns (bool): True if all builds were successful
+        '''
         srpms = {}
         success = True
 
@@ -68,44 +219,232 @@ class CoprBuilder(object):
         else:
             projects = self.config.sections()
 
-        copr_projects = []
+        copr_projects = {}
+        shared_srpms = {}
+
+        projects, durations = self._schedule(projects)
+        order = {project: idx for idx, project in enumerate(projects)}
+
+        # SRPMs ready for upload, the next free upload job takes the project with the highest
+        # priority and the longest Copr build
+        queue = _SubmitQueue()
+
+        # projects with the same git repository share one clone and may share SRPMs
+        if workspace is None:
+            workspace = Workspace(self.git_cache)
+
+        own_watcher = watcher is None
+        if own_watcher:
+            watcher = BuildWatcher(self.copr.uncached, state_db=self.state_db, metrics=self.metrics)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as watch_executor, \
+             concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as srpm_executor, \
+             concurrent.futures.ThreadPoolExecutor(max_workers=self.upload_jobs) as build_executor:
+
+            watch_future = watch_executor.submit(watcher.watch) if own_watcher and not watch_file else None
 
-        # generate srpms for projects in config
-        for project in projects:
-            try:
-                p = CoprProject(self.config[project], self.copr)
-                # XXX: save reference to the CoprProject instance to avoid
-                # automatic deletion of tempdir with the SRPM
-                copr_projects.append(p)
-                srpm = p.build_srpm()
-                if srpm:
-                    srpms[project] = srpm
-            # previous build with the same srpm already failed, so do not try to
-            # run the build again a just fail
-            except CoprBuilderAlreadyFailed:
-                success = False
-            except CoprBuilderError as e:
-                log.error('Failed to create SRPM for %s:\n%s', project, str(e))
-                success = False
-
-        # for all generated srpms run the copr build
-        build_ids = []
-        for project in srpms.keys():
             try:
-                build_id = self._do_copr_build(project, srpms[project])
-                build_ids.append(build_id)
-            except CoprBuilderError as e:
-                log.error('Failed to start Copr build for %s:\n%s', project, str(e))
-                success = False
+                # generate srpms for projects in config, up to self.jobs projects at once
+                srpm_futures = {srpm_executor.submit(self._build_srpm, project, workspace): project
+                                for project in projects}
+                build_futures = []
+
+                for future in concurrent.futures.as_completed(srpm_futures):
+                    project = srpm_futures[future]
+                    try:
+                        p, srpm = future.result()
+                    # previous build with the same srpm already failed, so do not try to
+                    # run the build again a just fail
+                    except CoprBuilderAlreadyFailed:
+                        success = False
+                        if done is not None:
+                            done.add(project)
+                        continue
+                    # the last build is still being imported, it will be checked next time
+                    except CoprBuilderVersionUnknown:
+                        continue
+                    except CoprBuilderError as e:
+                        log.error('Failed to create SRPM for %s:\n%s', project, str(e))
+                        success = False
+                        continue
+
+                    # XXX: save reference to the CoprProject instance to avoid
+                    # automatic deletion of tempdir with the SRPM
+                    copr_projects[project] = p
+
+                    if not srpm and done is not None:
+                        done.add(project)
+
+                    # run the copr build right away
+                    if srpm:
+                        shared = None
+                        if isinstance(srpm, str):
+                            srpms[project] = srpm
+                            # projects with the same SRPM (see Workspace.srpm) upload it only once
+                            shared = shared_srpms.setdefault(srpm, _SharedSRPM())
+                        key = (-self._priority(project), -durations[project][1], order[project])
+                        queue.push(key, (project, srpm, p, shared))
+                        build_futures.append(build_executor.submit(self._start_next, queue, watcher))
+
+                    build_futures.extend(self._requeue(queue, build_executor, watcher)[0])
+
+                while True:
+                    requeued, wait = self._requeue(queue, build_executor, watcher)
+                    build_futures.extend(requeued)
+                    if not build_futures:
+                        if wait is None:
+                            break
+                        # only deferred projects are left
+                        time.sleep(wait)
+                        continue
+
+                    finished, build_futures = concurrent.futures.wait(build_futures, timeout=wait,
+                                                                      return_when=concurrent.futures.FIRST_COMPLETED)
+                    build_futures = list(build_futures)
+                    for future in finished:
+                        project, error = future.result()
+                        if error is not None:
+                            log.error('Failed to start Copr build for %s:\n%s', project, str(error))
+                            success = False
+                        elif project is not None and done is not None:
+                            done.add(project)
+            finally:
+                if own_watcher:
+                    watcher.close()
+
+            # now remove the srpms, we no longer need them (SRPMs from the SRPM
+            # cache are only copies) some projects may actually share the same
+            # srpm, so it could be already deleted
+            for srpm in srpms.values():
+                if os.path.exists(srpm):
+                    os.remove(srpm)
+
+            self.copr.save()
+
+            if own_watcher and watch_file:
+                watcher.save(watch_file)
+            elif own_watcher:
+                success = watch_future.result() and success
+
+        self.write_metrics()
 
-        # now remove the srpms, we no longer need them
-        # some projects may actually share the same srpm, so it could be
-        # already deleted
-        for srpm in srpms.values():
-            if os.path.exists(srpm):
-                os.remove(srpm)
+        return success
 
-        return self._watch_builds(build_ids) and success
+    def write_metrics(self):
+        if self.metrics_json:
+            self.metrics.write_json(self.metrics_json)
+        if self.metrics_textfile:
+            self.metrics.write_textfile(self.metrics_textfile)
+
+    def _priority(self, project):
+        try:
+            return int(self.config[project].get(PRIORITY_CONF, 0))
+        except ValueError:
+            # reported as a configuration error when building the project
+            return 0
+
+    def _expected_durations(self, projects):
+        ''' Get expected durations of the local work and of the Copr build of @projects
+
+            Durations of the last build saved in the state database are used, projects
+            without them are expected to take as long as the other projects on average.
+
+            returns (dict): project -- (local work, Copr build) duration in seconds
+        '''
+        local = {}
+        copr = {}
+        for project in projects:
+            timings = self.state_db.timings(project) if self.state_db is not None else {}
+            if any(phase in timings for phase in LOCAL_PHASES):
+                local[project] = sum(timings.get(phase, 0) for phase in LOCAL_PHASES)
+            if timings.get('copr'):
+                copr[project] = timings['copr']
+
+        local_mean = statistics.mean(local.values()) if local else 0
+        copr_mean = statistics.mean(copr.values()) if copr else 0
+
+        return {project: (local.get(project, local_mean), copr.get(project, copr_mean)) for project in projects}
+
+    def _schedule(self, projects):
+        ''' Order @projects so that all their builds finish as soon as possible
+
+            Projects with a higher priority go first, then the projects taking the longest
+            (local work and Copr build together), so they don't delay the end of the run by
+            starting last. Without history (see _expected_durations) the order from the
+            config is kept.
+
+            returns (tuple): ordered @projects and their expected durations
+        '''
+        durations = self._expected_durations(projects)
+        projects = sorted(projects, key=lambda p: (-self._priority(p), -sum(durations[p])))
+
+        return projects, durations
+
+    def _requeue(self, queue, executor, watcher):
+        ''' Start deferred projects from @queue (_SubmitQueue) due for another try in @executor
+
+            returns (tuple): list of the new futures and seconds until the next deferred project is due
+        '''
+        count, wait = queue.requeue()
+        return [executor.submit(self._start_next, queue, watcher) for _i in range(count)], wait
+
+    def _start_next(self, queue, watcher):
+        ''' Start Copr build of the first project from @queue (_SubmitQueue)
+
+            returns (tuple): the project (None if it was deferred) and CoprBuilderError
+                             if starting the build failed
+        '''
+        key, item = queue.pop()
+        project, srpm, copr_project, shared = item
+
+        try:
+            self._start_build(project, srpm, copr_project, watcher, shared)
+        except _SRPMNotPublished:
+            log.debug('SRPM for %s is not published by Copr yet, trying again later.', project)
+            queue.defer(key, item)
+            return None, None
+        except CoprBuilderError as e:
+            return project, e
+
+        return project, None
+
+    def _start_build(self, project, srpm, copr_project, watcher, shared=None):
+        ''' Start Copr build of @project from @srpm and add it to @watcher '''
+        build = self._do_copr_build(project, srpm, shared)
+        copr_project.save_state(build_id=build.id, state=build.get('state') or 'pending')
+        watcher.add(WatchedBuild(build.id, self.config[project][COPR_USER_CONF],
+                                 self.config[project][COPR_REPO_CONF],
+                                 build.get('submitted_on') or time.time(),
+                                 copr_project.last_build_duration, project))
+
+        # the new build replaces unfinished builds of older commits
+        for build_id in copr_project.outdated_builds():
+            self._cancel_build(project, build_id, watcher)
+
+    def _cancel_build(self, project, build_id, watcher):
+        try:
+            self._copr_request('cancel build %s' % build_id, self.copr.build_proxy.cancel, build_id=build_id)
+        except COPR_ERRORS + (CoprException,) as e:
+            # the build may have finished or been deleted in the meantime or it was
+            # submitted by another member of a group project we can't cancel
+            log.warning('Failed to cancel outdated build %s of %s: %s', build_id, project, str(e))
+            return
+
+        log.info('Canceled outdated build %s of %s.', build_id, project)
+        watcher.add_canceled(build_id, project)
+
+    def _build_srpm(self, project, workspace):
+        ''' Create the CoprProject for @project and build its SRPM
+
+            returns (tuple): the CoprProject instance and path to the SRPM
+                             (or None if there is nothing new to build)
+        '''
+        # keep messages from one project together when running in parallel
+        with buffered_log(log) if self.jobs > 1 else contextlib.nullcontext():
+            p = CoprProject(self.config[project], self.copr, workspace=workspace, state_db=self.state_db,
+                            srpm_cache=self.srpm_cache,
+                            metrics=self.metrics.project(project) if self.metrics else None)
+            return (p, p.build_srpm())
 
     def _get_copr_url(self, copr_user, copr_repo, build_id):
         if copr_user.startswith('@'):
@@ -114,52 +453,217 @@ class CoprBuilder(object):
         else:
             return BUILD_URL_TEMPLATE % (self.copr.config['copr_url'], copr_user, copr_repo, build_id)
 
-    def _do_copr_build(self, project, srpm):
+    def _shared_srpm_url(self, shared):
+        ''' Get URL of the SRPM uploaded for the first build of @shared (_SharedSRPM)
+
+            Doesn't wait for Copr to publish the SRPM, _SRPMNotPublished is raised
+            when it isn't published yet.
+
+            returns (str): the URL or None if Copr didn't publish the SRPM
+        '''
+        with shared.lock:
+            if not shared.uploaded.is_set():
+                raise _SRPMNotPublished
+            if shared.url is not None or shared.build_id is None or shared.deadline is None:
+                return shared.url
+
+            now = time.monotonic()
+            if shared.checked_on is not None and now - shared.checked_on < SRPM_URL_INTERVAL:
+                raise _SRPMNotPublished
+            shared.checked_on = now
+
+            # Copr publishes the SRPM after importing it
+            try:
+                build = self.copr.uncached.build_proxy.get(shared.build_id)
+            except COPR_ERRORS + (CoprException,) as e:
+                log.warning('Failed to get SRPM of build %s: %s', shared.build_id, str(e))
+                build = {}
+
+            shared.url = (build.get('source_package') or {}).get('url')
+            if shared.url is None and build.get('state') not in ('failed', 'canceled', 'skipped') and \
+               now < shared.deadline and build:
+                raise _SRPMNotPublished
+
+            if shared.url is None:
+                log.debug('SRPM of build %s not available, uploading it again.', shared.build_id)
+                # don't ask again for the other projects
+                shared.deadline = None
+            return shared.url
+
+    def _do_copr_build(self, project, srpm, shared=None):
         copr_user = self.config[project][COPR_USER_CONF]
         copr_repo = self.config[project][COPR_REPO_CONF]
 
         # get the project to extract project id
         try:
-            self.copr.project_proxy.get(ownername=copr_user, projectname=copr_repo)
+            self._copr_request('get project %s/%s' % (copr_user, copr_repo), self.copr.project_proxy.get,
+                               ownername=copr_user, projectname=copr_repo)
         except CoprNoResultException as e:
             raise CoprBuilderError('Copr project %s/%s not found' % (copr_user, copr_repo)) from e
+        except COPR_ERRORS as e:
+            raise CoprBuilderError('Failed to get Copr project %s/%s' % (copr_user, copr_repo)) from e
+
+        # SRPM already uploaded for another project, build it from Copr
+        if shared is not None and not shared.claim():
+            url = self._shared_srpm_url(shared)
+            if url is not None:
+                log.info('Using SRPM %s uploaded for build %s.', url, shared.build_id)
+                srpm = UrlSource(url, None)
+            shared = None
+
+        if isinstance(srpm, ScmSource):
+            # nothing to upload, Copr builds the SRPM itself
+            with self.metrics.phase(project, 'submit') if self.metrics else contextlib.nullcontext():
+                build = self._submit_script(copr_user, copr_repo, srpm)
+            what = '%s (commit %s)' % (project, srpm.commit)
+        elif isinstance(srpm, UrlSource):
+            with self.metrics.phase(project, 'submit') if self.metrics else contextlib.nullcontext():
+                build = self._submit_url(copr_user, copr_repo, srpm)
+            what = srpm.url
+        else:
+            build = None
+            try:
+                if self.metrics is None:
+                    build = self._upload_srpm(copr_user, copr_repo, srpm)
+                else:
+                    with self.metrics.phase(project, 'upload') as measured:
+                        build = self._upload_srpm(copr_user, copr_repo, srpm)
+                        measured['bytes'] = os.path.getsize(srpm)
+            finally:
+                # let the other projects with the same SRPM continue even if the upload failed
+                if shared is not None:
+                    shared.build_id = build.id if build is not None else None
+                    shared.deadline = time.monotonic() + SRPM_URL_TIMEOUT
+                    shared.uploaded.set()
+            what = srpm
 
+        # pylint: disable=no-member
+        self._created_builds.add(build.id)
+        log.info('Started Copr build of %s (ID: %s)', what, build.id)
+        log.info('Build URL: %s', self._get_copr_url(copr_user, copr_repo, build.id))
+
+        return build
+
+    def _copr_request(self, description, method, created=None, **kwargs):
+        ''' Call @method of the Copr client with @kwargs, retry on transient errors
+
+            @created -- for requests creating a build, called before trying again, returns
+                        the build if the failed attempt created it anyway (or None)
+        '''
+        attempt = 1
+        while True:
+            try:
+                return method(**kwargs)
+            except COPR_ERRORS as e:
+                if not is_transient_error(e) or attempt == UPLOAD_ATTEMPTS:
+                    raise
+                error = e
+
+            delay = max(UPLOAD_RETRY_DELAY * 2 ** (attempt - 1), retry_after(error))
+            log.warning('Failed to %s (attempt %d of %d): %s. Trying again in %d seconds.',
+                        description, attempt, UPLOAD_ATTEMPTS, str(error), delay)
+            time.sleep(delay)
+            attempt += 1
+
+            # the server may have created the build and failed only to reply, requests
+            # over the rate limit are not processed at all
+            response = getattr(error, 'result', {}).get('__response__')
+            if created is not None and (response is None or response.status_code != 429):
+                build = created()
+                if build is not None:
+                    log.warning('Build %s was created by the failed attempt to %s.', build.id, description)
+                    return build
+
+    def _created_build(self, copr_user, copr_repo, srpm_name, since):
+        ''' Find a build of SRPM @srpm_name (file name) submitted to the Copr project after
+            @since (seconds since the epoch) that wasn't created by us
+
+            Copr knows the SRPM of a build only after importing it, builds that are not
+            imported yet are not accepted, building the SRPM twice is better than not at all.
+
+            returns (Munch): the build or None if there is no such build
+        '''
+        pagination = {'order': 'id', 'order_type': 'DESC', 'limit': 10}
         try:
-            build = self.copr.build_proxy.create_from_file(ownername=copr_user,
-                                                           projectname=copr_repo,
-                                                           path=srpm)
-        except CoprRequestException as e:
+            builds = self.copr.uncached.build_proxy.get_list(ownername=copr_user, projectname=copr_repo,
+                                                             pagination=pagination)
+        except COPR_ERRORS + (CoprException,) as e:
+            log.warning('Failed to check builds in %s/%s: %s', copr_user, copr_repo, str(e))
+            return None
+
+        for build in builds:
+            if (build.get('submitted_on') or 0) < since or build.id in self._created_builds:
+                continue
+            url = (build.get('source_package') or {}).get('url')
+            if url is not None and os.path.basename(url) == srpm_name:
+                return build
+
+        return None
+
+    def _creating(self, copr_user, copr_repo, srpm):
+        ''' Get the @created function for _copr_request creating a build of @srpm (path or URL) '''
+        since = time.time() - CLOCK_SKEW
+        srpm_name = os.path.basename(srpm)
+        return lambda: self._created_build(copr_user, copr_repo, srpm_name, since)
+
+    def _upload_srpm(self, copr_user, copr_repo, srpm):
+        ''' Upload @srpm and create a new build from it, retry on transient errors '''
+        size = os.path.getsize(srpm)
+
+        start = time.monotonic()
+        try:
+            build = self._copr_request('upload %s' % srpm, self.copr.build_proxy.create_from_file,
+                                       created=self._creating(copr_user, copr_repo, srpm),
+                                       ownername=copr_user, projectname=copr_repo, path=srpm)
+        except COPR_ERRORS as e:
             raise CoprBuilderError('Failed to create build') from e
 
-        # pylint: disable=no-member
-        log.info('Started Copr build of %s (ID: %s)', srpm, build.id)
-        log.info('Build URL: %s', self._get_copr_url(copr_user, copr_repo, build.id))
+        elapsed = time.monotonic() - start
+        log.debug('Uploaded %s (%.1f MiB) in %.1f s (%.2f MiB/s)', srpm, size / 2**20, elapsed,
+                  size / 2**20 / elapsed if elapsed else 0)
 
-        return build.id
+        return build
 
-    def _print_chroot_states(self, build):
-        # pylint: disable=no-member
-        chroots = sorted(build.chroots)
-        for chroot in chroots:
-            task = self.copr.build_chroot_proxy.get(build_id=build.id, chrootname=chroot)
-            log.info('\tChroot %s finished: %s', task.name, task.state)
+    def _submit_script(self, copr_user, copr_repo, source):
+        ''' Create a new build running @source (ScmSource) in Copr, retry on transient errors
 
-    def _watch_builds(self, build_ids):
-        success = True
+            Name of the SRPM is not known before Copr builds it, so a build created by
+            a failed request can't be recognized and it may be submitted twice.
+        '''
+        try:
+            return self._copr_request('submit build of commit %s' % source.commit,
+                                      self.copr.build_proxy.create_from_custom,
+                                      ownername=copr_user, projectname=copr_repo, script=source.script,
+                                      script_chroot=source.chroot, script_builddeps=' '.join(source.builddeps),
+                                      script_resultdir=SCRIPT_RESULTDIR)
+        except COPR_ERRORS as e:
+            raise CoprBuilderError('Failed to create build') from e
 
-        # pylint: disable=no-member
-        while build_ids:
-            for build_id in build_ids:
-                build = self.copr.build_proxy.get(build_id)
-                if build.state in ('skipped', 'failed', 'succeeded', 'canceled'):
-                    log.info('Build of %s-%s (ID: %s) finished: %s',
-                             build.source_package['name'], build.source_package['version'],
-                             build.id, build.state)
-                    if build.state == 'failed':
-                        success = False
-                        self._print_chroot_states(build)
-                    build_ids.remove(build_id)
+    def _submit_url(self, copr_user, copr_repo, source):
+        ''' Create a new build from SRPM at the URL of @source (UrlSource), retry on transient errors '''
+        buildopts = {'chroots': source.chroots} if source.chroots else None
+        try:
+            return self._copr_request('submit build of %s' % source.url, self.copr.build_proxy.create_from_url,
+                                      created=self._creating(copr_user, copr_repo, source.url),
+                                      ownername=copr_user, projectname=copr_repo, url=source.url,
+                                      buildopts=buildopts)
+        except COPR_ERRORS as e:
+            raise CoprBuilderError('Failed to create build') from e
 
-            time.sleep(0.5)
+    def watch(self, watch_file):
+        ''' Resume watching builds saved to @watch_file by a detached do_builds '''
+        builds = BuildWatcher.load(watch_file)
+        if not builds:
+            log.info('No builds to watch found in %s.', watch_file)
+            return True
+
+        watcher = BuildWatcher(self.copr.uncached, state_db=self.state_db, metrics=self.metrics)
+        for build in builds:
+            watcher.add(build)
+        watcher.close()
+
+        success = watcher.watch()
+        os.remove(watch_file)
+        self.write_metrics()
 
         return success
@@ -0,0 +1,209 @@
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+
+import requests
+
+from copr.v3 import CoprRequestException
+from copr.v3.exceptions import CoprTimeoutException
+from copr.v3.helpers import List
+from munch import Munch
+
+log = logging.getLogger("copr.builder")
+
+
+# proxy methods with cached results, all other proxy methods are passed to the client
+CACHED_METHODS = {'project_proxy': ('get',),
+                  'build_proxy': ('get_list',)}
+
+# prefixes of proxy methods changing projects or builds, calling them drops cached results of the proxy
+MODIFYING_METHODS = ('add', 'cancel', 'create', 'delete', 'edit', 'fork', 'regenerate')
+
+# errors of failed Copr requests
+COPR_ERRORS = (CoprRequestException, CoprTimeoutException, requests.exceptions.RequestException)
+
+
+def is_transient_error(error):
+    ''' Whether a Copr request failed because of an error that may go away when trying again '''
+    if isinstance(error, (CoprTimeoutException, requests.exceptions.RequestException)):
+        return True
+
+    # connection failures have no response, server errors have status code 5xx
+    # and requests over the rate limit 429
+    response = error.result.get('__response__')
+    return response is None or response.status_code >= 500 or response.status_code == 429
+
+
+def retry_after(error):
+    ''' How long the server asked us to wait before trying again (0 if it didn't) '''
+    response = getattr(error, 'result', {}).get('__response__')
+    try:
+        return max(0, int(response.headers.get('Retry-After', 0)))
+    except (AttributeError, ValueError):
+        return 0
+
+
+def _freeze(value):
+    ''' Convert @value to something usable as a dictionary key '''
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _strip_response(value):
+    ''' Remove the HTTP responses from results so they can be saved to a file '''
+    if isinstance(value, List):
+        return List(items=[_strip_response(i) for i in value], meta=value.meta)
+    if isinstance(value, Munch):
+        return Munch((k, v) for k, v in value.items() if k != '__response__')
+    return value
+
+
+class _InFlight(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class CachedCoprClient(object):
+    ''' Copr client wrapper caching project and build list lookups for the whole run
+
+        Lookups of the same project or build list running at the same time in
+        multiple threads are coalesced into one request. With @cache_file the
+        results are saved between runs and reused for @ttl seconds.
+    '''
+
+    def __init__(self, client, cache_file=None, ttl=None):
+        self.client = client
+        self.cache_file = cache_file
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._results = {}
+        self._in_flight = {}
+        self._proxies = {}
+
+        if self.cache_file:
+            self._load()
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if name not in CACHED_METHODS:
+            return attr
+
+        with self._lock:
+            if name not in self._proxies:
+                self._proxies[name] = _CachedProxy(self, name, attr)
+            return self._proxies[name]
+
+    @property
+    def uncached(self):
+        ''' The wrapped Copr client, for lookups that must never be cached '''
+        return self.client
+
+    def _load(self):
+        if not os.path.exists(self.cache_file):
+            return
+
+        try:
+            with open(self.cache_file, 'rb') as f:
+                results = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+            log.warning('Failed to load Copr cache from %s: %s', self.cache_file, str(e))
+            return
+
+        now = time.time()
+        self._results = {k: v for k, v in results.items() if not self.ttl or now - v[0] < self.ttl}
+        log.debug('Loaded %d cached Copr results from %s.', len(self._results), self.cache_file)
+
+    def save(self):
+        ''' Save cached results to the cache file '''
+        if not self.cache_file:
+            return
+
+        with self._lock:
+            results = {k: (t, _strip_response(v)) for k, (t, v) in self._results.items()}
+
+        cache_dir = os.path.dirname(os.path.abspath(self.cache_file))
+        os.makedirs(cache_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=cache_dir, delete=False) as f:
+            pickle.dump(results, f)
+        os.replace(f.name, self.cache_file)
+
+    def invalidate(self, proxy_name=None):
+        ''' Drop cached results of @proxy_name (or all results) '''
+        with self._lock:
+            if proxy_name is None:
+                self._results.clear()
+            else:
+                self._results = {k: v for k, v in self._results.items() if k[0] != proxy_name}
+
+    def _call(self, key, func, args, kwargs):
+        with self._lock:
+            if key in self._results:
+                timestamp, result = self._results[key]
+                if not self.ttl or time.time() - timestamp < self.ttl:
+                    return result
+
+            in_flight = self._in_flight.get(key)
+            owner = in_flight is None
+            if owner:
+                in_flight = _InFlight()
+                self._in_flight[key] = in_flight
+
+        if not owner:
+            # same request is already running in another thread, wait for its result
+            in_flight.done.wait()
+            if in_flight.error is not None:
+                raise in_flight.error
+            return in_flight.result
+
+        try:
+            in_flight.result = func(*args, **kwargs)
+        except Exception as e:
+            in_flight.error = e
+            raise
+        else:
+            with self._lock:
+                self._results[key] = (time.time(), in_flight.result)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            in_flight.done.set()
+
+        return in_flight.result
+
+
+class _CachedProxy(object):
+
+    def __init__(self, cache, name, proxy):
+        self._cache = cache
+        self._name = name
+        self._proxy = proxy
+
+    def __getattr__(self, name):
+        attr = getattr(self._proxy, name)
+        if not callable(attr):
+            return attr
+
+        if name in CACHED_METHODS[self._name]:
+            def cached(*args, **kwargs):
+                key = (self._name, name, _freeze(args), _freeze(kwargs))
+                return self._cache._call(key, attr, args, kwargs)
+            return cached
+
+        if name.startswith(MODIFYING_METHODS):
+            def modifying(*args, **kwargs):
+                # builds or projects changed, drop everything we know about them
+                self._cache.invalidate(self._name)
+                return attr(*args, **kwargs)
+            return modifying
+
+        return attr
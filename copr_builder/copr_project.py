@@ -1,24 +1,76 @@
+import configparser
 import datetime
 import logging
+import os
+import time
 
+from collections import namedtuple
+
+from munch import Munch
 from packaging.version import Version
 
 from copr.v3 import CoprNoResultException
 
-from . import PACKAGE_CONF, COPR_USER_CONF, COPR_REPO_CONF, GIT_URL_CONF, ARCHIVE_CMD_CONF, CoprBuilderVersion
+from . import PACKAGE_CONF, COPR_USER_CONF, COPR_REPO_CONF, GIT_URL_CONF, GIT_BRANCH_CONF, GIT_MERGE_BRANCH_CONF, \
+    PRE_ARCHIVE_CMD_CONF, ARCHIVE_CMD_CONF, ARCHIVE_GLOB_CONF, GIT_DEPTH_CONF, GIT_FILTER_CONF, GIT_SINGLE_BRANCH_CONF, \
+    GIT_NO_TAGS_CONF, COMMAND_TIMEOUT_CONF, BUILD_MODE_CONF, SCM_BUILDDEPS_CONF, SCM_CHROOT_CONF, CHROOT_DELTA_CONF, \
+    CANCEL_OUTDATED_CONF, PRIORITY_CONF, CoprBuilderVersion
 from .errors import CoprBuilderError, CoprBuilderConfigurationError, CoprBuilderAlreadyFailed, \
-    CoprBuilderBrokenGitHash
+    CoprBuilderBrokenGitHash, CoprBuilderVersionUnknown, GitError, SRPMBuilderError
+from .build_state import RECORDED_STATES
+from .build_watcher import FINAL_STATES
+from .git_repo import CloneOptions, GitRepo
+from .scm_build import make_source
+from .spec_file import spec_release
 from .srpm_builder import SRPMBuilder
+from .srpm_cache import SRPMCache
+from .utils import file_hash
 
 
 log = logging.getLogger("copr.builder")
 
 
+# number of builds requested at once when looking for the last build
+LAST_BUILD_PAGE_SIZE = 10
+
+# fields of the last build we need to decide whether to build again
+LAST_BUILD_FIELDS = ('id', 'state', 'chroots', 'source_package', 'submitted_on', 'started_on', 'ended_on')
+
+# SRPMs are built locally and uploaded to Copr
+BUILD_MODE_SRPM = 'srpm'
+# SRPMs are built in Copr by a script running the archive commands (see scm_build)
+BUILD_MODE_SCM = 'scm'
+BUILD_MODES = (BUILD_MODE_SRPM, BUILD_MODE_SCM)
+
+# existing SRPM at @url built only in @chroots (all chroots of the project if None)
+UrlSource = namedtuple('UrlSource', ['url', 'chroots'])
+
+# configuration values that affect content of the SRPM
+SRPM_CONFS = (PACKAGE_CONF, GIT_URL_CONF, GIT_BRANCH_CONF, GIT_MERGE_BRANCH_CONF, PRE_ARCHIVE_CMD_CONF, ARCHIVE_CMD_CONF,
+              ARCHIVE_GLOB_CONF)
+
+
 class CoprProject(object):
 
-    def __init__(self, project_data, copr_client):
+    def __init__(self, project_data, copr_client, workspace=None, state_db=None, srpm_cache=None, metrics=None):
         self.project_data = project_data
         self.copr_client = copr_client
+        self.workspace = workspace
+        self.state_db = state_db
+        self.srpm_cache = srpm_cache
+
+        # how long the last build in Copr took
+        self.last_build_duration = None
+
+        # how long the individual steps of the SRPM build took
+        self.timings = {}
+
+        # chroots added to the project since the last build, see _needs_build
+        self._new_chroots = None
+
+        # unfinished builds of the package found in Copr and commit of the new build
+        self._unfinished = []
+        self.built_commit = None
 
         self._test_required_config_values()
 
@@ -26,7 +78,12 @@ class CoprProject(object):
                                                          self.project_data[COPR_USER_CONF],
                                                          self.project_data[COPR_REPO_CONF])
 
-        self.srpm_builder = SRPMBuilder(self.project_data)
+        clone_options = self._get_clone_options()
+        if self.workspace is not None:
+            git_repo = self.workspace.git_repo(self.project_data[GIT_URL_CONF], clone_options)
+        else:
+            git_repo = GitRepo(self.project_data[GIT_URL_CONF], clone_options=clone_options)
+        self.srpm_builder = SRPMBuilder(self.project_data, git_repo=git_repo, metrics=metrics)
 
         # get the Copr project
         try:
@@ -36,13 +93,71 @@ class CoprProject(object):
             raise CoprBuilderError('Copr project %s/%s not found' % (self.project_data[COPR_USER_CONF],
                                                                      self.project_data[COPR_REPO_CONF])) from e
 
+    def _get_clone_options(self):
+        ''' Get options for cloning the git repository from the configuration '''
+        try:
+            depth = int(self.project_data.get(GIT_DEPTH_CONF, 0))
+            if depth < 0:
+                raise ValueError(depth)
+            single_branch = self._get_boolean(GIT_SINGLE_BRANCH_CONF)
+            no_tags = self._get_boolean(GIT_NO_TAGS_CONF)
+        except ValueError as e:
+            raise CoprBuilderConfigurationError('Invalid value in the configuration: %s' % str(e)) from e
+
+        # the branch matters only for single branch clones, projects building different
+        # branches of the same repository can share the clone otherwise (see Workspace)
+        return CloneOptions(depth=depth or None, filter=self.project_data.get(GIT_FILTER_CONF),
+                            single_branch=single_branch, no_tags=no_tags,
+                            branch=self.project_data.get(GIT_BRANCH_CONF) if single_branch else None)
+
+    def _get_boolean(self, conf):
+        value = str(self.project_data.get(conf, 'no')).lower()
+        if value not in configparser.ConfigParser.BOOLEAN_STATES:
+            raise ValueError('%s = %s' % (conf, value))
+        return configparser.ConfigParser.BOOLEAN_STATES[value]
+
     def _test_required_config_values(self):
         ''' Test if all required configuration values are set properly. '''
         for conf in [PACKAGE_CONF, COPR_USER_CONF, COPR_REPO_CONF, GIT_URL_CONF, ARCHIVE_CMD_CONF]:
             if conf not in self.project_data.keys():
                 raise CoprBuilderConfigurationError('Missing \"%s\" value in the configuration!' % conf)
 
+        if self.build_mode not in BUILD_MODES:
+            raise CoprBuilderConfigurationError('Invalid \"%s\" value in the configuration!' % BUILD_MODE_CONF)
+        if self.build_mode == BUILD_MODE_SCM:
+            # the commit to build is found without cloning, result of a merge can't be
+            scm = '\"%s = %s\"' % (BUILD_MODE_CONF, BUILD_MODE_SCM)
+            if GIT_BRANCH_CONF not in self.project_data.keys():
+                raise CoprBuilderConfigurationError('\"%s\" is required with %s.' % (GIT_BRANCH_CONF, scm))
+            if GIT_MERGE_BRANCH_CONF in self.project_data.keys():
+                raise CoprBuilderConfigurationError('\"%s\" can\'t be used with %s.' % (GIT_MERGE_BRANCH_CONF, scm))
+
+        for conf in (CHROOT_DELTA_CONF, CANCEL_OUTDATED_CONF):
+            try:
+                self._get_boolean(conf)
+            except ValueError as e:
+                raise CoprBuilderConfigurationError('Invalid \"%s\" value in the configuration!' % conf) from e
+
+        if COMMAND_TIMEOUT_CONF in self.project_data.keys():
+            try:
+                float(self.project_data[COMMAND_TIMEOUT_CONF])
+            except ValueError as e:
+                raise CoprBuilderConfigurationError('Invalid \"%s\" value in the configuration!' % COMMAND_TIMEOUT_CONF) from e
+
+        if PRIORITY_CONF in self.project_data.keys():
+            try:
+                int(self.project_data[PRIORITY_CONF])
+            except ValueError as e:
+                raise CoprBuilderConfigurationError('Invalid \"%s\" value in the configuration!' % PRIORITY_CONF) from e
+
+    @property
+    def build_mode(self):
+        return self.project_data.get(BUILD_MODE_CONF, BUILD_MODE_SRPM)
+
     def _get_package_version(self, build):
+        if build.source_package is None and build.state not in FINAL_STATES:
+            return None  # sources not imported yet
+
         if build.source_package and 'version' in build.source_package.keys():
             return build.source_package['version']
 
@@ -65,25 +180,202 @@ class CoprProject(object):
 
         return ret
 
+    def _remote_head_built(self, git_hash):
+        ''' Check whether head of the git branch is @git_hash from the last build
+            without cloning the repository
+
+            returns (bool): True if the last build was built from the remote head, False
+                            if it isn't or if it can't be decided without cloning
+        '''
+        if GIT_MERGE_BRANCH_CONF in self.project_data.keys():
+            # result of the merge can't be decided from the remote heads
+            return False
+        if GIT_BRANCH_CONF not in self.project_data.keys():
+            return False
+
+        try:
+            head = self.srpm_builder.git_repo.remote_head(self.project_data[GIT_BRANCH_CONF])
+        except GitError as e:
+            log.debug('%s Failed to check remote head: %s', self._log_prefix, str(e))
+            return False
+
+        # head may be a commit from the bot excluded by GitRepo.last_commit, we need
+        # to clone the repository to check that so only the match is conclusive
+        if head is None or not head.startswith(git_hash):
+            return False
+
+        log.debug('%s Remote head of %s is %s, same as the last build.', self._log_prefix,
+                  self.project_data[GIT_BRANCH_CONF], head)
+        return True
+
+    def _needs_build(self, last_build, last_version, last_commit):
+        ''' Check whether the last build, which was built from @last_commit, needs
+            to be built again
+
+            returns (bool): True if there are changes in chroots, False if the build is up to date
+        '''
+        proj_chroots = set(self.copr_project.chroot_repos.keys())
+        last_chroots = set(last_build.chroots)
+
+        if proj_chroots != last_chroots and self._get_boolean(CHROOT_DELTA_CONF) and last_build.state == 'succeeded':
+            new_chroots = proj_chroots - self._built_chroots(last_build)
+            if not new_chroots:
+                # chroots were only removed from the project, nothing to build
+                last_chroots = proj_chroots
+            elif last_build.source_package.get('url'):
+                log.info('%s Newest version is already built (git hash: %s) but new chroots were enabled for '
+                         'the project -- building it in %s.', self._log_prefix, last_commit, ', '.join(sorted(new_chroots)))
+                self._new_chroots = sorted(new_chroots)
+                return True
+
+        if proj_chroots != last_chroots:
+            # always try to rebuild if there is a change in chroots
+            log.info('%s Newest version is already built (git hash: %s) but there are different chroots '
+                     'enabled for the project -- building anyway.', self._log_prefix, last_commit)
+            chroots_diff = self._get_chroots_diff_message(proj_chroots, last_chroots)
+            log.debug('%s %s', self._log_prefix, chroots_diff)
+            return True
+
+        self.save_state(git_hash=last_commit, version=last_build.source_package['version'],
+                        chroots=sorted(last_chroots), build_id=last_build.id, state=last_build.state)
+
+        if last_build.state == 'failed':
+            date = datetime.date.fromtimestamp(last_build.submitted_on).isoformat()
+            log.error('%s Build of the newest version (git hash: %s) was already submitted on '
+                      '%s but it failed.', self._log_prefix, last_version.git_hash, date)
+            raise CoprBuilderAlreadyFailed
+
+        log.info('%s Newest version is already built (git hash: %s).', self._log_prefix, last_commit)
+        return False
+
+    def _built_chroots(self, last_build):
+        ''' Get chroots the version from @last_build was successfully built in, the version can
+            be built by more builds when only new chroots were built (see "chroot_delta")
+        '''
+        copr_user = self.project_data[COPR_USER_CONF]
+        copr_package = self.project_data[PACKAGE_CONF]
+        copr_project = self.project_data[COPR_REPO_CONF]
+        version = last_build.source_package['version']
+
+        chroots = set()
+        offset = 0
+        while True:
+            pagination = {'order': 'id', 'order_type': 'DESC', 'limit': LAST_BUILD_PAGE_SIZE, 'offset': offset}
+            builds = self.copr_client.build_proxy.get_list(ownername=copr_user,
+                                                           projectname=copr_project,
+                                                           packagename=copr_package,
+                                                           pagination=pagination)
+            for build in builds:
+                if build.state in ('skipped', 'canceled') or build.id > last_build.id:
+                    continue
+                if build.source_package['version'] != version:
+                    return chroots
+                if build.state == 'succeeded':
+                    chroots.update(build.chroots)
+
+            if len(builds) < LAST_BUILD_PAGE_SIZE:
+                return chroots
+            offset += LAST_BUILD_PAGE_SIZE
+
+    def outdated_builds(self):
+        ''' Get IDs of unfinished builds of the package built from other commits than the new build
+
+            returns (list): the builds, always empty without "cancel_outdated"
+        '''
+        if not self._get_boolean(CANCEL_OUTDATED_CONF) or not self.built_commit:
+            return []
+
+        outdated = []
+        for build in self._unfinished:
+            try:
+                version = self._extract_version(build.source_package['version'])
+            except (CoprBuilderBrokenGitHash, KeyError, TypeError, ValueError):
+                # not built by us or the version is not known yet
+                continue
+
+            if not (self.built_commit.startswith(version.git_hash) or version.git_hash.startswith(self.built_commit)):
+                outdated.append(build.id)
+
+        return outdated
+
+    def _chroot_delta_source(self, last_build, last_commit):
+        ''' Get source building SRPM of @last_build only in the new chroots '''
+        self.built_commit = last_commit
+        self.save_state(git_hash=last_commit, version=last_build.source_package['version'],
+                        chroots=sorted(self.copr_project.chroot_repos.keys()), build_id=None, state='srpm')
+
+        return UrlSource(last_build.source_package['url'], self._new_chroots)
+
+    def save_state(self, **values):
+        ''' Save @values to the local state database record of this project '''
+        if self.state_db is None:
+            return
+
+        self.state_db.update(self.project_data.name, copr_user=self.project_data[COPR_USER_CONF],
+                             copr_repo=self.project_data[COPR_REPO_CONF], package=self.project_data[PACKAGE_CONF],
+                             **values)
+
+    def _check_saved_state(self):
+        ''' Check whether the last build saved in the local state database is up to date
+            without asking Copr for the builds
+
+            returns (bool): True if the last build is up to date, False if it isn't or if
+                            it can't be decided from the saved state
+        '''
+        if self.state_db is None:
+            return False
+
+        state = self.state_db.get(self.project_data.name)
+        if state is None or state.state not in RECORDED_STATES or not state.git_hash:
+            return False
+
+        # configuration changed since the last build
+        if (state.copr_user, state.copr_repo, state.package) != (self.project_data[COPR_USER_CONF],
+                                                                 self.project_data[COPR_REPO_CONF],
+                                                                 self.project_data[PACKAGE_CONF]):
+            return False
+
+        if set(state.chroots) != set(self.copr_project.chroot_repos.keys()):
+            return False
+
+        if not self._remote_head_built(state.git_hash):
+            return False
+
+        if state.state == 'failed':
+            log.error('%s Build of the newest version (git hash: %s) already failed (build ID: %s).',
+                      self._log_prefix, state.git_hash, state.build_id)
+            raise CoprBuilderAlreadyFailed
+
+        log.info('%s Newest version is already built (git hash: %s).', self._log_prefix, state.git_hash)
+        return True
+
     def build_srpm(self):
         ''' Build an SRPM package for this project
 
-            returns (str): path to newly created SRPM
+            With "build_mode = scm" the SRPM is not built locally, a source
+            building it in Copr is returned instead. With "chroot_delta" only
+            new chroots may be built from SRPM of the last build (UrlSource).
+
+            returns (str): path to newly created SRPM (or ScmSource or UrlSource)
         '''
         log.info('%s New SRPM build started.', self._log_prefix)
 
+        # the last build we know about may be enough to decide without asking Copr
+        if self._check_saved_state():
+            return None
+
         # get last build in Copr
         last_build = self._get_last_build()
 
-        # switch branch and do some other things needed before build
-        self.srpm_builder.prepare_build()
-
-        # check if we actually need to do the build -- check version and last commit
-        last_commit = self.srpm_builder.git_repo.last_commit()
-
         try:
             if last_build:
                 package_version = self._get_package_version(last_build)
+                if package_version is None:
+                    # Copr knows the version only after importing the sources, we can't
+                    # tell whether the build is up to date until then
+                    log.info('%s Version of the last build (ID: %s) is not known yet, trying again later.',
+                             self._log_prefix, last_build.id)
+                    raise CoprBuilderVersionUnknown
                 last_version = self._extract_version(package_version)
             else:
                 last_version = None
@@ -92,34 +384,165 @@ class CoprProject(object):
                         'a new build.', self._log_prefix)
             last_version = None
 
-        if last_build and last_version and last_commit == last_version.git_hash:
-            proj_chroots = set(self.copr_project.chroot_repos.keys())
-            last_chroots = set(last_build.chroots)
+        # check if we actually need to do the build -- check version and last commit,
+        # first try to do that without cloning the repository
+        remote_checked = False
+        if last_build and last_version and self._remote_head_built(last_version.git_hash):
+            if not self._needs_build(last_build, last_version, last_version.git_hash):
+                return None
+            if self._new_chroots:
+                return self._chroot_delta_source(last_build, last_version.git_hash)
+            remote_checked = True
 
-            if proj_chroots != last_chroots:
-                # always try to rebuild if there is a change in chroots
-                log.info('%s Newest version is already built (git hash: %s) but there are different chroots '
-                         'enabled for the project -- building anyway.', self._log_prefix, last_commit)
-                chroots_diff = self._get_chroots_diff_message(proj_chroots, last_chroots)
-                log.debug('%s %s', self._log_prefix, chroots_diff)
-            else:
-                if last_build.state == 'failed':
-                    date = datetime.date.fromtimestamp(last_build.submitted_on).isoformat()
-                    log.error('%s Build of the newest version (git hash: %s) was already submitted on '
-                              '%s but it failed.', self._log_prefix, last_version.git_hash, date)
-                    raise CoprBuilderAlreadyFailed
-                else:
-                    log.info('%s Newest version is already built (git hash: %s).', self._log_prefix, last_commit)
-                    return None
+        if self.build_mode == BUILD_MODE_SCM:
+            return self._scm_source(last_version)
+
+        # switch branch and do some other things needed before build
+        start = time.monotonic()
+        self.srpm_builder.prepare_build()
+        self.timings['prepare'] = time.monotonic() - start
+
+        last_commit = self.srpm_builder.git_repo.last_commit()
+
+        if not remote_checked and last_build and last_version and last_commit == last_version.git_hash:
+            if not self._needs_build(last_build, last_version, last_commit):
+                return None
+            if self._new_chroots:
+                return self._chroot_delta_source(last_build, last_commit)
+
+        if self.workspace is None:
+            srpm = self._get_srpm(last_version, last_commit)
+        else:
+            # projects building the same commit with the same commands and with the same
+            # last version in Copr would create the same SRPM, build it only once
+            key = tuple(self.project_data.get(conf) for conf in SRPM_CONFS)
+            key += (last_commit, (last_version.version, last_version.build) if last_version else None)
+
+            srpm = self.workspace.srpm(key, lambda: self._get_srpm(last_version, last_commit))
+
+        self.built_commit = last_commit
 
+        # the build is not submitted yet, so its state is not final
+        version = self._srpm_version(last_version, last_commit)
+        self.save_state(git_hash=last_commit, version=version, chroots=sorted(self.copr_project.chroot_repos.keys()),
+                        build_id=None, state='srpm', srpm_hash=file_hash(srpm), timings=self.timings)
+
+        return srpm
+
+    def _scm_source(self, last_version):
+        ''' Get source for a build running the archive commands in Copr
+
+            returns (ScmSource): the source
+        '''
+        branch = self.project_data[GIT_BRANCH_CONF]
+        commit = self.srpm_builder.git_repo.remote_head(branch)
+        if commit is None:
+            raise GitError('Failed to find branch %s in %s.' % (branch, self.project_data[GIT_URL_CONF]))
+        self.built_commit = commit
+
+        log.info('%s Building commit %s in Copr.', self._log_prefix, commit)
+
+        source = make_source(self.project_data[PACKAGE_CONF], self.project_data[GIT_URL_CONF], commit,
+                             self.project_data[ARCHIVE_CMD_CONF],
+                             pre_archive_cmd=self.project_data.get(PRE_ARCHIVE_CMD_CONF),
+                             archive_glob=self.project_data.get(ARCHIVE_GLOB_CONF),
+                             last_version=last_version,
+                             builddeps=self.project_data.get(SCM_BUILDDEPS_CONF, '').split(),
+                             chroot=self.project_data.get(SCM_CHROOT_CONF))
+
+        # version is not known until the build finishes in Copr
+        self.save_state(git_hash=commit, version=None, chroots=sorted(self.copr_project.chroot_repos.keys()),
+                        build_id=None, state='srpm', srpm_hash=None, timings=self.timings)
+
+        return source
+
+    def _srpm_version(self, last_version, last_commit):
+        ''' Get version of the new SRPM as "version-release" (without dist)
+
+            SRPMs from the SRPM cache or built by another project were built from the same
+            spec, their version is computed the same way _make_srpm does it.
+
+            returns (str): the version or None if the spec can't be read
+        '''
+        if self.srpm_builder.srpm_version is not None:
+            return self.srpm_builder.srpm_version
+
+        try:
+            spec_version = self.srpm_builder.spec_version
+            Version(spec_version.version)
+            new_version = self._new_version(spec_version, last_version, last_commit)
+        except SRPMBuilderError:
+            # spec file is generated by the archive command
+            return None
+        except ValueError:
+            # template of the spec file with placeholders (e.g. "Version: @VERSION@"), the
+            # version is known only after the archive command generates the spec
+            return None
+
+        return '%s-%s' % (new_version.version, spec_release(new_version))
+
+    def _srpm_cache_key(self, last_version):
+        ''' Get key for the SRPM cache from everything that affects content of the SRPM
+
+            returns (str): the key or None if the key can't be computed yet
+        '''
+        try:
+            spec = self.srpm_builder.read_spec()
+        except SRPMBuilderError:
+            # spec file is generated by the archive command
+            return None
+
+        # merging creates a new commit every time, use the heads before the merge
+        head = self.srpm_builder.source_commit
+        merge_head = None
+        if GIT_MERGE_BRANCH_CONF in self.project_data.keys():
+            rev = 'origin/%s' % self.project_data[GIT_MERGE_BRANCH_CONF]
+            merge_head = self.srpm_builder.git_repo.resolve(rev)[0]
+            if merge_head is None:
+                raise GitError('Failed to resolve %s.' % rev)
+        if head is None:
+            raise GitError('Failed to resolve %s.' % self.project_data[GIT_BRANCH_CONF])
+
+        # last version in Copr and date are used to compute the new version, see _new_version
+        return SRPMCache.srpm_key(head, merge_head,
+                                  self.project_data.get(PRE_ARCHIVE_CMD_CONF), self.project_data[ARCHIVE_CMD_CONF],
+                                  self.project_data.get(ARCHIVE_GLOB_CONF),
+                                  spec, (last_version.version, last_version.build) if last_version else None,
+                                  datetime.date.today().strftime('%Y%m%d'))
+
+    def _get_srpm(self, last_version, last_commit):
+        ''' Get SRPM from the SRPM cache or build a new one '''
+        if self.srpm_cache is None:
+            return self._make_srpm(last_version, last_commit)
+
+        key = self._srpm_cache_key(last_version)
+        if key is not None:
+            os.makedirs(self.srpm_builder.rpmdir, exist_ok=True)
+            srpm = self.srpm_cache.get(key, self.srpm_builder.rpmdir)
+            if srpm:
+                log.info('%s Using SRPM from cache: %s', self._log_prefix, srpm)
+                return srpm
+
+        srpm = self._make_srpm(last_version, last_commit)
+        if key is not None:
+            self.srpm_cache.put(key, srpm)
+
+        return srpm
+
+    def _make_srpm(self, last_version, last_commit):
+        start = time.monotonic()
         self.srpm_builder.make_archive()
+        self.timings['archive'] = time.monotonic() - start
 
         # update version in spec file
         self.srpm_builder.spec_version = self._new_version(self.srpm_builder.spec_version,
                                                            last_version, last_commit)
 
         # make srpm
+        start = time.monotonic()
         srpm = self.srpm_builder.build()
+        self.timings['srpm'] = time.monotonic() - start
+
         return srpm
 
     def _extract_version(self, version_str):
@@ -148,19 +571,40 @@ class CoprProject(object):
         copr_package = self.project_data[PACKAGE_CONF]
         copr_project = self.project_data[COPR_REPO_CONF]
 
-        # get list of builds for this Copr project
-        all_builds = self.copr_client.build_proxy.get_list(ownername=copr_user,
+        # go through the builds from the newest one and stop at the first one that wasn't skipped
+        # or canceled, builds that failed before Copr imported the sources have no version, there
+        # may be thousands of builds, so get them in small pages
+        last = None
+        offset = 0
+        while last is None:
+            pagination = {'order': 'id', 'order_type': 'DESC', 'limit': LAST_BUILD_PAGE_SIZE, 'offset': offset}
+            builds = self.copr_client.build_proxy.get_list(ownername=copr_user,
                                                            projectname=copr_project,
-                                                           packagename=copr_package)
-        project_builds = [b for b in all_builds if b.state not in ('skipped', 'canceled')]
-        if len(project_builds) == 0:
+                                                           packagename=copr_package,
+                                                           pagination=pagination)
+            last = next((b for b in builds if b.state not in ('skipped', 'canceled') and
+                         (b.state not in FINAL_STATES or (b.source_package or {}).get('version'))), None)
+            self._unfinished.extend(Munch(id=b.id, source_package=b.source_package)
+                                    for b in builds if b.state not in FINAL_STATES)
+
+            if len(builds) < LAST_BUILD_PAGE_SIZE:
+                break
+            offset += LAST_BUILD_PAGE_SIZE
+
+        if last is None:
             log.debug('%s No previous builds found.', self._log_prefix)
             return None  # no previous builds, we are doing the first one
 
-        last = max(project_builds, key=lambda x: x.submitted_on)
+        # Copr API can't select fields, keep only those we need
+        last = Munch({k: last.get(k) for k in LAST_BUILD_FIELDS})
+
+        if last.get('started_on') and last.get('ended_on'):
+            self.last_build_duration = last.ended_on - last.started_on
+            self.timings['copr'] = self.last_build_duration
 
+        source_package = last.source_package or {}
         log.debug('%s Found latest build: %s-%s (ID: %s)', self._log_prefix,
-                  last.source_package['name'], last.source_package['version'], last.id)
+                  source_package.get('name'), source_package.get('version'), last.id)
         return last
 
     def _new_version(self, spec_version, copr_version, last_commit):
@@ -0,0 +1,325 @@
+import http.server
+import json
+import logging
+import os
+import queue
+import socketserver
+import threading
+import time
+import urllib.parse
+
+from . import GIT_URL_CONF, GIT_BRANCH_CONF, GIT_MERGE_BRANCH_CONF
+from .build_watcher import BuildWatcher
+from .errors import CoprBuilderError, CoprBuilderConfigurationError, GitError
+from .git_repo import GitRepo
+from .workspace import Workspace
+
+log = logging.getLogger("copr.builder")
+
+
+POLL_INTERVAL_CONF = 'poll_interval'
+
+# trigger for all projects
+ALL_PROJECTS = '*'
+
+
+def _normalize_url(url):
+    url = url.rstrip('/')
+    if url.endswith('.git'):
+        url = url[:-4]
+    return url
+
+
+class CoprBuilderDaemon(object):
+    ''' Keep building projects from @builder as their repositories change
+
+        The Copr client, the git clones and the build watcher are kept for
+        the whole life of the daemon. Remote heads of the projects are checked
+        every @poll_interval seconds (or "poll_interval" from the project
+        config) and only projects with new commits are built. Projects can be
+        also triggered using a Unix socket at @socket_path or an HTTP endpoint
+        on localhost:@http_port. Builds still running when the daemon stops
+        are saved to @watch_file.
+    '''
+
+    def __init__(self, builder, projects=None, poll_interval=300, socket_path=None, http_port=None, watch_file=None):
+        self.builder = builder
+
+        if projects:
+            self.builder._check_projects_input(projects)
+            self.projects = projects
+        else:
+            self.projects = self.builder.config.sections()
+
+        self.poll_interval = poll_interval
+        self.socket_path = socket_path
+        self.http_port = http_port
+        self.watch_file = watch_file
+
+        self.workspace = Workspace(self.builder.git_cache)
+        self.watcher = BuildWatcher(self.builder.copr.uncached, state_db=self.builder.state_db,
+                                    metrics=self.builder.metrics)
+
+        # last known heads of the project branches and when to check them again
+        self._heads = {}
+        self._next_poll = {p: 0 for p in self.projects}
+        self._remotes = {}
+
+        self._triggers = queue.Queue()
+        self._stopped = threading.Event()
+        self._servers = []
+        self._watch_success = True
+
+        for project in self.projects:
+            try:
+                self._interval(project)
+            except ValueError as e:
+                raise CoprBuilderConfigurationError('Invalid "%s" value for %s.' % (POLL_INTERVAL_CONF, project)) from e
+
+    def trigger(self, target=ALL_PROJECTS):
+        ''' Build @target (name of a project, git URL of projects or ALL_PROJECTS) as soon as possible
+
+            returns (list): names of the triggered projects
+        '''
+        if target == ALL_PROJECTS:
+            projects = list(self.projects)
+        elif target in self.projects:
+            projects = [target]
+        else:
+            url = _normalize_url(target)
+            projects = [p for p in self.projects if _normalize_url(self.builder.config[p][GIT_URL_CONF]) == url]
+
+        for project in projects:
+            self._triggers.put(project)
+
+        return projects
+
+    def stop(self):
+        ''' Stop the daemon after the current cycle '''
+        self._stopped.set()
+        self._triggers.put(None)
+
+    def _interval(self, project):
+        return float(self.builder.config[project].get(POLL_INTERVAL_CONF, self.poll_interval))
+
+    def _remote_heads(self, project):
+        ''' Get current heads of the branches @project is built from
+
+            returns (tuple): the heads or None if they can't be checked
+        '''
+        conf = self.builder.config[project]
+        if GIT_BRANCH_CONF not in conf:
+            return None
+
+        url = conf[GIT_URL_CONF]
+        if url not in self._remotes:
+            self._remotes[url] = GitRepo(url, cache=self.builder.git_cache)
+        remote = self._remotes[url]
+
+        branches = [conf[GIT_BRANCH_CONF]]
+        if GIT_MERGE_BRANCH_CONF in conf:
+            branches.append(conf[GIT_MERGE_BRANCH_CONF])
+
+        heads = tuple(remote.remote_head(b) for b in branches)
+        # not a branch (e.g. a tag or a commit), we can't tell whether it changed
+        return heads if None not in heads else None
+
+    def _changed(self, projects):
+        ''' Get projects from @projects with new commits
+
+            returns (dict): the projects and their current heads, these are saved
+                            only once the projects are built (see _cycle)
+        '''
+        changed = {}
+        for project in projects:
+            try:
+                heads = self._remote_heads(project)
+            except GitError as e:
+                log.warning('Failed to check remote heads of %s: %s', project, str(e))
+                continue
+
+            if heads is None or heads != self._heads.get(project):
+                changed[project] = heads
+
+        return changed
+
+    def _cycle(self, due, triggered):
+        # everything we know about git and Copr may be out of date now
+        if self.builder.git_cache is not None:
+            self.builder.git_cache.expire()
+        self.builder.copr.invalidate()
+        self.workspace.refresh()
+
+        now = time.monotonic()
+        for project in due:
+            self._next_poll[project] = now + self._interval(project)
+
+        heads = self._changed(p for p in due if p not in triggered)
+
+        projects = [p for p in self.projects if p in heads or p in triggered]
+        if not projects:
+            log.debug('No changes in %s.', ', '.join(due))
+            return
+
+        log.info('Building %s.', ', '.join(projects))
+        done = set()
+        try:
+            self.builder.do_builds(projects, workspace=self.workspace, watcher=self.watcher, done=done)
+        except CoprBuilderError as e:
+            log.error('Failed to build %s:\n%s', ', '.join(projects), str(e))
+            done = set()
+        except Exception:  # pylint: disable=broad-except
+            # don't let a bug in one project stop building the others
+            log.exception('Failed to build %s.', ', '.join(projects))
+            done = set()
+
+        # projects that failed are built again with the next check even without new commits
+        for project in projects:
+            if project in done and project in heads:
+                self._heads[project] = heads[project]
+            elif project not in done:
+                self._heads.pop(project, None)
+
+    def _wait(self):
+        ''' Wait for projects that should be checked or built now
+
+            returns (tuple): projects due for polling and triggered projects
+        '''
+        now = time.monotonic()
+        due = [p for p in self.projects if self._next_poll[p] <= now]
+        triggered = set()
+
+        if not due:
+            wait = min(self._next_poll.values()) - now
+            try:
+                triggered.add(self._triggers.get(timeout=wait))
+            except queue.Empty:
+                pass
+
+        # take everything triggered so far, projects are built together
+        while True:
+            try:
+                triggered.add(self._triggers.get_nowait())
+            except queue.Empty:
+                break
+
+        triggered.discard(None)
+        return due, triggered
+
+    def _start_servers(self):
+        if self.socket_path:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            server = socketserver.ThreadingUnixStreamServer(self.socket_path, _SocketTriggerHandler)
+            self._servers.append(server)
+            log.info('Listening for triggers on %s.', self.socket_path)
+
+        if self.http_port is not None:
+            server = http.server.ThreadingHTTPServer(('127.0.0.1', self.http_port), _HTTPTriggerHandler)
+            self._servers.append(server)
+            log.info('Listening for triggers on http://127.0.0.1:%d/.', server.server_address[1])
+
+        for server in self._servers:
+            server.daemon_threads = True
+            server.builder_daemon = self
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def _stop_servers(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers = []
+
+        if self.socket_path and os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def run(self):
+        ''' Run until stop is called
+
+            returns (bool): False if some of the builds failed
+        '''
+        self._start_servers()
+
+        watch_thread = threading.Thread(target=self._watch, daemon=True)
+        watch_thread.start()
+
+        try:
+            while not self._stopped.is_set():
+                due, triggered = self._wait()
+                if self._stopped.is_set():
+                    break
+                if due or triggered:
+                    self._cycle(due, triggered)
+        finally:
+            self._stop_servers()
+            self.watcher.close()
+            if self.watch_file and self.watcher.builds:
+                # don't wait for the running builds, they can be watched later
+                self.watcher.save(self.watch_file)
+            else:
+                watch_thread.join()
+            self.builder.write_metrics()
+
+        return self._watch_success
+
+    def _watch(self):
+        self._watch_success = self.watcher.watch()
+
+
+class _SocketTriggerHandler(socketserver.StreamRequestHandler):
+    ''' Every line is a project name, git URL or "*" for all projects '''
+
+    def handle(self):
+        for line in self.rfile:
+            target = line.decode(errors='replace').strip() or ALL_PROJECTS
+            projects = self.server.builder_daemon.trigger(target)
+            if projects:
+                self.wfile.write(('OK %s\n' % ' '.join(projects)).encode())
+            else:
+                self.wfile.write(('ERROR unknown project %s\n' % target).encode())
+
+
+class _HTTPTriggerHandler(http.server.BaseHTTPRequestHandler):
+    ''' POST /trigger with "project" or "url" query arguments (all projects without them)
+        or with a push webhook payload containing URL of the repository
+    '''
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        url = urllib.parse.urlparse(self.path)
+        if url.path != '/trigger':
+            self.send_error(404)
+            return
+
+        query = urllib.parse.parse_qs(url.query)
+        targets = query.get('project', []) + query.get('url', [])
+
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            try:
+                payload = json.loads(self.rfile.read(length))
+            except ValueError:
+                self.send_error(400, 'Invalid JSON payload')
+                return
+            repository = payload.get('repository') if isinstance(payload, dict) else None
+            if not isinstance(repository, dict):
+                repository = {}
+            targets.extend(repository[key] for key in ('clone_url', 'git_http_url', 'html_url', 'ssh_url')
+                           if repository.get(key))
+
+        projects = set()
+        for target in targets or [ALL_PROJECTS]:
+            projects.update(self.server.builder_daemon.trigger(target))
+
+        if not projects:
+            self.send_error(404, 'No matching projects')
+            return
+
+        body = json.dumps({'projects': sorted(projects)}).encode()
+        self.send_response(202)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        log.debug('HTTP trigger: %s', format % args)
@@ -21,3 +21,7 @@ class CoprBuilderConfigurationError(CoprBuilderError):
 
 class CoprBuilderBrokenGitHash(CoprBuilderError):
     pass
+
+
+class CoprBuilderVersionUnknown(CoprBuilderError):
+    pass
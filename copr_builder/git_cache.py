@@ -0,0 +1,99 @@
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import threading
+
+from contextlib import contextmanager
+
+from .utils import run_command
+from .errors import GitError
+
+log = logging.getLogger("copr.builder")
+
+
+class GitMirrorCache(object):
+    ''' Persistent cache of bare git mirrors keyed by repository URL
+
+        Mirrors are only fetched when used so repeated runs download just
+        the new objects. Every mirror is protected by a lock file so the
+        cache can be shared by multiple copr-builder processes -- fetching
+        takes an exclusive lock, cloning from the mirror a shared one.
+    '''
+
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # mirrors already fetched by this process
+        self._updated = set()
+        self._updated_lock = threading.Lock()
+
+    def mirror_path(self, repo_url):
+        ''' Path of the mirror for @repo_url '''
+        name = os.path.basename(repo_url.rstrip('/'))
+        if name.endswith('.git'):
+            name = name[:-4]
+        digest = hashlib.sha256(repo_url.encode()).hexdigest()[:16]
+
+        return os.path.join(self.cache_dir, '%s-%s.git' % (name, digest))
+
+    @contextmanager
+    def _lock(self, repo_url, shared=False):
+        with open(self.mirror_path(repo_url) + '.lock', 'a', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def update(self, repo_url, force=False):
+        ''' Create the mirror for @repo_url or fetch new changes into it
+
+            The mirror is fetched only once per process unless @force is set.
+        '''
+        with self._updated_lock:
+            if repo_url in self._updated and not force:
+                return
+
+        path = self.mirror_path(repo_url)
+
+        with self._lock(repo_url):
+            with self._updated_lock:
+                if repo_url in self._updated and not force:
+                    return
+
+            if os.path.isdir(path):
+                log.debug('Fetching %s into git mirror %s.', repo_url, path)
+                command = ['git', 'fetch', '--prune', 'origin', '+refs/heads/*:refs/heads/*', '+refs/tags/*:refs/tags/*']
+                ret, out = run_command(command, path)
+                if ret != 0:
+                    raise GitError('Failed to fetch %s into mirror %s:\n%s' % (repo_url, path, out))
+            else:
+                log.debug('Creating git mirror %s for %s.', path, repo_url)
+                # clone to a temporary location first so an interrupted clone
+                # doesn't leave a broken mirror behind
+                tmp_path = path + '.tmp'
+                if os.path.exists(tmp_path):
+                    shutil.rmtree(tmp_path)
+                command = ['git', 'clone', '--bare', repo_url, tmp_path]
+                ret, out = run_command(command, self.cache_dir)
+                if ret != 0:
+                    shutil.rmtree(tmp_path, ignore_errors=True)
+                    raise GitError('Failed to create mirror of %s:\n%s' % (repo_url, out))
+                os.rename(tmp_path, path)
+
+            with self._updated_lock:
+                self._updated.add(repo_url)
+
+    def expire(self):
+        ''' Forget which mirrors were already fetched, they are fetched again when used '''
+        with self._updated_lock:
+            self._updated.clear()
+
+    @contextmanager
+    def use(self, repo_url):
+        ''' Lock the mirror for @repo_url for reading and return its path '''
+        with self._lock(repo_url, shared=True):
+            yield self.mirror_path(repo_url)
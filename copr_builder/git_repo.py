@@ -2,6 +2,8 @@ import logging
 import os
 import tempfile
 
+from collections import namedtuple
+
 from .utils import run_command
 from .errors import GitError
 
@@ -11,20 +13,66 @@ log = logging.getLogger("copr.builder")
 # username used for git merge
 GIT_USER = "CoprBuilderBot"
 
+# identity for commits created by us, passed to git with "-c" so config of the repository is not changed
+GIT_IDENTITY = ['-c', 'user.email=%s@example.com' % GIT_USER.lower(), '-c', 'user.name=%s' % GIT_USER]
+
+# how many times history of a shallow clone is deepened (twice as much every time) before fetching all of it
+DEEPEN_STEPS = 3
+
+# options for "git clone", the clone is deepened when more history is needed
+# @depth -- number of commits to clone, all history if None
+# @filter -- object filter for partial clones (e.g. "blob:none")
+# @single_branch -- clone only @branch
+# @no_tags -- don't clone tags
+CloneOptions = namedtuple('CloneOptions', ['depth', 'filter', 'single_branch', 'no_tags', 'branch'])
+CloneOptions.__new__.__defaults__ = (None, None, False, False, None)
+
 
 class GitRepo(object):
 
-    def __init__(self, repo_url):
+    def __init__(self, repo_url, cache=None, clone_options=None):
         self.repo_url = repo_url
+        self.cache = cache
+        self.clone_options = clone_options or CloneOptions()
         self.tempdir = tempfile.TemporaryDirectory()
 
         self.gitdir = None
 
+        # set when the clone should be updated before it is used again
+        self.outdated = False
+
+    def _git(self, *args, cwd=None, stdin=None):
+        ''' Run git with @args (without shell) in the repository or in @cwd '''
+        return run_command(['git'] + list(args), cwd or self.gitdir, stdin=stdin)
+
+    def _clone_args(self):
+        options = self.clone_options
+        args = []
+
+        if options.depth:
+            args.append('--depth=%d' % options.depth)
+        if options.filter:
+            args.append('--filter=%s' % options.filter)
+        if options.single_branch:
+            args.append('--single-branch')
+        elif options.depth:
+            # --depth implies --single-branch
+            args.append('--no-single-branch')
+        if options.branch and (options.single_branch or options.depth):
+            args.append('--branch=%s' % options.branch)
+        if options.no_tags:
+            args.append('--no-tags')
+
+        return args
+
     def clone(self):
-        command = 'git clone %s' % self.repo_url
-        ret, out = run_command(command, self.tempdir.name)
-        if ret != 0:
-            raise GitError('Failed to clone %s:\n%s' % (self.repo_url, out))
+        if self.cache is not None:
+            # clone options are not used here, local clone from the mirror is cheap
+            self._clone_from_cache()
+        else:
+            ret, out = self._git('clone', *self._clone_args(), self.repo_url, cwd=self.tempdir.name)
+            if ret != 0:
+                raise GitError('Failed to clone %s:\n%s' % (self.repo_url, out))
 
         subdirs = os.listdir(self.tempdir.name)
         if len(subdirs) != 1:
@@ -32,38 +80,205 @@ class GitRepo(object):
 
         self.gitdir = self.tempdir.name + '/' + subdirs[0]
 
+    def _clone_from_cache(self):
+        self.cache.update(self.repo_url)
+
+        with self.cache.use(self.repo_url) as mirror:
+            # local clone hardlinks objects from the mirror, no network access needed,
+            # origin is then changed back to the real URL
+            name = os.path.basename(self.repo_url.rstrip('/'))
+            if name.endswith('.git'):
+                name = name[:-4]
+            ret, out = self._git('clone', mirror, name, cwd=self.tempdir.name)
+            if ret == 0:
+                ret, out = self._git('-C', name, 'remote', 'set-url', 'origin', self.repo_url, cwd=self.tempdir.name)
+            if ret != 0:
+                raise GitError('Failed to clone %s from mirror %s:\n%s' % (self.repo_url, mirror, out))
+
+    def update(self):
+        ''' Fetch new commits into an existing clone '''
+        if self.cache is not None:
+            self.cache.update(self.repo_url)
+            with self.cache.use(self.repo_url) as mirror:
+                ret, out = self._git('fetch', '--prune', mirror, '+refs/heads/*:refs/remotes/origin/*',
+                                     '+refs/tags/*:refs/tags/*')
+        else:
+            ret, out = self._git('fetch', '--prune', 'origin')
+        if ret != 0:
+            raise GitError('Failed to fetch %s:\n%s' % (self.repo_url, out))
+
+        # worktrees of the clone removed since the last update
+        self._git('worktree', 'prune')
+        self.outdated = False
+
+    def remote_head(self, branch):
+        ''' Get hash of the head of @branch without cloning the repository
+
+            Uses the mirror cache if available, "git ls-remote" otherwise.
+
+            returns (str): full commit hash or None if @branch is not a branch
+        '''
+        ref = 'refs/heads/%s' % branch
+
+        if self.cache is not None:
+            self.cache.update(self.repo_url)
+            with self.cache.use(self.repo_url) as mirror:
+                ret, out = self._git('rev-parse', '--verify', '--quiet', ref, cwd=mirror)
+            return out if ret == 0 and out else None
+
+        ret, out = run_command(['git', 'ls-remote', self.repo_url, ref])
+        if ret != 0:
+            raise GitError('Failed to get remote head of %s for %s:\n%s' % (branch, self.repo_url, out))
+
+        for line in out.split('\n'):
+            if line.endswith('\t' + ref):
+                return line.split('\t')[0]
+
+        return None
+
+    def _is_shallow(self):
+        ret, out = self._git('rev-parse', '--is-shallow-repository')
+        return ret == 0 and out == 'true'
+
+    def _deepen(self, depth):
+        ''' Fetch @depth more commits of history, all of it if @depth is None '''
+        if depth is None:
+            args = ['fetch', '--unshallow', 'origin']
+        else:
+            args = ['fetch', '--deepen=%d' % depth, 'origin']
+        log.debug('Fetching more history of %s: git %s', self.repo_url, ' '.join(args))
+
+        ret, out = self._git(*args)
+        if ret != 0:
+            raise GitError('Failed to fetch more history of %s:\n%s' % (self.repo_url, out))
+
+    def _with_history(self, func):
+        ''' Call @func until it returns something else than None, deepen the clone
+            every time it doesn't and the clone is shallow
+
+            returns: result of @func or None if it failed even with all the history
+        '''
+        depth = self.clone_options.depth or 1
+        steps = 0
+
+        while True:
+            result = func()
+            if result is not None or not self._is_shallow():
+                return result
+
+            self._deepen(depth * 2 ** steps if steps < DEEPEN_STEPS else None)
+            steps += 1
+
     def last_commit(self, short=True):
-        command = 'git log --perl-regexp --author=\'^((?!%s).*)$\' ' \
-                  '--pretty=format:\'%%%s\' -n 1' % (GIT_USER, 'h' if short else 'H')
-        ret, out = run_command(command, self.gitdir)
+        args = ['log', '--perl-regexp', '--author=^((?!%s).*)$' % GIT_USER,
+                '--pretty=format:%%%s' % ('h' if short else 'H'), '-n', '1']
+
+        def _last_commit():
+            ret, out = self._git(*args)
+            if ret != 0:
+                raise GitError('Failed to get last commit hash for %s:\n%s' % (self.repo_url, out))
+            return out or None
+
+        # all commits in a shallow clone can be from the bot
+        return self._with_history(_last_commit) or ''
+
+    def resolve(self, *revs):
+        ''' Get full hashes of the commits @revs point to, all @revs are resolved by one git process
+
+            returns (list): commit hashes, None for @revs that don't point to a commit
+        '''
+        ret, out = self._git('cat-file', '--batch-check=%(objectname)',
+                             stdin=''.join('%s^{commit}\n' % rev for rev in revs))
         if ret != 0:
-            raise GitError('Failed to get last commit hash for %s:\n%s' % (self.repo_url, out))
+            raise GitError('Failed to resolve %s in %s:\n%s' % (', '.join(revs), self.repo_url, out))
 
-        return out
+        # "<rev> missing" (or "ambiguous") is printed instead of the hash for unknown revisions
+        return [None if ' ' in line else line for line in out.split('\n')]
 
     def last_tag(self):
-        command = 'git tag -l --sort=taggerdate | tail -n 1'
-        ret, out = run_command(command, self.gitdir)
+        ret, out = self._git('for-each-ref', '--sort=taggerdate', '--format=%(refname:strip=2)', 'refs/tags')
         if ret != 0:
             raise GitError('Failed to get last tag for %s:\n%s' % (self.repo_url, out))
 
-        return out
+        return out.split('\n')[-1]
 
     def checkout(self, branch):
-        command = 'git checkout %s' % branch
-        ret, out = run_command(command, self.gitdir)
+        ret, out = self._git('checkout', branch)
         if ret != 0:
             raise GitError('Failed to checkout branch %s:\n%s' % (branch, out))
 
-    def merge(self, branch):
-        # we need to set username and email to make git happy before merging
-        command = 'git config user.email "%s@example.com" && '\
-                  'git config user.name "%s"' % (GIT_USER.lower(), GIT_USER)
-        ret, out = run_command(command, self.gitdir)
+    def _fetch_branch(self, branch):
+        ''' Fetch @branch if it isn't in the clone (e.g. single branch clones) '''
+        if self.resolve('refs/remotes/origin/%s' % branch)[0] is not None:
+            return
+
+        depth = ['--depth=%d' % self.clone_options.depth] if self.clone_options.depth else []
+        ret, out = self._git('fetch', *depth, 'origin', '+refs/heads/%s:refs/remotes/origin/%s' % (branch, branch))
         if ret != 0:
-            raise GitError('Failed to set username and email before merging.\n%s' % out)
+            raise GitError('Failed to fetch branch %s:\n%s' % (branch, out))
 
-        command = 'git merge --ff origin/%s' % branch
-        ret, out = run_command(command, self.gitdir)
+    def merge(self, branch):
+        if self.clone_options.single_branch or self.clone_options.depth:
+            self._fetch_branch(branch)
+
+        if self.clone_options.depth and self.cache is None:
+            def _merge_base():
+                ret, _out = self._git('merge-base', 'HEAD', 'origin/%s' % branch)
+                return True if ret == 0 else None
+
+            # the common ancestor may not be in a shallow clone yet
+            self._with_history(_merge_base)
+
+        # we need to set username and email to make git happy before merging, set
+        # them only for the command, config of the repository may be shared by worktrees
+        ret, out = self._git(*GIT_IDENTITY, 'merge', '--ff', 'origin/%s' % branch)
         if ret != 0:
             raise GitError('Failed to merge brach %s:\n%s' % (branch, out))
+
+
+class GitWorktree(GitRepo):
+    ''' Worktree of a repository clone shared with other projects
+
+        The shared repository is cloned when the first of its worktrees is
+        created. Branches are always checked out with detached HEAD because
+        a branch can't be checked out in more than one worktree.
+    '''
+
+    def __init__(self, repo, lock):
+        super().__init__(repo.repo_url, cache=repo.cache, clone_options=repo.clone_options)
+
+        self.repo = repo
+        self._lock = lock
+
+    def clone(self):
+        path = os.path.join(self.tempdir.name, os.path.basename(self.repo_url.rstrip('/')))
+
+        with self._lock:
+            if self.repo.gitdir is None:
+                self.repo.clone()
+            elif self.repo.outdated:
+                self.repo.update()
+
+            ret, out = self._git('worktree', 'add', '--detach', path, cwd=self.repo.gitdir)
+            if ret != 0:
+                raise GitError('Failed to create worktree for %s:\n%s' % (self.repo_url, out))
+
+        self.gitdir = path
+
+    def _deepen(self, depth):
+        # history is fetched to the shared repository
+        with self._lock:
+            super()._deepen(depth)
+
+    def _fetch_branch(self, branch):
+        with self._lock:
+            super()._fetch_branch(branch)
+
+    def checkout(self, branch):
+        # use the remote branch if it exists, @branch can be also a tag or a commit
+        remote = self.resolve('refs/remotes/origin/%s' % branch)[0]
+        rev = 'origin/%s' % branch if remote is not None else branch
+
+        ret, out = self._git('checkout', '--detach', rev)
+        if ret != 0:
+            raise GitError('Failed to checkout branch %s:\n%s' % (branch, out))
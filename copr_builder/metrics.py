@@ -0,0 +1,129 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+from collections import namedtuple
+from contextlib import contextmanager
+
+
+# @project -- name of the project (config section)
+# @phase -- name of the phase (e.g. "clone" or "srpm")
+# @timestamp -- when the phase started (seconds since epoch)
+# @duration -- how long the phase took (seconds)
+# @bytes -- size of the data the phase created or sent (e.g. size of the SRPM) if known
+# @outcome -- "success", "failed" or final state of the Copr build
+# @cpu_time -- CPU time of the command run in the phase (seconds) if known
+# @max_rss -- maximum resident set size of the command run in the phase (bytes) if known
+PhaseRecord = namedtuple('PhaseRecord', ['project', 'phase', 'timestamp', 'duration', 'bytes', 'outcome',
+                                         'cpu_time', 'max_rss'])
+
+PROMETHEUS_PREFIX = 'copr_builder'
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _write_atomic(path, content):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', dir=directory, delete=False, encoding='utf-8') as f:
+        f.write(content)
+    os.chmod(f.name, 0o644)
+    os.replace(f.name, path)
+
+
+class Metrics(object):
+    ''' Duration, size and outcome of the build phases of each project
+
+        Only the last record of each phase of a project is kept. Records can
+        be saved as a JSON report and as a textfile for the node exporter
+        textfile collector.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records = {}
+
+    def record(self, project, phase, duration, outcome='success', size=None, timestamp=None, cpu_time=None,
+               max_rss=None):
+        if timestamp is None:
+            timestamp = time.time() - duration
+
+        with self._lock:
+            self._records[(project, phase)] = PhaseRecord(project, phase, timestamp, duration, size, outcome,
+                                                          cpu_time, max_rss)
+
+    @contextmanager
+    def phase(self, project, phase):
+        ''' Measure duration of a phase of @project, the phase failed if the block raises an exception
+
+            Yields a dictionary, size of the data the phase created can be set as its "bytes" value
+            and resources used by the command run in the phase as "cpu_time" and "max_rss".
+        '''
+        result = {'bytes': None, 'cpu_time': None, 'max_rss': None}
+        timestamp = time.time()
+        start = time.monotonic()
+        outcome = 'failed'
+        try:
+            yield result
+            outcome = 'success'
+        finally:
+            self.record(project, phase, time.monotonic() - start, outcome, result['bytes'], timestamp,
+                        result['cpu_time'], result['max_rss'])
+
+    def project(self, project):
+        ''' Get metrics bound to @project '''
+        return ProjectMetrics(self, project)
+
+    @property
+    def records(self):
+        with self._lock:
+            return sorted(self._records.values())
+
+    def write_json(self, path):
+        ''' Save all records to @path as a JSON report '''
+        report = {'timestamp': time.time(), 'phases': [r._asdict() for r in self.records]}
+        _write_atomic(path, json.dumps(report, indent=2))
+
+    def write_textfile(self, path):
+        ''' Save all records to @path in the Prometheus text format '''
+        metrics = (('phase_duration_seconds', 'Duration of the last run of the phase.', lambda r: r.duration),
+                   ('phase_bytes', 'Size of the data created or sent by the last run of the phase.', lambda r: r.bytes),
+                   ('phase_success', 'Whether the last run of the phase was successful.',
+                    lambda r: 1 if r.outcome in ('success', 'succeeded') else 0),
+                   ('phase_timestamp_seconds', 'When the last run of the phase started.', lambda r: r.timestamp),
+                   ('phase_cpu_seconds', 'CPU time of the command run in the last run of the phase.',
+                    lambda r: r.cpu_time),
+                   ('phase_max_rss_bytes', 'Peak memory of the command run in the last run of the phase.',
+                    lambda r: r.max_rss))
+
+        lines = []
+        records = self.records
+        for name, description, value in metrics:
+            name = '%s_%s' % (PROMETHEUS_PREFIX, name)
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s gauge' % name)
+            for record in records:
+                if value(record) is None:
+                    continue
+                lines.append('%s{project="%s",phase="%s"} %s' % (name, _label(record.project), _label(record.phase),
+                                                                 repr(float(value(record)))))
+
+        _write_atomic(path, '\n'.join(lines) + '\n')
+
+
+class ProjectMetrics(object):
+    ''' Metrics of one project, see Metrics '''
+
+    def __init__(self, metrics, project):
+        self.metrics = metrics
+        self.project = project
+
+    def phase(self, phase):
+        return self.metrics.phase(self.project, phase)
+
+    def record(self, phase, duration, outcome='success', size=None, timestamp=None, cpu_time=None, max_rss=None):
+        self.metrics.record(self.project, phase, duration, outcome, size, timestamp, cpu_time, max_rss)
@@ -0,0 +1,158 @@
+import datetime
+
+from collections import namedtuple
+
+from .git_repo import GIT_USER
+
+
+# packages needed by the generated script itself
+SCRIPT_BUILDDEPS = ['git-core', 'python3', 'python3-packaging']
+
+# directory (relative to the working directory of the script) Copr takes the spec and sources from
+SCRIPT_RESULTDIR = 'sources'
+
+
+# @script -- script generating the spec and sources in Copr
+# @commit -- commit the sources are generated from
+# @builddeps -- packages needed to run the script
+# @chroot -- chroot to run the script in (None for the Copr default)
+ScmSource = namedtuple('ScmSource', ['script', 'commit', 'builddeps', 'chroot'])
+
+
+# Runs the same steps as SRPMBuilder and CoprProject do locally (see _make_srpm): clones
+# the repository, runs the pre-archive and archive commands, bumps the release in the spec
+# file the way CoprProject._new_version does and points the Source lines to the archives.
+SCRIPT = '''#!/usr/bin/python3
+# generated by copr-builder for {package}
+
+import glob
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tarfile
+
+from packaging.version import Version
+
+GIT_URL = {git_url!r}
+COMMIT = {commit!r}
+PRE_ARCHIVE_CMD = {pre_archive_cmd!r}
+ARCHIVE_CMD = {archive_cmd!r}
+ARCHIVE_GLOB = {archive_glob!r}
+LAST_VERSION = {last_version!r}
+DATE = {date!r}
+GIT_USER = {git_user!r}
+
+GIT_DIR = os.path.abspath({resultdir!r})
+
+
+def run(command):
+    print('+ %s' % command, flush=True)
+    subprocess.run(command, shell=isinstance(command, str), cwd=GIT_DIR, check=True)
+
+
+def output(command):
+    return subprocess.run(command, cwd=GIT_DIR, check=True, stdout=subprocess.PIPE,
+                          universal_newlines=True).stdout.strip()
+
+
+def dir_index():
+    index = {{}}
+    for entry in os.scandir(GIT_DIR):
+        index[entry.name] = (entry.stat().st_size, entry.stat().st_mtime_ns) if entry.is_file() else None
+    return index
+
+
+def find_spec():
+    for pattern in ('*.spec', '*.spec.in'):
+        specs = glob.glob(os.path.join(GIT_DIR, pattern)) + glob.glob(os.path.join(GIT_DIR, '*', pattern))
+        if len(specs) > 1:
+            sys.exit('Found more than one file that looks a spec file.')
+        if specs:
+            return specs[0]
+    sys.exit('Failed to find a spec file.')
+
+
+def new_release(version, release):
+    spec_build = int(release.split('%')[0].split('.')[0])
+    if LAST_VERSION is None or Version(version) > Version(LAST_VERSION[0]):
+        return str(spec_build + 1)
+    if Version(version) == Version(LAST_VERSION[0]):
+        return str(int(LAST_VERSION[1]) + 1)
+    sys.exit('Version from spec is older than last build in Copr')
+
+
+def main():
+    subprocess.run(['git', 'clone', '--no-checkout', GIT_URL, GIT_DIR], check=True)
+    run(['git', 'checkout', '--detach', COMMIT])
+    git_hash = output(['git', 'log', '--perl-regexp', '--author=^((?!%s).*)$' % GIT_USER,
+                       '--pretty=format:%h', '-n', '1'])
+
+    if PRE_ARCHIVE_CMD:
+        run(PRE_ARCHIVE_CMD)
+
+    before = dir_index()
+    run(ARCHIVE_CMD)
+    after = dir_index()
+
+    if ARCHIVE_GLOB:
+        archives = sorted(p for p in glob.glob(os.path.join(GIT_DIR, ARCHIVE_GLOB)) if os.path.isfile(p))
+    else:
+        archives = sorted(os.path.join(GIT_DIR, name) for name, stat in after.items() if before.get(name) != stat)
+        archives = [p for p in archives if os.path.isfile(p) and tarfile.is_tarfile(p)]
+    if not archives:
+        sys.exit('Failed to find source archive after creating it.')
+
+    # Copr takes the sources from the top directory
+    for archive in archives:
+        if os.path.dirname(archive) != GIT_DIR:
+            shutil.copy(archive, GIT_DIR)
+    archives = [os.path.basename(a) for a in archives]
+
+    spec = find_spec()
+    with open(spec, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+
+    version = next(line.split('Version:')[1].strip() for line in lines if line.startswith('Version:'))
+    release = next(line.split('Release:')[1].strip() for line in lines if line.startswith('Release:'))
+    release = 'Release: %s.%sgit%s%%{{?dist}}\\n' % (new_release(version, release), DATE, git_hash)
+
+    for idx, line in enumerate(lines):
+        if line.startswith('Release:'):
+            lines[idx] = release
+        elif line.startswith('Source'):
+            match = re.search(r"Source([0-9]+):\\s+(\\S+)", line)
+            if match and match.group(2) not in after:
+                if not archives:
+                    sys.exit('Found Source%s in SPEC, but not enough sources generated.' % match.group(1))
+                lines[idx] = 'Source%s: %s\\n' % (match.group(1), archives.pop(0))
+
+    name = os.path.basename(spec)
+    if name.endswith('.in'):
+        name = name[:-len('.in')]
+    with open(os.path.join(GIT_DIR, name), 'w', encoding='utf-8') as f:
+        f.writelines(lines)
+
+
+if __name__ == '__main__':
+    main()
+'''
+
+
+def make_source(package, git_url, commit, archive_cmd, pre_archive_cmd=None, archive_glob=None, last_version=None,
+                builddeps=None, chroot=None):
+    ''' Create source for a Copr build running the archive commands of @package in Copr
+
+        @last_version -- CoprBuilderVersion of the last build in Copr (or None)
+        @builddeps -- additional packages needed by the archive commands
+
+        returns (ScmSource): the source
+    '''
+    script = SCRIPT.format(package=package, git_url=git_url, commit=commit, pre_archive_cmd=pre_archive_cmd,
+                           archive_cmd=archive_cmd, archive_glob=archive_glob,
+                           last_version=(last_version.version, last_version.build) if last_version else None,
+                           date=datetime.date.today().strftime('%Y%m%d'), git_user=GIT_USER,
+                           resultdir=SCRIPT_RESULTDIR)
+
+    return ScmSource(script, commit, SCRIPT_BUILDDEPS + (builddeps or []), chroot)
@@ -0,0 +1,107 @@
+import os
+import re
+import tempfile
+
+from . import CoprBuilderVersion
+from .errors import SRPMBuilderError
+
+
+SOURCE_RE = re.compile(r"Source([0-9]+):\s+(\S+)")
+
+
+def spec_release(version):
+    ''' Release (without dist) for @version (CoprBuilderVersion) as written to the spec '''
+    return '%s.%sgit%s' % (version.build, version.date, version.git_hash)
+
+
+class SpecFile(object):
+    ''' Spec file parsed once
+
+        Version, Release and Source lines are indexed when the file is read,
+        changes are kept in memory until write is called.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(self.path, 'r', encoding='utf-8') as f:
+            self._lines = f.readlines()
+
+        self._version_lines = []
+        self._release_lines = []
+        self._source_lines = []
+        self._modified = False
+
+        for idx, line in enumerate(self._lines):
+            if line.startswith('Version:'):
+                self._version_lines.append(idx)
+            elif line.startswith('Release:'):
+                self._release_lines.append(idx)
+            elif line.startswith('Source'):
+                self._source_lines.append(idx)
+
+    @property
+    def modified(self):
+        return self._modified
+
+    def _value(self, lines, tag):
+        if not lines:
+            return None
+        return self._lines[lines[0]].split(tag)[1].strip()
+
+    @property
+    def version(self):
+        ''' Version and release (without dist and other macros) from the spec
+
+            :rtype: CoprBuilderVersion
+        '''
+        version = self._value(self._version_lines, 'Version:')
+        release = self._value(self._release_lines, 'Release:')
+
+        if not (version and release):
+            raise SRPMBuilderError('Failed to extract version and release from spec file %s' % self.path)
+
+        return CoprBuilderVersion(version, release.split('%')[0], None, None)
+
+    @version.setter
+    def version(self, new_version):
+        for idx in self._version_lines:
+            self._lines[idx] = 'Version: %s\n' % new_version.version
+        for idx in self._release_lines:
+            self._lines[idx] = 'Release: %s%%{?dist}\n' % spec_release(new_version)
+        self._modified = True
+
+    @property
+    def sources(self):
+        ''' Source lines from the spec as a list of (number, name) tuples '''
+        sources = []
+        for idx in self._source_lines:
+            m = SOURCE_RE.search(self._lines[idx])
+            if not m:
+                raise SRPMBuilderError('Failed to parse Source line: %s' % self._lines[idx])
+            sources.append((int(m.group(1)), m.group(2)))
+
+        return sources
+
+    @sources.setter
+    def sources(self, new_sources):
+        if len(new_sources) != len(self._source_lines):
+            raise SRPMBuilderError('Expected %d sources, got %d.' % (len(self._source_lines), len(new_sources)))
+
+        for idx, (source_num, source_name) in zip(self._source_lines, new_sources):
+            self._lines[idx] = 'Source%d: %s\n' % (source_num, source_name)
+        self._modified = True
+
+    def write(self):
+        ''' Write changes back to the spec file '''
+        if not self._modified:
+            return
+
+        spec_dir = os.path.dirname(os.path.abspath(self.path))
+        mode = os.stat(self.path).st_mode
+        with tempfile.NamedTemporaryFile('w', dir=spec_dir, delete=False, encoding='utf-8') as f:
+            f.writelines(self._lines)
+        os.chmod(f.name, mode)
+        os.replace(f.name, self.path)
+
+        self._modified = False
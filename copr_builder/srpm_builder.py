@@ -1,14 +1,15 @@
+import contextlib
 import glob
 import logging
 import os
-import re
 import tarfile
 
-from . import GIT_URL_CONF, PACKAGE_CONF, PRE_ARCHIVE_CMD_CONF, ARCHIVE_CMD_CONF, GIT_BRANCH_CONF, \
-    GIT_MERGE_BRANCH_CONF, CoprBuilderVersion
+from . import GIT_URL_CONF, PACKAGE_CONF, PRE_ARCHIVE_CMD_CONF, ARCHIVE_CMD_CONF, ARCHIVE_GLOB_CONF, \
+    COMMAND_TIMEOUT_CONF, GIT_BRANCH_CONF, GIT_MERGE_BRANCH_CONF
 from .errors import SRPMBuilderError
 from .git_repo import GitRepo
-from .utils import run_command
+from .spec_file import SpecFile
+from .utils import stream_command
 
 
 log = logging.getLogger("copr.builder")
@@ -16,17 +17,27 @@ log = logging.getLogger("copr.builder")
 
 class SRPMBuilder(object):
 
-    def __init__(self, project_data, git_dir=None):
+    def __init__(self, project_data, git_dir=None, git_repo=None, metrics=None):
 
         self.project_data = project_data
 
-        self._spec_file = None
+        # ProjectMetrics for measuring the build phases
+        self.metrics = metrics
+
+        self._spec = None
         self._archives = None
+        self._git_files = None
+
+        # commit checked out in prepare_build before merging git_merge_branch
+        self.source_commit = None
+
+        # "version-release" (without dist) of the SRPM created by build
+        self.srpm_version = None
 
         if git_dir is None:
-            self.git_repo = GitRepo(project_data[GIT_URL_CONF])
-            self.git_repo.clone()
-            self.git_dir = self.git_repo.gitdir
+            # the repository is cloned later in prepare_build
+            self.git_repo = git_repo or GitRepo(project_data[GIT_URL_CONF])
+            self.git_dir = None
         else:
             os.chdir(git_dir)
             self.git_dir = git_dir
@@ -34,11 +45,44 @@ class SRPMBuilder(object):
 
         self._log_prefix = 'Package %s:' % self.project_data[PACKAGE_CONF]
 
+    def _measure(self, phase):
+        if self.metrics is None:
+            return contextlib.nullcontext({})
+        return self.metrics.phase(phase)
+
+    def _run(self, name, command, on_line=None, measured=None):
+        ''' Run @command in the git directory, output is logged and only its end is kept
+
+            CPU time and memory used by the command are saved to @measured (see Metrics.phase).
+
+            returns (tuple): return code and the end of the output
+        '''
+        timeout = self.project_data.get(COMMAND_TIMEOUT_CONF)
+        res = stream_command(command, self.git_dir, timeout=float(timeout) if timeout else None,
+                             logger=log, log_prefix=self._log_prefix, on_line=on_line)
+
+        if measured is not None:
+            measured['cpu_time'] = res.cpu_time
+            measured['max_rss'] = res.max_rss * 1024
+        log.debug('%s Command "%s" finished in %.1f s (CPU time %.1f s, max RSS %d KiB).',
+                  self._log_prefix, name, res.duration, res.cpu_time, res.max_rss)
+
+        return res.returncode, res.output
+
+    @property
+    def spec(self):
+        ''' Parsed spec file of this project
+
+        The spec file is located and parsed on first access, it might be generated
+        by the archive command so don't use this before running make_archive.
+        '''
+        if self._spec is None:
+            self._spec = SpecFile(self._locate_spec_file())
+        return self._spec
+
     @property
     def spec_file(self):
-        if self._spec_file is None:
-            self._spec_file = self._locate_spec_file()
-        return self._spec_file
+        return self.spec.path
 
     @property
     def archives(self):
@@ -55,66 +99,49 @@ class SRPMBuilder(object):
     def spec_version(self):
         ''' Get version from spec file '''
 
-        version = None
-        release = None
-        spec = self._locate_spec_file()
-
-        with open(spec, 'r', encoding='utf-8') as f:
-            for line in f:
-                if line.startswith('Version:'):
-                    version = line.split('Version:')[1].strip()
-                elif line.startswith('Release:'):
-                    release = line.split('Release:')[1].strip()
-
-                if version and release:
-                    break
+        version = self.spec.version
 
-        if not (version and release):
-            raise SRPMBuilderError('Failed to extract version and release from spec file %s' % spec)
+        log.debug('%s Spec version: %s-%s', self._log_prefix, version.version, version.build)
 
-        release = release.split('%')[0]
-
-        log.debug('%s Spec version: %s-%s', self._log_prefix, version, release)
-
-        return CoprBuilderVersion(version, release, None, None)
+        return version
 
     @spec_version.setter
     def spec_version(self, new_version):
         ''' Update version in spec file so the build number is always higher '''
 
-        spec_file = self._locate_spec_file()
-
-        new_spec = []
+        self.spec.version = new_version
 
-        with open(spec_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                if line.startswith('Version:'):
-                    new_spec.append('Version: %s\n' % new_version.version)
-                elif line.startswith('Release:'):
-                    new_spec.append('Release: %s.%sgit%s%%{?dist}\n' % (new_version.build,
-                                                                        new_version.date,
-                                                                        new_version.git_hash))
-                else:
-                    new_spec.append(line)
+        log.debug('%s Spec version updated.', self._log_prefix)
 
-        with open(spec_file, 'w', encoding='utf-8') as f:
-            for line in new_spec:
-                f.write(line)
+    @property
+    def rpmdir(self):
+        ''' Directory for the generated SRPM '''
+        return os.path.join(self.git_dir, 'packaging')
 
-        log.debug('%s Spec version updated.', self._log_prefix)
+    def read_spec(self):
+        ''' Get content of the spec file as it is now '''
+        with open(self._locate_spec_file(), 'r', encoding='utf-8') as f:
+            return f.read()
 
     def prepare_build(self):
         # checkout to the right branch if needed
         if self.git_repo is None:
             raise SRPMBuilderError('Prepare build called but GitRepo is not set.')
 
-        self.git_repo.checkout(self.project_data[GIT_BRANCH_CONF])
+        with self._measure('prepare'):
+            if self.git_dir is None:
+                with self._measure('clone'):
+                    self.git_repo.clone()
+                self.git_dir = self.git_repo.gitdir
+
+            self.git_repo.checkout(self.project_data[GIT_BRANCH_CONF])
+            self.source_commit = self.git_repo.resolve('HEAD')[0]
 
-        # and do the merge if we want to
-        if GIT_MERGE_BRANCH_CONF in self.project_data.keys():
-            self.git_repo.merge(self.project_data[GIT_MERGE_BRANCH_CONF])
+            # and do the merge if we want to
+            if GIT_MERGE_BRANCH_CONF in self.project_data.keys():
+                self.git_repo.merge(self.project_data[GIT_MERGE_BRANCH_CONF])
 
-        self._run_prepare_archive_commands()
+            self._run_prepare_archive_commands()
 
     def _run_prepare_archive_commands(self):
         '''Running commands to prepare archive process.
@@ -127,71 +154,88 @@ class SRPMBuilder(object):
         log.debug('%s Running prepare archive commands.', self._log_prefix)
 
         command = str(self.project_data[PRE_ARCHIVE_CMD_CONF])
-        ret, out = run_command(command, self.git_dir)
-        if ret != 0:
-            raise SRPMBuilderError('Failed to run prepare archive commands for %s:\n%s' % (self.project_data[PACKAGE_CONF], out))
+        with self._measure('pre_archive') as measured:
+            ret, out = self._run('pre_archive', command, measured=measured)
+            if ret != 0:
+                raise SRPMBuilderError('Failed to run prepare archive commands for %s:\n%s' % (self.project_data[PACKAGE_CONF], out))
 
     def make_archive(self):
-        self._archives = self._make_archive()
-        self._set_source(self._archives)
+        with self._measure('archive') as measured:
+            self._archives = self._make_archive(measured)
+            measured['bytes'] = sum(os.path.getsize(a) for a in self._archives)
+        # _set_source takes the archives from the list, keep ours for removing them later
+        self._set_source(list(self._archives))
 
     def build(self):
         if self._archives is None:
             raise ValueError('You must create archive first!')
-        srpm = self._make_srpm(self._archives)
+        with self._measure('srpm') as measured:
+            srpm = self._make_srpm(self._archives, measured)
+            measured['bytes'] = os.path.getsize(srpm)
+
+        version = self.spec.version
+        self.srpm_version = '%s-%s' % (version.version, version.build)
 
         return srpm
 
     def _set_source(self, archive_names):
-        spec_file = self._locate_spec_file()
-
-        new_spec = []
-
-        with open(spec_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                if line.startswith('Source'):
-                    m = re.search(r"Source([0-9]+):\s+(\S+)", line)
-                    if not m or len(m.groups()) != 2:
-                        raise SRPMBuilderError('Failed to parse Source line: %s' % line)
-
-                    source_num = int(m.groups()[0])
-                    source_name = m.groups()[1]
-
-                    if source_name in os.listdir(self.git_dir):
-                        # this source is already present in the git directory, we can just add it as is
-                        new_spec.append('Source%d: %s\n' % (source_num, source_name))
-                    else:
-                        # try adding a next archive we generated in `make_archive`
-                        try:
-                            archive_name = archive_names.pop(0)
-                        except IndexError:
-                            # pylint: disable=raise-missing-from
-                            raise SRPMBuilderError('Found Source%d in SPEC, but only %d sources generated.' % (source_num,
-                                                                                                               len(archive_names)))
-                        new_spec.append('Source%d: %s\n' % (source_num,
-                                                            archive_name))
-                else:
-                    new_spec.append(line)
-
-        with open(spec_file, 'w', encoding='utf-8') as f:
-            for line in new_spec:
-                f.write(line)
+        new_sources = []
+        for source_num, source_name in self.spec.sources:
+            if source_name in self._git_files:
+                # this source is already present in the git directory, we can just add it as is
+                new_sources.append((source_num, source_name))
+            else:
+                # try adding a next archive we generated in `make_archive`
+                try:
+                    archive_name = archive_names.pop(0)
+                except IndexError:
+                    # pylint: disable=raise-missing-from
+                    raise SRPMBuilderError('Found Source%d in SPEC, but only %d sources generated.' % (source_num,
+                                                                                                       len(archive_names)))
+                new_sources.append((source_num, archive_name))
+
+        self.spec.sources = new_sources
 
         log.debug('%s Spec source updated.', self._log_prefix)
 
-    def _make_archive(self):
+    def _dir_index(self):
+        ''' Get size and modification time of files in the git directory '''
+        index = {}
+        with os.scandir(self.git_dir) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    index[entry.name] = (stat.st_size, stat.st_mtime_ns)
+                else:
+                    index[entry.name] = None
+
+        return index
+
+    def _make_archive(self, measured=None):
         ''' Create source archive for this project '''
 
         log.debug('%s Started creating source archive.', self._log_prefix)
 
+        before = self._dir_index()
+
         command = str(self.project_data[ARCHIVE_CMD_CONF])
-        ret, out = run_command(command, self.git_dir)
+        ret, out = self._run('archive', command, measured=measured)
         if ret != 0:
             raise SRPMBuilderError('Failed to create source archive for %s:\n%s' % (self.project_data[PACKAGE_CONF], out))
 
-        # archive should be created, get everything that looks like one
-        paths = [os.path.join(self.git_dir, f) for f in os.listdir(self.git_dir)]
-        archives = [p for p in paths if (os.path.isfile(p) and tarfile.is_tarfile(p))]
+        # files in the git directory after running the archive command, used in _set_source too
+        after = self._dir_index()
+        self._git_files = set(after.keys())
+
+        if ARCHIVE_GLOB_CONF in self.project_data:
+            pattern = os.path.join(self.git_dir, str(self.project_data[ARCHIVE_GLOB_CONF]))
+            archives = sorted(p for p in glob.glob(pattern) if os.path.isfile(p))
+        else:
+            # archives are the files created or changed by the archive command
+            archives = sorted(os.path.join(self.git_dir, name) for name, stat in after.items()
+                              if before.get(name) != stat)
+            archives = [p for p in archives if os.path.isfile(p) and tarfile.is_tarfile(p)]
+
         if not archives:
             raise SRPMBuilderError('Failed to find source archive after creating it.')
 
@@ -199,22 +243,32 @@ class SRPMBuilder(object):
 
         return archives
 
-    def _make_srpm(self, archives):
+    def _make_srpm(self, archives, measured=None):
         ''' Create SRPM using spec and source archive '''
 
         pkg_name = self.project_data[PACKAGE_CONF]
 
         # create 'packaging' directory in gitdir
-        rpmdir = os.path.join(self.git_dir, 'packaging')
+        rpmdir = self.rpmdir
         if not os.path.exists(rpmdir):
             os.mkdir(rpmdir)
 
+        # all changes to the spec are written at once right before building the srpm
+        self.spec.write()
+
         # build the srpm
         data = {'srcdir': self.git_dir, 'rpmdir': rpmdir, 'spec': self.spec_file}
         command = 'rpmbuild -bs --define "_sourcedir {srcdir}" --define "_specdir {rpmdir}"' \
                   ' --define "_builddir {rpmdir}" --define "_srcrpmdir {rpmdir}"' \
                   ' --define "_rpmdir {rpmdir}" {spec}'.format(**data)
-        ret, out = run_command(command, self.git_dir)
+        written = []
+
+        def _wrote(line):
+            # XXX: we assume there is only one line starting with "Wrote:"
+            if line.startswith('Wrote:'):
+                written.append(line.split('Wrote:')[1].strip())
+
+        ret, out = self._run('srpm', command, on_line=_wrote, measured=measured)
 
         # remove the source archives, we no longer need it
         for archive in archives:
@@ -223,13 +277,9 @@ class SRPMBuilder(object):
         if ret != 0:
             raise SRPMBuilderError('SPRM generation failed:\n %s' % out)
 
-        srpm = None
-        for line in out.split("\n"):
-            # XXX: we assume there is only one line starting with "Wrote:"
-            if line.startswith('Wrote:'):
-                srpm = line.split('Wrote:')[1].strip()
-                log.info('%s SRPM built for %s: %s', self._log_prefix, pkg_name, srpm)
-                break
+        srpm = written[0] if written else None
+        if srpm:
+            log.info('%s SRPM built for %s: %s', self._log_prefix, pkg_name, srpm)
 
         if not srpm or not os.path.exists(srpm):
             raise SRPMBuilderError('Cannot find the generated SRPM "%s"' % srpm)
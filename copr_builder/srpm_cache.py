@@ -0,0 +1,100 @@
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+
+from contextlib import contextmanager
+
+log = logging.getLogger("copr.builder")
+
+
+class SRPMCache(object):
+    ''' Cache of generated SRPMs
+
+        SRPMs are stored under a key computed from everything that affects
+        their content (see srpm_key), so an SRPM generated by a run that
+        failed to submit it can be reused by the next run. Least recently
+        used SRPMs are removed when the cache grows over @max_size bytes.
+    '''
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self.max_size = max_size
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def srpm_key(*values):
+        ''' Compute cache key from @values '''
+        sha = hashlib.sha256()
+        for value in values:
+            sha.update(repr(value).encode())
+            sha.update(b'\0')
+
+        return sha.hexdigest()
+
+    @contextmanager
+    def _lock(self):
+        with open(os.path.join(self.cache_dir, '.lock'), 'a', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get(self, key, dest_dir):
+        ''' Copy SRPM with @key to @dest_dir
+
+            returns (str): path to the copied SRPM or None if there is no SRPM with @key
+        '''
+        entry = os.path.join(self.cache_dir, key)
+
+        with self._lock():
+            if not os.path.isdir(entry):
+                return None
+
+            srpms = os.listdir(entry)
+            if len(srpms) != 1:
+                return None
+
+            cached = os.path.join(entry, srpms[0])
+            srpm = os.path.join(dest_dir, srpms[0])
+            shutil.copy2(cached, srpm)
+
+            # mark as recently used
+            os.utime(entry)
+
+        return srpm
+
+    def put(self, key, srpm):
+        ''' Save @srpm to the cache under @key '''
+        entry = os.path.join(self.cache_dir, key)
+
+        with self._lock():
+            if os.path.exists(entry):
+                return
+
+            tmp_entry = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp')
+            shutil.copy2(srpm, tmp_entry)
+            os.rename(tmp_entry, entry)
+
+            self._evict()
+
+    def _entry_size(self, entry):
+        path = os.path.join(self.cache_dir, entry)
+        return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+    def _evict(self):
+        entries = [e for e in os.listdir(self.cache_dir) if not e.startswith('.')]
+        entries.sort(key=lambda e: os.path.getmtime(os.path.join(self.cache_dir, e)))
+        sizes = {e: self._entry_size(e) for e in entries}
+
+        total = sum(sizes.values())
+        for entry in entries:
+            if total <= self.max_size:
+                break
+            log.debug('Removing %s from the SRPM cache.', entry)
+            shutil.rmtree(os.path.join(self.cache_dir, entry))
+            total -= sizes[entry]
@@ -1,17 +1,178 @@
+import collections
+import functools
+import hashlib
+import logging
 import os
+import signal
 import subprocess
+import threading
+import time
 
+from contextlib import contextmanager
 
-def run_command(command, cwd=None):
+
+_log_buffer = threading.local()
+_log_flush_lock = threading.Lock()
+
+# number of last lines of output kept by stream_command
+OUTPUT_LINES = 100
+
+# how often stream_command checks whether a command with closed output finished
+WAIT_INTERVAL = 0.1
+
+# result of stream_command
+# @returncode -- exit code of the command, negative signal number if it was killed
+# @output -- last OUTPUT_LINES lines of the output (stdout and stderr)
+# @timed_out -- whether the command was killed because of the timeout
+# @duration -- wall-clock time in seconds
+# @cpu_time -- user and system CPU time of the command and its children in seconds
+# @max_rss -- maximum resident set size of the command or its children in KiB
+CommandResult = collections.namedtuple('CommandResult', ['returncode', 'output', 'timed_out', 'duration',
+                                                         'cpu_time', 'max_rss'])
+
+
+@functools.lru_cache(maxsize=None)
+def _command_env():
+    # copied only once, the environment is the same for all commands
     env = os.environ.copy()
     env["LC_ALL"] = "C"
+    return env
+
 
-    res = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE,
-                           stderr=subprocess.PIPE, cwd=cwd, env=env)
+def run_command(command, cwd=None, stdin=None):
+    ''' Run @command, a string is run using shell, a list of arguments is executed directly
 
-    out, err = res.communicate()
+        @stdin (str) is written to standard input of the command
+    '''
+    res = subprocess.Popen(command, shell=isinstance(command, str), stdout=subprocess.PIPE,
+                           stderr=subprocess.PIPE, stdin=subprocess.PIPE if stdin is not None else None,
+                           cwd=cwd, env=_command_env())
+
+    out, err = res.communicate(stdin.encode() if stdin is not None else None)
     if res.returncode != 0:
         output = out.decode().strip() + '\n' + err.decode().strip()
     else:
         output = out.decode().strip()
     return (res.returncode, output)
+
+
+def _exit_code(status):
+    # os.waitstatus_to_exitcode is available since Python 3.9
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def stream_command(command, cwd=None, timeout=None, logger=None, log_prefix='', on_line=None):
+    ''' Run @command and process its output line by line
+
+        Only the last OUTPUT_LINES lines of the output are kept in memory. Every
+        line is logged to @logger (on debug level) and passed to @on_line, in
+        a thread with buffered log (see buffered_log) only the kept lines are
+        logged when the command finishes. The command and all its children are
+        killed after @timeout seconds.
+
+        returns (CommandResult): result of the command
+    '''
+    start = time.monotonic()
+    deadline = start + timeout if timeout is not None else None
+
+    # new session so the command can be killed together with everything it started
+    res = subprocess.Popen(command, shell=isinstance(command, str), stdout=subprocess.PIPE,
+                           stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL, cwd=cwd,
+                           env=_command_env(), start_new_session=True)
+
+    lines = collections.deque(maxlen=OUTPUT_LINES)
+
+    # buffered log would keep all the lines in memory
+    buffered = getattr(_log_buffer, 'records', None) is not None
+
+    def _read():
+        for raw in res.stdout:
+            line = raw.decode(errors='replace').rstrip('\n')
+            lines.append(line)
+            if logger is not None and not buffered:
+                logger.debug('%s %s', log_prefix, line)
+            if on_line is not None:
+                on_line(line)
+
+    def _kill():
+        try:
+            os.killpg(res.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        lines.append('Command timed out after %d seconds.' % timeout)
+
+    reader = threading.Thread(target=_read, daemon=True)
+    reader.start()
+    reader.join(timeout)
+
+    timed_out = reader.is_alive()
+    if timed_out:
+        _kill()
+        reader.join()
+    res.stdout.close()
+
+    # the command may close (or redirect) its output and keep running
+    pid = 0
+    while not timed_out and deadline is not None and pid == 0:
+        pid, status, rusage = os.wait4(res.pid, os.WNOHANG)
+        if pid == 0:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                timed_out = True
+                _kill()
+            else:
+                time.sleep(min(remaining, WAIT_INTERVAL))
+    if pid == 0:
+        _pid, status, rusage = os.wait4(res.pid, 0)
+    # the process is already reaped, don't let Popen wait for it again
+    res.returncode = _exit_code(status)
+
+    if logger is not None and buffered and lines:
+        logger.debug('%s Last %d lines of output:\n%s', log_prefix, len(lines), '\n'.join(lines))
+
+    return CommandResult(res.returncode, '\n'.join(lines).strip(), timed_out, time.monotonic() - start,
+                         rusage.ru_utime + rusage.ru_stime, rusage.ru_maxrss)
+
+
+class _LogBufferFilter(logging.Filter):
+    ''' Hold back records logged from threads with an active log buffer '''
+
+    def filter(self, record):
+        records = getattr(_log_buffer, 'records', None)
+        if records is None:
+            return True
+
+        records.append(record)
+        return False
+
+
+@contextmanager
+def buffered_log(logger):
+    ''' Collect all messages logged to @logger from the current thread and
+        emit them together when the block ends, so output of projects
+        processed in parallel is not interleaved.
+    '''
+    if not any(isinstance(f, _LogBufferFilter) for f in logger.filters):
+        logger.addFilter(_LogBufferFilter())
+
+    records = []
+    _log_buffer.records = records
+    try:
+        yield
+    finally:
+        _log_buffer.records = None
+        with _log_flush_lock:
+            for record in records:
+                logger.handle(record)
+
+
+def file_hash(path):
+    ''' SHA-256 hash of the file at @path '''
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+
+    return sha.hexdigest()
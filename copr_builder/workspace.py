@@ -0,0 +1,73 @@
+import logging
+import os
+import threading
+
+from .git_repo import GitRepo, GitWorktree
+
+log = logging.getLogger("copr.builder")
+
+
+class Workspace(object):
+    ''' Git repositories and SRPMs shared by projects built in one run
+
+        Projects with the same git URL share one clone of the repository and
+        each of them gets its own worktree. SRPMs are remembered so projects
+        that would create the same SRPM can reuse it instead of running
+        the archive command and rpmbuild again.
+    '''
+
+    def __init__(self, git_cache=None):
+        self.git_cache = git_cache
+
+        self._lock = threading.Lock()
+        self._repos = {}
+        self._repo_locks = {}
+        self._srpms = {}
+        self._srpm_locks = {}
+
+    def git_repo(self, repo_url, clone_options=None):
+        ''' Get a new worktree of the shared clone of @repo_url
+
+            Projects with different @clone_options don't share the clone, the options
+            are not used for clones from the mirror cache.
+        '''
+        if self.git_cache is not None:
+            clone_options = None
+
+        key = (repo_url, clone_options)
+        with self._lock:
+            if key not in self._repos:
+                self._repos[key] = GitRepo(repo_url, cache=self.git_cache, clone_options=clone_options)
+                self._repo_locks[key] = threading.Lock()
+
+            return GitWorktree(self._repos[key], self._repo_locks[key])
+
+    def refresh(self):
+        ''' Start using the workspace again, the shared clones are updated
+            before their next use and SRPMs from previous builds are forgotten
+        '''
+        with self._lock:
+            for repo in self._repos.values():
+                repo.outdated = True
+            self._srpms.clear()
+            self._srpm_locks.clear()
+
+    def srpm(self, key, build):
+        ''' Get SRPM identified by @key, if it wasn't created yet, call @build to create it
+
+            returns (str): path to the SRPM
+        '''
+        with self._lock:
+            key_lock = self._srpm_locks.setdefault(key, threading.Lock())
+
+        # projects with the same key wait for the first one to build the SRPM
+        with key_lock:
+            srpm = self._srpms.get(key)
+            if srpm and os.path.exists(srpm):
+                log.debug('Reusing already built SRPM %s.', srpm)
+                return srpm
+
+            srpm = build()
+            self._srpms[key] = srpm
+
+        return srpm
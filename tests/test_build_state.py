@@ -0,0 +1,80 @@
+import os
+import tempfile
+import time
+
+from datetime import date
+
+import pytest
+
+from copr.v3 import Client
+from munch import Munch
+
+from copr_builder.build_state import BuildStateDB
+from copr_builder.copr_builder import CoprBuilder
+from copr_builder.copr_project import CoprProject
+from copr_builder.errors import CoprBuilderAlreadyFailed
+from copr_builder.git_repo import GitRepo
+
+from test_builder import BUILDER_FILE, COPR_FILE, MockCoprClient, prepare_config_files
+from utils import write_file
+
+
+def test_state_db():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "state", "builds.db")
+        db = BuildStateDB(path, max_age=3600)
+
+        assert db.get("projectA") is None
+
+        db.update("projectA", git_hash="cb678c83", chroots=["fedora-rawhide-x86_64"], state="srpm",
+                  timings={"srpm": 1.5})
+        db.update("projectA", build_id=42, state="pending")
+        db.update_build(42, "succeeded")
+
+        state = db.get("projectA")
+        assert state.git_hash == "cb678c83"
+        assert state.chroots == ["fedora-rawhide-x86_64"]
+        assert state.timings == {"srpm": 1.5}
+        assert state.build_id == 42
+        assert state.state == "succeeded"
+
+        # duration of the Copr build is saved with the timings
+        db.update_build(42, "succeeded", 300.0)
+        assert db.get("projectA").timings == {"srpm": 1.5, "copr": 300.0}
+        db.close()
+
+        # records are kept between runs, but ignored when too old
+        db = BuildStateDB(path, max_age=3600)
+        assert db.get("projectA").state == "succeeded"
+        db = BuildStateDB(path, max_age=0)
+        time.sleep(0.01)
+        assert db.get("projectA") is None
+        # old timings are still good for scheduling
+        assert db.timings("projectA") == {"srpm": 1.5, "copr": 300.0}
+
+
+def test_saved_state_check(monkeypatch):
+    monkeypatch.setattr(Client, "create_from_config_file", lambda path: MockCoprClient())
+    monkeypatch.setattr(GitRepo, "remote_head", lambda _self, _branch: "cb678c83e1a2b3c4d5e6f7a8b9c0d1e2f3a4b5c6")
+
+    def no_copr(_self):
+        raise AssertionError("builds should not be requested from Copr")
+
+    monkeypatch.setattr(CoprProject, "_get_last_build", no_copr)
+
+    with prepare_config_files() as (builder_file, copr_file), tempfile.TemporaryDirectory() as tmp:
+        today = date.today()
+        write_file(builder_file, BUILDER_FILE)
+        write_file(copr_file, COPR_FILE.format(date=today.replace(year=today.year + 1)))
+
+        builder = CoprBuilder(builder_file, copr_file, state_db=os.path.join(tmp, "builds.db"))
+        builder.state_db.update("projectA", copr_user="userA", copr_repo="repoA", package="packageA",
+                                git_hash="cb678c83", chroots=["fedora-rawhide-x86_64"], build_id=1, state="succeeded")
+
+        cp = CoprProject(builder.config["projectA"], builder.copr, state_db=builder.state_db)
+        cp.copr_project = Munch(chroot_repos={"fedora-rawhide-x86_64": ""})
+        assert cp.build_srpm() is None
+
+        builder.state_db.update_build(1, "failed")
+        with pytest.raises(CoprBuilderAlreadyFailed):
+            cp.build_srpm()
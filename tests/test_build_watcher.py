@@ -0,0 +1,144 @@
+import concurrent.futures
+import os
+import tempfile
+import time
+
+from copr.v3 import CoprNoResultException, CoprRequestException
+from munch import Munch
+
+from copr_builder.build_watcher import BuildWatcher, WatchedBuild
+
+
+class MockBuildProxy:
+    def __init__(self, builds):
+        # builds -- list of (id, project, [states in subsequent checks])
+        self.builds = builds
+        self.list_calls = 0
+        self.get_calls = 0
+
+    def _build(self, build_id, states):
+        state = states.pop(0) if len(states) > 1 else states[0]
+        return Munch(id=build_id, state=state, chroots=[],
+                     source_package={"name": "package", "version": "1.0-1"})
+
+    def get_list(self, ownername, projectname, pagination):  # pylint: disable=unused-argument
+        self.list_calls += 1
+        builds = sorted((b for b in self.builds if b[1] == projectname), key=lambda b: b[0], reverse=True)
+        builds = builds[pagination["offset"]:pagination["offset"] + pagination["limit"]]
+        return [self._build(build_id, states) for build_id, _project, states in builds]
+
+    def get(self, build_id):
+        self.get_calls += 1
+        return Munch(id=build_id, state="succeeded", chroots=[],
+                     source_package={"name": "package", "version": "1.0-1"})
+
+
+class MockCoprClient:
+    def __init__(self, builds):
+        self.build_proxy = MockBuildProxy(builds)
+
+
+def test_watch_builds():
+    client = MockCoprClient([(1, "repoA", ["running", "succeeded"]),
+                             (2, "repoA", ["pending", "running", "succeeded"]),
+                             (3, "repoB", ["succeeded"]),
+                             (4, "repoB", ["importing", "succeeded"])])
+
+    watcher = BuildWatcher(client, min_interval=0.01, max_interval=0.01, page_size=1)
+    now = time.time()
+    for build_id, project in ((1, "repoA"), (2, "repoA"), (4, "repoB"), (5, "repoB")):
+        watcher.add(WatchedBuild(build_id, "user", project, now, None))
+    watcher.close()
+
+    assert watcher.watch()
+    assert not watcher.builds
+
+    # build 5 is not in the list and must be checked separately
+    assert client.build_proxy.get_calls == 1
+
+
+def test_watch_interval():
+    watcher = BuildWatcher(None, min_interval=5, max_interval=300)
+    now = time.time()
+
+    # young build without history is checked often
+    assert watcher._interval([WatchedBuild(1, "user", "repo", now - 10, None)], now) == 5
+    # previous build took an hour, no need to check it in the first half of the hour
+    assert watcher._interval([WatchedBuild(1, "user", "repo", now - 60, 3600)], now) == 300
+    # old build is checked less often
+    assert watcher._interval([WatchedBuild(1, "user", "repo", now - 600, None)], now) == 60
+
+
+def test_detached_watch():
+    with tempfile.TemporaryDirectory() as tmp:
+        watch_file = os.path.join(tmp, "builds.json")
+
+        watcher = BuildWatcher(None)
+        watcher.add(WatchedBuild(1, "user", "repo", 1.0, None))
+        watcher.save(watch_file)
+
+        watcher = BuildWatcher(None)
+        watcher.add(WatchedBuild(2, "user", "repo", 2.0, 60))
+        watcher.save(watch_file)
+
+        builds = BuildWatcher.load(watch_file)
+        assert sorted(b.build_id for b in builds) == [1, 2]
+        assert [b for b in builds if b.build_id == 2][0].expected_duration == 60
+
+
+def test_watch_added_builds():
+    client = MockCoprClient([(1, "repoA", ["running", "succeeded"]),
+                             (2, "repoB", ["failed"])])
+    watcher = BuildWatcher(client, min_interval=0.01, max_interval=0.01)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(watcher.watch)
+
+        # builds are added while the watch is already running
+        watcher.add(WatchedBuild(1, "user", "repoA", time.time(), None))
+        time.sleep(0.05)
+        watcher.add(WatchedBuild(2, "user", "repoB", time.time(), None))
+        watcher.close()
+
+        assert not future.result(timeout=10)
+        assert not watcher.builds
+
+
+def test_watch_copr_errors():
+    client = MockCoprClient([(1, "repoA", ["running", "succeeded"])])
+    get_list = client.build_proxy.get_list
+    errors = [CoprRequestException("Unable to connect")]
+
+    def flaky_get_list(*args, **kwargs):
+        if errors:
+            raise errors.pop(0)
+        return get_list(*args, **kwargs)
+
+    client.build_proxy.get_list = flaky_get_list
+
+    # Copr not responding doesn't stop the watch, the builds are checked again later
+    watcher = BuildWatcher(client, min_interval=0.01, max_interval=0.01)
+    watcher.add(WatchedBuild(1, "user", "repoA", time.time(), None))
+    watcher.close()
+
+    assert watcher.watch()
+    assert not errors
+    assert not watcher.builds
+
+
+def test_watch_deleted_build():
+    client = MockCoprClient([(1, "repoA", ["running", "succeeded"])])
+
+    def get(build_id):
+        raise CoprNoResultException("Build %s doesn't exist." % build_id)
+
+    client.build_proxy.get = get
+
+    # build 2 is not in the list and it doesn't exist anymore, it is not watched forever
+    watcher = BuildWatcher(client, min_interval=0.01, max_interval=0.01)
+    watcher.add(WatchedBuild(1, "user", "repoA", time.time(), None))
+    watcher.add(WatchedBuild(2, "user", "repoA", time.time(), None))
+    watcher.close()
+
+    assert not watcher.watch()
+    assert not watcher.builds
@@ -1,14 +1,18 @@
+import os
 import pytest
 import tempfile
+import time
 from contextlib import contextmanager
 from datetime import date
 
-from copr.v3 import Client
+from copr.v3 import Client, CoprAuthException, CoprNoResultException, CoprRequestException
+from munch import Munch
 
 from copr_builder import CoprBuilderVersion
-from copr_builder.copr_builder import CoprBuilder
-from copr_builder.copr_project import CoprProject
-from copr_builder.errors import CoprBuilderError
+from copr_builder.build_watcher import BuildWatcher
+from copr_builder.copr_builder import CoprBuilder, _SharedSRPM, _SRPMNotPublished
+from copr_builder.copr_project import CoprProject, UrlSource
+from copr_builder.errors import CoprBuilderError, CoprBuilderAlreadyFailed, CoprBuilderVersionUnknown
 from copr_builder.git_repo import GitRepo
 
 from utils import write_file
@@ -144,3 +148,406 @@ def test_version(monkeypatch):
         assert new_ver.build == str(int(copr_ver.build) + 1)
         assert new_ver.date == date.today().strftime('%Y%m%d')
         assert new_ver.git_hash == commit
+
+
+def test_parallel_srpm_builds(monkeypatch):
+    monkeypatch.setattr(Client, "create_from_config_file", lambda path: MockCoprClient())
+
+    class MockCoprProject:
+        def __init__(self, project_data, _copr_client, **_kwargs):
+            self.project_data = project_data
+
+        def build_srpm(self):
+            if self.project_data["package"] == "packageB":
+                raise CoprBuilderError("failed")
+            return None
+
+    monkeypatch.setattr("copr_builder.copr_builder.CoprProject", MockCoprProject)
+
+    with prepare_config_files() as (builder_file, copr_file):
+        today = date.today()
+        write_file(builder_file, BUILDER_FILE)
+        write_file(copr_file, COPR_FILE.format(date=today.replace(year=today.year + 1)))
+
+        with pytest.raises(CoprBuilderError):
+            CoprBuilder(builder_file, copr_file, jobs=0)
+
+        builder = CoprBuilder(builder_file, copr_file, jobs=2)
+
+        # projectB fails, the failure must be reported even when running in parallel
+        assert not builder.do_builds(None)
+        assert builder.do_builds(["projectA"])
+
+
+def test_remote_precheck(monkeypatch):
+    monkeypatch.setattr(Client, "create_from_config_file", lambda path: MockCoprClient())
+
+    def no_clone(_self):
+        raise AssertionError("repository should not be cloned")
+
+    monkeypatch.setattr(GitRepo, "clone", no_clone)
+    monkeypatch.setattr(GitRepo, "remote_head", lambda _self, _branch: "cb678c83e1a2b3c4d5e6f7a8b9c0d1e2f3a4b5c6")
+
+    last_build = Munch(id=1, state="succeeded", chroots=["fedora-rawhide-x86_64"], submitted_on=0,
+                       source_package={"name": "packageA", "version": "2.33-8.20170322gitcb678c83.fc26"})
+    monkeypatch.setattr(CoprProject, "_get_last_build", lambda _self: last_build)
+
+    with prepare_config_files() as (builder_file, copr_file):
+        today = date.today()
+        write_file(builder_file, BUILDER_FILE)
+        write_file(copr_file, COPR_FILE.format(date=today.replace(year=today.year + 1)))
+
+        builder = CoprBuilder(builder_file, copr_file)
+
+        # remote head is the last built commit -- nothing to build, no clone
+        cp = CoprProject(builder.config["projectA"], builder.copr)
+        cp.copr_project = Munch(chroot_repos={"fedora-rawhide-x86_64": ""})
+        assert cp.build_srpm() is None
+
+        # last build failed -- must be reported without cloning too
+        last_build.state = "failed"
+        with pytest.raises(CoprBuilderAlreadyFailed):
+            cp.build_srpm()
+
+
+def test_chroot_delta(monkeypatch):
+    monkeypatch.setattr(Client, "create_from_config_file", lambda path: MockCoprClient())
+
+    def no_clone(_self):
+        raise AssertionError("repository should not be cloned")
+
+    monkeypatch.setattr(GitRepo, "clone", no_clone)
+    monkeypatch.setattr(GitRepo, "remote_head", lambda _self, _branch: "cb678c83e1a2b3c4d5e6f7a8b9c0d1e2f3a4b5c6")
+
+    version = "2.33-8.20170322gitcb678c83.fc26"
+    url = "https://example.com/packageA-2.33-8.20170322gitcb678c83.fc26.src.rpm"
+    builds = [Munch(id=2, state="succeeded", chroots=["fedora-rawhide-x86_64"], submitted_on=0,
+                    source_package={"name": "packageA", "version": version, "url": url}),
+              Munch(id=1, state="succeeded", chroots=["fedora-42-x86_64"], submitted_on=0,
+                    source_package={"name": "packageA", "version": "2.33-7.20170321gitaaaaaaaa.fc26", "url": url})]
+
+    class MockBuildProxy:
+        def get_list(self, ownername, projectname, packagename, pagination):  # pylint: disable=unused-argument
+            return builds[pagination["offset"]:pagination["offset"] + pagination["limit"]]
+
+    monkeypatch.setattr(CoprProject, "_get_last_build", lambda _self: builds[0])
+
+    with prepare_config_files() as (builder_file, copr_file):
+        today = date.today()
+        write_file(builder_file, BUILDER_FILE)
+        write_file(copr_file, COPR_FILE.format(date=today.replace(year=today.year + 1)))
+
+        builder = CoprBuilder(builder_file, copr_file)
+        builder.config["projectA"]["chroot_delta"] = "yes"
+
+        # new chroot enabled -- only the new chroot is built from the last SRPM
+        cp = CoprProject(builder.config["projectA"], builder.copr)
+        cp.copr_client = Munch(build_proxy=MockBuildProxy())
+        cp.copr_project = Munch(chroot_repos={"fedora-rawhide-x86_64": "", "fedora-42-x86_64": ""})
+        assert cp.build_srpm() == UrlSource(url, ["fedora-42-x86_64"])
+
+        # the new chroot was already built by a newer build of the same version
+        builds.insert(0, Munch(id=3, state="succeeded", chroots=["fedora-42-x86_64"], submitted_on=0,
+                               source_package={"name": "packageA", "version": version, "url": url}))
+        cp = CoprProject(builder.config["projectA"], builder.copr)
+        cp.copr_client = Munch(build_proxy=MockBuildProxy())
+        cp.copr_project = Munch(chroot_repos={"fedora-rawhide-x86_64": "", "fedora-42-x86_64": ""})
+        assert cp.build_srpm() is None
+
+        # chroot removed from the project -- nothing to build
+        builds.pop(0)
+        cp = CoprProject(builder.config["projectA"], builder.copr)
+        cp.copr_client = Munch(build_proxy=MockBuildProxy())
+        cp.copr_project = Munch(chroot_repos={})
+        assert cp.build_srpm() is None
+
+
+def test_last_build(monkeypatch):
+    class MockBuildProxy:
+        def __init__(self):
+            # newest builds were canceled, the last real build is on the second page
+            self.builds = [Munch(id=i, state="canceled" if i > 12 else "succeeded", chroots=[],
+                                 submitted_on=i, source_package={"name": "packageA", "version": "1.0-%d" % i})
+                           for i in range(1, 31)]
+            self.pages = 0
+
+        def get_list(self, ownername, projectname, packagename, pagination):  # pylint: disable=unused-argument
+            self.pages += 1
+            assert pagination["order"] == "id" and pagination["order_type"] == "DESC"
+            builds = sorted(self.builds, key=lambda b: b.id, reverse=True)
+            return builds[pagination["offset"]:pagination["offset"] + pagination["limit"]]
+
+    class MockClient(MockCoprClient):
+        build_proxy = MockBuildProxy()
+
+    monkeypatch.setattr(Client, "create_from_config_file", lambda path: MockClient())
+
+    with prepare_config_files() as (builder_file, copr_file):
+        today = date.today()
+        write_file(builder_file, BUILDER_FILE)
+        write_file(copr_file, COPR_FILE.format(date=today.replace(year=today.year + 1)))
+
+        builder = CoprBuilder(builder_file, copr_file)
+
+        cp = CoprProject(builder.config["projectA"], builder.copr)
+        last = cp._get_last_build()
+        assert last.id == 12
+        assert last.source_package["version"] == "1.0-12"
+        assert MockClient.build_proxy.pages == 2
+
+        # newest build failed before Copr imported its sources, so it has no version
+        MockClient.build_proxy.builds.append(Munch(id=31, state="failed", chroots=[], submitted_on=31,
+                                                   source_package={"name": None, "version": None}))
+        builder.copr.invalidate()
+        cp = CoprProject(builder.config["projectA"], builder.copr)
+        assert cp._get_last_build().id == 12
+
+        # newest build is still being imported -- we can't tell whether it's up to date yet
+        MockClient.build_proxy.builds.append(Munch(id=32, state="importing", chroots=[], submitted_on=32,
+                                                   source_package={"name": None, "version": None}))
+        builder.copr.invalidate()
+        cp = CoprProject(builder.config["projectA"], builder.copr)
+        cp.copr_project = Munch(chroot_repos={})
+        assert cp._get_last_build().id == 32
+        with pytest.raises(CoprBuilderVersionUnknown):
+            cp.build_srpm()
+
+        # no builds at all
+        MockClient.build_proxy.builds = []
+        cp = CoprProject(builder.config["projectB"], builder.copr)
+        assert cp._get_last_build() is None
+
+
+def test_upload_retry(monkeypatch):
+    class MockResponse:
+        def __init__(self, status_code):
+            self.status_code = status_code
+
+    class MockBuildProxy:
+        def __init__(self):
+            self.errors = []
+            self.calls = 0
+            self.builds = []
+
+        def fail(self, errors):
+            self.errors = errors
+            self.calls = 0
+
+        def create_from_file(self, ownername, projectname, path):  # pylint: disable=unused-argument
+            self.calls += 1
+            if self.errors:
+                raise self.errors.pop(0)
+            return Munch(id=42)
+
+        def get_list(self, ownername, projectname, pagination):  # pylint: disable=unused-argument
+            return self.builds
+
+    class MockClient(MockCoprClient):
+        build_proxy = MockBuildProxy()
+
+    monkeypatch.setattr(Client, "create_from_config_file", lambda path: MockClient())
+    monkeypatch.setattr("copr_builder.copr_builder.UPLOAD_RETRY_DELAY", 0)
+
+    with prepare_config_files() as (builder_file, copr_file):
+        today = date.today()
+        write_file(builder_file, BUILDER_FILE)
+        write_file(copr_file, COPR_FILE.format(date=today.replace(year=today.year + 1)))
+
+        builder = CoprBuilder(builder_file, copr_file)
+
+        # connection failure, server error and rate limit are tried again
+        MockClient.build_proxy.fail([CoprRequestException("Unable to connect"),
+                                     CoprRequestException("error", response=MockResponse(502)),
+                                     CoprRequestException("error", response=MockResponse(429))])
+        assert builder._upload_srpm("userA", "repoA", builder_file).id == 42
+        assert MockClient.build_proxy.calls == 4
+
+        # invalid request fails right away
+        MockClient.build_proxy.fail([CoprRequestException("error", response=MockResponse(400))])
+        with pytest.raises(CoprBuilderError):
+            builder._upload_srpm("userA", "repoA", builder_file)
+        assert MockClient.build_proxy.calls == 1
+
+        # give up after the last attempt
+        MockClient.build_proxy.fail([CoprRequestException("Unable to connect")] * 4)
+        with pytest.raises(CoprBuilderError):
+            builder._upload_srpm("userA", "repoA", builder_file)
+        assert MockClient.build_proxy.calls == 4
+
+        # the build was created even though the request failed, it's not created again,
+        # older builds and builds of other SRPMs are ignored
+        srpm_url = "https://example.com/srpm-builds/00000043/" + os.path.basename(builder_file)
+        MockClient.build_proxy.builds = [Munch(id=45, submitted_on=time.time(),
+                                               source_package={"name": "packageB", "url": "packageB.src.rpm"}),
+                                         Munch(id=44, submitted_on=time.time(), source_package={"url": srpm_url}),
+                                         Munch(id=41, submitted_on=time.time() - 3600,
+                                               source_package={"url": srpm_url})]
+        MockClient.build_proxy.fail([CoprRequestException("error", response=MockResponse(504))])
+        assert builder._upload_srpm("userA", "repoA", builder_file).id == 44
+        assert MockClient.build_proxy.calls == 1
+
+        # build that isn't imported yet may be someone else's, the SRPM is uploaded again
+        MockClient.build_proxy.builds = [Munch(id=46, submitted_on=time.time(), source_package={"url": None})]
+        MockClient.build_proxy.fail([CoprRequestException("error", response=MockResponse(504))])
+        assert builder._upload_srpm("userA", "repoA", builder_file).id == 42
+        assert MockClient.build_proxy.calls == 2
+
+
+def test_cancel_outdated(monkeypatch):
+    class MockResponse:
+        status_code = 400
+
+    class MockBuildProxy:
+        def __init__(self):
+            self.canceled = []
+
+        def create_from_file(self, ownername, projectname, path):  # pylint: disable=unused-argument
+            return Munch(id=42)
+
+        def cancel(self, build_id):
+            if build_id == 6:
+                raise CoprRequestException("already finished", response=MockResponse())
+            if build_id == 8:
+                raise CoprAuthException("submitted by another member of the group")
+            if build_id == 9:
+                raise CoprNoResultException("deleted")
+            self.canceled.append(build_id)
+
+    class MockClient(MockCoprClient):
+        build_proxy = MockBuildProxy()
+        config = {"copr_url": "https://copr.fedorainfracloud.org"}
+
+    monkeypatch.setattr(Client, "create_from_config_file", lambda path: MockClient())
+
+    with prepare_config_files() as (builder_file, copr_file):
+        today = date.today()
+        write_file(builder_file, BUILDER_FILE)
+        write_file(copr_file, COPR_FILE.format(date=today.replace(year=today.year + 1)))
+
+        builder = CoprBuilder(builder_file, copr_file)
+
+        cp = CoprProject(builder.config["projectA"], builder.copr)
+        cp._unfinished = [Munch(id=4, source_package={"name": "packageA", "version": "1.0-2.20200101gitcb678c83"}),
+                          Munch(id=5, source_package={"name": "packageA", "version": "1.0-1.20200101gitaaaaaaaa"}),
+                          Munch(id=6, source_package={"name": "packageA", "version": "1.0-1.20200101gitbbbbbbbb"}),
+                          Munch(id=7, source_package=None),
+                          Munch(id=8, source_package={"name": "packageA", "version": "1.0-1.20200101gitbbbbbbbb"}),
+                          Munch(id=9, source_package={"name": "packageA", "version": "1.0-1.20200101gitbbbbbbbb"})]
+        cp.built_commit = "cb678c83e1a2b3c4"
+
+        # disabled by default
+        assert cp.outdated_builds() == []
+
+        # builds from other commits are outdated, build with unknown version can't be decided
+        builder.config["projectA"]["cancel_outdated"] = "yes"
+        assert cp.outdated_builds() == [5, 6, 8, 9]
+
+        # outdated builds are canceled after the new build is submitted, failure to cancel is not fatal
+        watcher = BuildWatcher(None)
+        builder._start_build("projectA", builder_file, cp, watcher)
+        assert 42 in watcher.builds
+        assert MockClient.build_proxy.canceled == [5]
+        assert watcher.canceled == [(5, "projectA")]
+
+
+def test_shared_srpm(monkeypatch):
+    class MockResponse:
+        status_code = 400
+
+    class MockBuildProxy:
+        def __init__(self):
+            self.uploads = []
+            self.urls = []
+            self.gets = 0
+            self.fail_upload = False
+
+        def create_from_file(self, ownername, projectname, path):  # pylint: disable=unused-argument
+            if self.fail_upload:
+                raise CoprRequestException("invalid SRPM", response=MockResponse())
+            self.uploads.append(projectname)
+            return Munch(id=len(self.uploads) + len(self.urls))
+
+        def create_from_url(self, ownername, projectname, url, buildopts):  # pylint: disable=unused-argument
+            self.urls.append((projectname, url))
+            return Munch(id=len(self.uploads) + len(self.urls))
+
+        def get(self, build_id):
+            self.gets += 1
+            if self.gets == 1:
+                # not imported yet
+                return Munch(id=build_id, state="importing", source_package={"name": None, "url": None})
+            return Munch(id=build_id, state="pending",
+                         source_package={"name": "packageA", "url": "https://example.com/packageA.src.rpm"})
+
+    class MockClient(MockCoprClient):
+        build_proxy = MockBuildProxy()
+        config = {"copr_url": "https://copr.fedorainfracloud.org"}
+
+    monkeypatch.setattr(Client, "create_from_config_file", lambda path: MockClient())
+
+    with prepare_config_files() as (builder_file, copr_file):
+        today = date.today()
+        write_file(builder_file, BUILDER_FILE)
+        write_file(copr_file, COPR_FILE.format(date=today.replace(year=today.year + 1)))
+
+        builder = CoprBuilder(builder_file, copr_file)
+
+        # SRPM is uploaded only for the first project, the second one uses the SRPM from Copr,
+        # it doesn't wait for Copr to publish it and it's tried again later instead
+        monkeypatch.setattr("copr_builder.copr_builder.SRPM_URL_INTERVAL", 0)
+        shared = _SharedSRPM()
+        builder._do_copr_build("projectA", builder_file, shared)
+        with pytest.raises(_SRPMNotPublished):
+            builder._do_copr_build("projectB", builder_file, shared)
+        builder._do_copr_build("projectB", builder_file, shared)
+        assert MockClient.build_proxy.uploads == ["repoA"]
+        assert MockClient.build_proxy.urls == [("repoB", "https://example.com/packageA.src.rpm")]
+
+        # first upload failed, the second project uploads the SRPM itself
+        MockClient.build_proxy.fail_upload = True
+        shared = _SharedSRPM()
+        with pytest.raises(CoprBuilderError):
+            builder._do_copr_build("projectA", builder_file, shared)
+        MockClient.build_proxy.fail_upload = False
+        builder._do_copr_build("projectB", builder_file, shared)
+        assert MockClient.build_proxy.uploads == ["repoA", "repoB"]
+
+
+def test_schedule(monkeypatch):
+    monkeypatch.setattr(Client, "create_from_config_file", lambda path: MockCoprClient())
+
+    order = []
+
+    class MockCoprProject:
+        def __init__(self, project_data, _copr_client, **_kwargs):
+            self.project_data = project_data
+
+        def build_srpm(self):
+            order.append(self.project_data.name)
+            return None
+
+    monkeypatch.setattr("copr_builder.copr_builder.CoprProject", MockCoprProject)
+
+    config = BUILDER_FILE + "\n[projectC]\ncopr_user = userC\ncopr_repo = repoC\npackage = packageC\n" \
+                            "git_url = urlC\narchive_cmd = cmdC\n"
+
+    with prepare_config_files() as (builder_file, copr_file), tempfile.TemporaryDirectory() as tmp:
+        today = date.today()
+        write_file(builder_file, config)
+        write_file(copr_file, COPR_FILE.format(date=today.replace(year=today.year + 1)))
+
+        # without history the order from the config is kept
+        builder = CoprBuilder(builder_file, copr_file, state_db=tmp + "/builds.db")
+        assert builder._schedule(builder.config.sections())[0] == ["projectA", "projectB", "projectC"]
+
+        # the longest project goes first, projectA without history is expected to take the average
+        builder.state_db.update("projectB", timings={"prepare": 1, "srpm": 10, "copr": 600})
+        builder.state_db.update("projectC", timings={"srpm": 5, "copr": 60})
+        projects, durations = builder._schedule(builder.config.sections())
+        assert projects == ["projectB", "projectA", "projectC"]
+        assert durations["projectA"] == (8, 330)
+
+        # priority wins over the duration
+        builder.config["projectC"]["priority"] = "10"
+        assert builder.do_builds(None)
+        assert order == ["projectC", "projectB", "projectA"]
@@ -0,0 +1,97 @@
+import os
+import tempfile
+import threading
+import time
+
+from munch import Munch
+
+from copr_builder.copr_cache import CachedCoprClient
+
+
+class CountingProxy:
+    def __init__(self, delay=0):
+        self.calls = 0
+        self.delay = delay
+        self._lock = threading.Lock()
+
+    def get(self, ownername, projectname):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return Munch(ownername=ownername, name=projectname)
+
+    def get_list(self, ownername, projectname, **_kwargs):
+        with self._lock:
+            self.calls += 1
+        return [Munch(id=self.calls, ownername=ownername, projectname=projectname)]
+
+    def create_from_file(self, **_kwargs):
+        return Munch(id=42)
+
+
+class MockClient:
+    def __init__(self, delay=0):
+        self.project_proxy = CountingProxy(delay)
+        self.build_proxy = CountingProxy()
+        self.config = {"copr_url": "https://copr.example.com"}
+
+
+def test_cached_lookups():
+    client = MockClient()
+    copr = CachedCoprClient(client)
+
+    assert copr.config["copr_url"] == "https://copr.example.com"
+
+    project = copr.project_proxy.get(ownername="user", projectname="repo")
+    assert copr.project_proxy.get(ownername="user", projectname="repo") is project
+    copr.project_proxy.get(ownername="user", projectname="other")
+    assert client.project_proxy.calls == 2
+
+    builds = copr.build_proxy.get_list("user", "repo", packagename="pkg", pagination={"limit": 1})
+    assert copr.build_proxy.get_list("user", "repo", packagename="pkg", pagination={"limit": 1}) == builds
+    assert client.build_proxy.calls == 1
+
+    # new build drops the cached build lists but not the projects
+    copr.build_proxy.create_from_file(ownername="user", projectname="repo", path="a.src.rpm")
+    assert copr.build_proxy.get_list("user", "repo", packagename="pkg", pagination={"limit": 1}) != builds
+    copr.project_proxy.get(ownername="user", projectname="repo")
+    assert client.build_proxy.calls == 2
+    assert client.project_proxy.calls == 2
+
+
+def test_coalesced_lookups():
+    client = MockClient(delay=0.2)
+    copr = CachedCoprClient(client)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(copr.project_proxy.get(ownername="user",
+                                                                                     projectname="repo")))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 5
+    assert client.project_proxy.calls == 1
+
+
+def test_persistent_cache():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_file = os.path.join(tmp, "cache")
+
+        copr = CachedCoprClient(MockClient(), cache_file=cache_file, ttl=600)
+        copr.project_proxy.get(ownername="user", projectname="repo")
+        copr.save()
+
+        client = MockClient()
+        copr = CachedCoprClient(client, cache_file=cache_file, ttl=600)
+        assert copr.project_proxy.get(ownername="user", projectname="repo").name == "repo"
+        assert client.project_proxy.calls == 0
+
+        # expired results are not used
+        client = MockClient()
+        copr = CachedCoprClient(client, cache_file=cache_file, ttl=0.001)
+        time.sleep(0.01)
+        copr.project_proxy.get(ownername="user", projectname="repo")
+        assert client.project_proxy.calls == 1
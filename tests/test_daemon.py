@@ -0,0 +1,130 @@
+import json
+import os
+import socket
+import tempfile
+import urllib.request
+
+from datetime import date
+
+from copr.v3 import Client
+
+from copr_builder.copr_builder import CoprBuilder
+from copr_builder.daemon import CoprBuilderDaemon
+from copr_builder.errors import CoprBuilderError
+
+from test_builder import COPR_FILE, MockCoprClient, prepare_config_files
+from test_git_repo import git, make_repo
+from utils import write_file
+
+
+DAEMON_FILE = """[projectA]
+copr_user = userA
+copr_repo = repoA
+package = packageA
+git_url = {origin}
+archive_cmd = cmdA
+git_branch = main
+
+[projectB]
+copr_user = userB
+copr_repo = repoB
+package = packageB
+git_url = {origin}/
+archive_cmd = cmdB
+git_branch = devel
+poll_interval = 60
+"""
+
+
+def test_daemon(monkeypatch):
+    monkeypatch.setattr(Client, "create_from_config_file", lambda path: MockCoprClient())
+
+    builds = []
+    failing = set()
+
+    def do_builds(_self, projects, done, **_kwargs):
+        builds.append(projects)
+        if "*" in failing:
+            raise CoprBuilderError("Copr is down")
+        done.update(p for p in projects if p not in failing)
+
+    monkeypatch.setattr(CoprBuilder, "do_builds", do_builds)
+
+    with tempfile.TemporaryDirectory() as tmp, prepare_config_files() as (builder_file, copr_file):
+        origin = os.path.join(tmp, "origin", "project")
+        make_repo(origin)
+        git(origin, "branch", "devel")
+
+        today = date.today()
+        write_file(builder_file, DAEMON_FILE.format(origin=origin))
+        write_file(copr_file, COPR_FILE.format(date=today.replace(year=today.year + 1)))
+
+        builder = CoprBuilder(builder_file, copr_file)
+        daemon = CoprBuilderDaemon(builder, poll_interval=10, socket_path=os.path.join(tmp, "daemon.sock"),
+                                   http_port=0)
+
+        # everything is built in the first cycle, then only projects with new commits
+        due, triggered = daemon._wait()
+        assert due == ["projectA", "projectB"] and not triggered
+        daemon._cycle(due, triggered)
+        assert builds == [["projectA", "projectB"]]
+        assert daemon._next_poll["projectB"] - daemon._next_poll["projectA"] > 40
+
+        daemon._cycle(["projectA", "projectB"], set())
+        assert len(builds) == 1
+
+        write_file(os.path.join(origin, "README"), "second\n")
+        git(origin, "commit", "-q", "-a", "-m", "second")
+        daemon._cycle(["projectA", "projectB"], set())
+        assert builds[-1] == ["projectA"]
+
+        # failed builds are retried with the next check, other projects are not
+        write_file(os.path.join(origin, "README"), "third\n")
+        git(origin, "commit", "-q", "-a", "-m", "third")
+        git(origin, "branch", "-f", "devel")
+        failing.add("projectA")
+        daemon._cycle(["projectA", "projectB"], set())
+        assert builds[-1] == ["projectA", "projectB"]
+        daemon._cycle(["projectA", "projectB"], set())
+        assert builds[-1] == ["projectA"]
+
+        # the whole cycle failed
+        failing.clear()
+        failing.add("*")
+        write_file(os.path.join(origin, "README"), "fourth\n")
+        git(origin, "commit", "-q", "-a", "-m", "fourth")
+        git(origin, "branch", "-f", "devel")
+        daemon._cycle(["projectA", "projectB"], set())
+        assert builds[-1] == ["projectA", "projectB"]
+        failing.clear()
+        daemon._cycle(["projectA", "projectB"], set())
+        assert builds[-1] == ["projectA", "projectB"]
+        count = len(builds)
+        daemon._cycle(["projectA", "projectB"], set())
+        assert len(builds) == count
+
+        # triggers
+        assert daemon.trigger("projectB") == ["projectB"]
+        assert daemon.trigger(origin + ".git") == ["projectA", "projectB"]
+        assert daemon.trigger("missing") == []
+        assert daemon._wait()[1] == {"projectA", "projectB"}
+
+        daemon._start_servers()
+        try:
+            with socket.socket(socket.AF_UNIX) as sock:
+                sock.connect(daemon.socket_path)
+                sock.sendall(b"projectA\nmissing\n")
+                sock.shutdown(socket.SHUT_WR)
+                assert sock.makefile().read() == "OK projectA\nERROR unknown project missing\n"
+            assert daemon._wait()[1] == {"projectA"}
+
+            port = daemon._servers[1].server_address[1]
+            payload = json.dumps({"repository": {"clone_url": origin + ".git"}}).encode()
+            request = urllib.request.Request("http://127.0.0.1:%d/trigger" % port, data=payload, method="POST")
+            with urllib.request.urlopen(request) as response:
+                assert response.status == 202
+                assert json.loads(response.read()) == {"projects": ["projectA", "projectB"]}
+            assert daemon._wait()[1] == {"projectA", "projectB"}
+        finally:
+            daemon._stop_servers()
+        assert not os.path.exists(os.path.join(tmp, "daemon.sock"))
@@ -0,0 +1,196 @@
+import os
+import subprocess
+import tempfile
+
+from copr_builder.copr_project import CoprProject
+from copr_builder.git_cache import GitMirrorCache
+from copr_builder.git_repo import CloneOptions, GitRepo, GIT_USER
+from copr_builder.workspace import Workspace
+
+from utils import write_file
+
+
+def git(cwd, *args):
+    out = subprocess.check_output(["git", "-c", "user.name=Tester", "-c", "user.email=tester@example.com"] + list(args),
+                                  cwd=cwd)
+    return out.decode().strip()
+
+
+def make_repo(path):
+    os.makedirs(path)
+    git(path, "init", "-q", "-b", "main")
+    write_file(os.path.join(path, "README"), "first\n")
+    git(path, "add", "README")
+    git(path, "commit", "-q", "-m", "first")
+
+
+def test_clone_from_cache():
+    with tempfile.TemporaryDirectory() as tmp:
+        origin = os.path.join(tmp, "origin", "project")
+        make_repo(origin)
+
+        cache = GitMirrorCache(os.path.join(tmp, "cache"))
+
+        repo = GitRepo(origin, cache=cache)
+        repo.clone()
+        assert os.path.isdir(cache.mirror_path(origin))
+        assert git(repo.gitdir, "remote", "get-url", "origin") == origin
+        assert repo.last_commit(short=False) == git(origin, "rev-parse", "HEAD")
+
+        # new commit must be fetched into the existing mirror by the next process
+        write_file(os.path.join(origin, "README"), "second\n")
+        git(origin, "commit", "-q", "-a", "-m", "second")
+
+        repo = GitRepo(origin, cache=GitMirrorCache(os.path.join(tmp, "cache")))
+        repo.clone()
+        repo.checkout("main")
+        assert repo.last_commit(short=False) == git(origin, "rev-parse", "HEAD")
+
+
+def test_remote_head():
+    with tempfile.TemporaryDirectory() as tmp:
+        origin = os.path.join(tmp, "origin", "project")
+        make_repo(origin)
+        head = git(origin, "rev-parse", "HEAD")
+
+        # from "git ls-remote"
+        repo = GitRepo(origin)
+        assert repo.remote_head("main") == head
+        assert repo.remote_head("missing") is None
+
+        # from the mirror cache
+        repo = GitRepo(origin, cache=GitMirrorCache(os.path.join(tmp, "cache")))
+        assert repo.remote_head("main") == head
+        assert repo.remote_head("missing") is None
+
+
+def test_workspace_worktrees():
+    with tempfile.TemporaryDirectory() as tmp:
+        origin = os.path.join(tmp, "origin", "project")
+        make_repo(origin)
+        git(origin, "checkout", "-q", "-b", "devel")
+        write_file(os.path.join(origin, "README"), "devel\n")
+        git(origin, "commit", "-q", "-a", "-m", "devel")
+        git(origin, "checkout", "-q", "main")
+
+        workspace = Workspace()
+        main = workspace.git_repo(origin)
+        devel = workspace.git_repo(origin)
+        main2 = workspace.git_repo(origin)
+
+        for repo, branch in ((main, "main"), (devel, "devel"), (main2, "main")):
+            repo.clone()
+            repo.checkout(branch)
+            assert repo.last_commit(short=False) == git(origin, "rev-parse", branch)
+
+        # all worktrees share a single clone
+        assert main.repo is devel.repo is main2.repo
+        assert len({main.gitdir, devel.gitdir, main2.gitdir}) == 3
+
+        built = []
+
+        def build():
+            srpm = os.path.join(tmp, "package-%d.src.rpm" % len(built))
+            write_file(srpm, "")
+            built.append(srpm)
+            return srpm
+
+        # second project with the same key reuses the SRPM
+        assert workspace.srpm(("a",), build) == workspace.srpm(("a",), build)
+        assert workspace.srpm(("b",), build) != workspace.srpm(("a",), build)
+        assert len(built) == 2
+
+        # refreshed workspace fetches new commits into the shared clone
+        write_file(os.path.join(origin, "README"), "second\n")
+        git(origin, "commit", "-q", "-a", "-m", "second")
+        workspace.refresh()
+        main3 = workspace.git_repo(origin)
+        main3.clone()
+        main3.checkout("main")
+        assert main3.last_commit(short=False) == git(origin, "rev-parse", "main")
+        assert workspace.srpm(("a",), build) == built[-1] and len(built) == 3
+
+
+def test_workspace_clone_options():
+    class MockCoprClient:
+        @property
+        def project_proxy(self):
+            return self
+
+        def get(self, ownername, projectname):  # pylint: disable=unused-argument
+            return None
+
+    section = {"copr_user": "user", "copr_repo": "repo", "package": "package", "git_url": "https://example.com/repo",
+               "archive_cmd": "true"}
+
+    def repos(workspace, **options):
+        for branch in ("main", "devel"):
+            CoprProject(dict(section, git_branch=branch, **options), MockCoprClient(), workspace=workspace)
+        return len(workspace._repos)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # projects building different branches share the clone unless only one branch is cloned
+        assert repos(Workspace()) == 1
+        assert repos(Workspace(), git_depth="1") == 1
+        assert repos(Workspace(), git_single_branch="yes") == 2
+        # clone options are not used with the mirror cache
+        assert repos(Workspace(GitMirrorCache(tmp)), git_single_branch="yes") == 1
+
+
+def test_shallow_clone():
+    with tempfile.TemporaryDirectory() as tmp:
+        origin = os.path.join(tmp, "origin", "project")
+        make_repo(origin)
+        first = git(origin, "rev-parse", "HEAD")
+
+        # commits from the bot are ignored by last_commit, shallow clone must be deepened to find the right one
+        for i in range(5):
+            write_file(os.path.join(origin, "README"), "bot %d\n" % i)
+            subprocess.check_call(["git", "-c", "user.name=%s" % GIT_USER, "-c", "user.email=bot@example.com",
+                                   "commit", "-q", "-a", "-m", "bot %d" % i], cwd=origin)
+
+        git(origin, "checkout", "-q", "-b", "devel", first)
+        write_file(os.path.join(origin, "devel"), "devel\n")
+        git(origin, "add", "devel")
+        git(origin, "commit", "-q", "-m", "devel")
+        git(origin, "checkout", "-q", "main")
+
+        options = CloneOptions(depth=1, filter="blob:none", single_branch=True, no_tags=True, branch="main")
+        repo = GitRepo("file://" + origin, clone_options=options)
+        repo.clone()
+        assert git(repo.gitdir, "rev-parse", "--is-shallow-repository") == "true"
+        assert "origin/devel" not in git(repo.gitdir, "branch", "-r")
+
+        assert repo.last_commit(short=False) == first
+
+        # merge needs the devel branch and the common ancestor
+        repo.merge("devel")
+        assert os.path.exists(os.path.join(repo.gitdir, "devel"))
+
+        # --depth alone must not clone only the default branch
+        repo = GitRepo("file://" + origin, clone_options=CloneOptions(depth=5, branch="devel"))
+        repo.clone()
+        assert git(repo.gitdir, "rev-parse", "--is-shallow-repository") == "true"
+        repo.checkout("devel")
+        assert os.path.exists(os.path.join(repo.gitdir, "devel"))
+        repo.checkout("main")
+        repo.merge("devel")
+        assert os.path.exists(os.path.join(repo.gitdir, "devel"))
+
+
+def test_git_queries():
+    with tempfile.TemporaryDirectory() as tmp:
+        origin = os.path.join(tmp, "origin", "project")
+        make_repo(origin)
+        first = git(origin, "rev-parse", "HEAD")
+        git(origin, "tag", "-a", "-m", "1.0", "1.0")
+        write_file(os.path.join(origin, "README"), "second\n")
+        git(origin, "commit", "-q", "-a", "-m", "second")
+        git(origin, "tag", "lightweight")
+        git(origin, "tag", "-a", "-m", "0.9", "0.9", first)
+
+        repo = GitRepo(origin)
+        repo.clone()
+
+        assert repo.resolve("HEAD", "origin/missing", "1.0") == [git(origin, "rev-parse", "HEAD"), None, first]
+        assert repo.last_tag() == git(repo.gitdir, "tag", "-l", "--sort=taggerdate").split("\n")[-1]
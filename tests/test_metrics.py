@@ -0,0 +1,78 @@
+import json
+import os
+import tempfile
+import time
+
+import pytest
+
+from copr_builder.build_watcher import BuildWatcher, WatchedBuild
+from copr_builder.metrics import Metrics
+
+from test_build_watcher import MockCoprClient
+from utils import read_file
+
+
+def test_phases():
+    metrics = Metrics()
+    project = metrics.project("projectA")
+
+    with project.phase("archive") as measured:
+        measured["bytes"] = 1024
+
+    with pytest.raises(RuntimeError):
+        with project.phase("srpm"):
+            raise RuntimeError("rpmbuild failed")
+
+    # only the last run of a phase is kept
+    metrics.record("projectB", "upload", 2.0, size=10)
+    metrics.record("projectB", "upload", 1.5, size=20, timestamp=100.0)
+    metrics.record("projectB", "srpm", 3.0, cpu_time=2.5, max_rss=2**20)
+
+    records = {(r.project, r.phase): r for r in metrics.records}
+    assert len(records) == 4
+    assert records[("projectA", "archive")].outcome == "success"
+    assert records[("projectA", "archive")].bytes == 1024
+    assert records[("projectA", "srpm")].outcome == "failed"
+    assert records[("projectA", "srpm")].bytes is None
+    assert records[("projectB", "upload")] == ("projectB", "upload", 100.0, 1.5, 20, "success", None, None)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_file = os.path.join(tmp, "metrics", "metrics.json")
+        metrics.write_json(json_file)
+        report = json.loads(read_file(json_file))
+        assert len(report["phases"]) == 4
+        assert {"project": "projectB", "phase": "upload", "timestamp": 100.0, "duration": 1.5,
+                "bytes": 20, "outcome": "success", "cpu_time": None, "max_rss": None} in report["phases"]
+
+        prom_file = os.path.join(tmp, "copr_builder.prom")
+        metrics.write_textfile(prom_file)
+        lines = read_file(prom_file).splitlines()
+        assert "# TYPE copr_builder_phase_duration_seconds gauge" in lines
+        assert 'copr_builder_phase_duration_seconds{project="projectB",phase="upload"} 1.5' in lines
+        assert 'copr_builder_phase_bytes{project="projectA",phase="archive"} 1024.0' in lines
+        assert 'copr_builder_phase_success{project="projectA",phase="srpm"} 0.0' in lines
+        assert 'copr_builder_phase_cpu_seconds{project="projectB",phase="srpm"} 2.5' in lines
+        assert 'copr_builder_phase_max_rss_bytes{project="projectB",phase="srpm"} 1048576.0' in lines
+        # size of the failed phase is not known
+        assert not any(line.startswith('copr_builder_phase_bytes{project="projectA",phase="srpm"}') for line in lines)
+
+
+def test_watch_phase():
+    client = MockCoprClient([(1, "repoA", ["succeeded"]), (2, "repoB", ["failed"])])
+    metrics = Metrics()
+
+    watcher = BuildWatcher(client, min_interval=0.01, max_interval=0.01, metrics=metrics)
+    now = time.time()
+    watcher.add(WatchedBuild(1, "user", "repoA", now - 60, None, "projectA"))
+    # build saved by an older version without the project name
+    watcher.add(WatchedBuild(2, "user", "repoB", now - 30, None))
+    watcher.close()
+    watcher._print_chroot_states = lambda build: None
+
+    assert not watcher.watch()
+
+    records = {r.project: r for r in metrics.records}
+    assert records["projectA"].phase == "watch"
+    assert records["projectA"].outcome == "succeeded"
+    assert records["projectA"].duration >= 60
+    assert records["user/repoB"].outcome == "failed"
@@ -0,0 +1,47 @@
+import datetime
+import os
+import subprocess
+import sys
+import tempfile
+
+from copr_builder import CoprBuilderVersion
+from copr_builder.scm_build import SCRIPT_RESULTDIR, make_source
+
+from test_git_repo import git
+from utils import read_file, write_file
+
+
+def test_scm_script():
+    with tempfile.TemporaryDirectory() as tmp:
+        origin = os.path.join(tmp, "origin")
+        os.makedirs(os.path.join(origin, "packaging"))
+        git(origin, "init", "-q", "-b", "main")
+        write_file(os.path.join(origin, "packaging", "package.spec"),
+                   "Name: package\nVersion: 1.0\nRelease: 1%{?dist}\nSource0: package.tar.gz\nSource1: package.conf\n")
+        write_file(os.path.join(origin, "package.conf"), "")
+        git(origin, "add", ".")
+        git(origin, "commit", "-q", "-m", "first")
+        commit = git(origin, "rev-parse", "HEAD")
+
+        source = make_source("package", origin, commit, "tar czf dist/package-1.0.tar.gz package.conf",
+                             pre_archive_cmd="mkdir dist", archive_glob="dist/*.tar.gz",
+                             last_version=CoprBuilderVersion("1.0", "5", "20200101", "abcdef0"),
+                             builddeps=["make"])
+        assert source.commit == commit
+        assert "make" in source.builddeps
+
+        # run the script the way Copr does, in an empty directory
+        workdir = os.path.join(tmp, "copr")
+        os.mkdir(workdir)
+        write_file(os.path.join(workdir, "script"), source.script)
+        subprocess.run([sys.executable, "script"], cwd=workdir, check=True, stdout=subprocess.DEVNULL)
+
+        resultdir = os.path.join(workdir, SCRIPT_RESULTDIR)
+        assert os.path.exists(os.path.join(resultdir, "package-1.0.tar.gz"))
+
+        # release follows the last build in Copr, archive replaces the source not in the repository
+        date = datetime.date.today().strftime("%Y%m%d")
+        spec = read_file(os.path.join(resultdir, "package.spec")).split("\n")
+        assert "Release: 6.%sgit%s%%{?dist}" % (date, commit[:7]) in spec
+        assert "Source0: package-1.0.tar.gz" in spec
+        assert "Source1: package.conf" in spec
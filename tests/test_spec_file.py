@@ -0,0 +1,66 @@
+import os
+import tempfile
+
+import pytest
+
+from copr_builder import CoprBuilderVersion
+from copr_builder.errors import SRPMBuilderError
+from copr_builder.spec_file import SpecFile
+
+from utils import read_file, write_file
+
+
+SPEC = """Name: copr-builder
+Version: 1.0
+Release: 3%{?dist}
+Summary: Tool for building packages in Copr
+
+Source0: https://example.com/%{name}-%{version}.tar.gz
+Source1:    copr-builder.conf
+
+%description
+Copr builder
+"""
+
+
+def test_spec_file():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "copr-builder.spec")
+        write_file(path, SPEC)
+
+        spec = SpecFile(path)
+        assert spec.version == CoprBuilderVersion("1.0", "3", None, None)
+        assert spec.sources == [(0, "https://example.com/%{name}-%{version}.tar.gz"), (1, "copr-builder.conf")]
+
+        spec.version = CoprBuilderVersion("1.1", "4", "20240101", "cb678c83")
+        spec.sources = [(0, "copr-builder-1.1.tar.gz"), (1, "copr-builder.conf")]
+
+        # nothing is written before write
+        assert read_file(path) == SPEC
+        assert spec.version == CoprBuilderVersion("1.1", "4.20240101gitcb678c83", None, None)
+
+        spec.write()
+        assert not spec.modified
+
+        content = read_file(path)
+        assert "Version: 1.1\n" in content
+        assert "Release: 4.20240101gitcb678c83%{?dist}\n" in content
+        assert "Source0: copr-builder-1.1.tar.gz\n" in content
+        assert "Source1: copr-builder.conf\n" in content
+        assert "Copr builder\n" in content
+        assert os.listdir(tmp) == ["copr-builder.spec"]
+
+        with pytest.raises(SRPMBuilderError):
+            spec.sources = [(0, "copr-builder-1.1.tar.gz")]
+
+
+def test_spec_file_errors():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "copr-builder.spec")
+        write_file(path, "Name: copr-builder\nVersion: 1.0\nSource: copr-builder.tar.gz\n")
+
+        spec = SpecFile(path)
+        with pytest.raises(SRPMBuilderError):
+            spec.version  # pylint: disable=pointless-statement
+        with pytest.raises(SRPMBuilderError):
+            spec.sources  # pylint: disable=pointless-statement
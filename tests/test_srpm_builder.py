@@ -1,10 +1,15 @@
 import pytest
 import os
 import shutil
+import tarfile
+import tempfile
 
-from copr_builder import GIT_URL_CONF, PACKAGE_CONF, ARCHIVE_CMD_CONF, GIT_BRANCH_CONF
+from copr_builder import GIT_URL_CONF, PACKAGE_CONF, ARCHIVE_CMD_CONF, ARCHIVE_GLOB_CONF, GIT_BRANCH_CONF
+from copr_builder.errors import SRPMBuilderError
 from copr_builder.srpm_builder import SRPMBuilder
 
+from utils import write_file
+
 
 def test_build_srpm():
     if not shutil.which("rpmbuild"):
@@ -25,5 +30,38 @@ def test_build_srpm():
     assert os.path.exists(srpm)
 
     srpm_name = os.path.basename(srpm)
-    assert srpm_name.startswith("copr-builder")
+    assert srpm_name.startswith("copr-builder-%s." % srpm_builder.srpm_version)
     assert srpm_name.endswith("src.rpm")
+
+
+def test_make_archive():
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        write_file(os.path.join(tmp, "package.spec"),
+                   "Name: package\nVersion: 1.0\nRelease: 1%{?dist}\nSource0: package.tar.gz\nSource1: package.conf\n")
+        write_file(os.path.join(tmp, "package.conf"), "")
+        os.mkdir(os.path.join(tmp, "dist"))
+
+        # tarball already present in the repository is not a new archive
+        with tarfile.open(os.path.join(tmp, "old.tar.gz"), "w:gz") as tar:
+            tar.add(os.path.join(tmp, "package.conf"), arcname="package.conf")
+
+        project_data = {PACKAGE_CONF: "package", ARCHIVE_CMD_CONF: "tar czf new.tar.gz package.spec"}
+        srpm_builder = SRPMBuilder(project_data, git_dir=tmp)
+        os.chdir(cwd)
+        srpm_builder.make_archive()
+        assert srpm_builder.archives == [os.path.join(tmp, "new.tar.gz")]
+        assert srpm_builder.spec.sources == [(0, os.path.join(tmp, "new.tar.gz")), (1, "package.conf")]
+
+        project_data = {PACKAGE_CONF: "package", ARCHIVE_CMD_CONF: "true"}
+        srpm_builder = SRPMBuilder(project_data, git_dir=tmp)
+        os.chdir(cwd)
+        with pytest.raises(SRPMBuilderError):
+            srpm_builder.make_archive()
+
+        project_data = {PACKAGE_CONF: "package", ARCHIVE_GLOB_CONF: "dist/*.tar.gz",
+                        ARCHIVE_CMD_CONF: "tar czf dist/package-1.0.tar.gz package.spec"}
+        srpm_builder = SRPMBuilder(project_data, git_dir=tmp)
+        os.chdir(cwd)
+        srpm_builder.make_archive()
+        assert srpm_builder.archives == [os.path.join(tmp, "dist/package-1.0.tar.gz")]
@@ -0,0 +1,131 @@
+import configparser
+import os
+import tempfile
+import time
+
+from munch import Munch
+
+import copr_builder.utils
+
+from copr_builder.build_state import BuildStateDB
+from copr_builder.copr_project import CoprProject
+from copr_builder.srpm_cache import SRPMCache
+
+from test_git_repo import git
+from utils import read_file, write_file
+
+
+def test_srpm_cache():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = SRPMCache(os.path.join(tmp, "cache"), max_size=25)
+        dest = os.path.join(tmp, "dest")
+        os.mkdir(dest)
+
+        key_a = SRPMCache.srpm_key("cb678c83", None, "make local", "Version: 1.0")
+        key_b = SRPMCache.srpm_key("cb678c83", None, "make local", "Version: 1.1")
+        assert key_a != key_b
+        assert key_a == SRPMCache.srpm_key("cb678c83", None, "make local", "Version: 1.0")
+
+        assert cache.get(key_a, dest) is None
+
+        srpm = os.path.join(tmp, "package-1.0-1.src.rpm")
+        write_file(srpm, "a" * 10)
+        cache.put(key_a, srpm)
+        os.remove(srpm)
+
+        cached = cache.get(key_a, dest)
+        assert cached == os.path.join(dest, "package-1.0-1.src.rpm")
+        assert read_file(cached) == "a" * 10
+
+        # the cache is full after the second SRPM, the least recently used one is removed
+        time.sleep(0.01)
+        srpm = os.path.join(tmp, "package-1.1-1.src.rpm")
+        write_file(srpm, "b" * 20)
+        cache.put(key_b, srpm)
+
+        assert cache.get(key_a, dest) is None
+        assert cache.get(key_b, dest) is not None
+
+
+class MockCoprClient:
+    @property
+    def project_proxy(self):
+        return self
+
+    def get(self, ownername, projectname):  # pylint: disable=unused-argument
+        return Munch(chroot_repos={"fedora-rawhide-x86_64": ""})
+
+
+def test_project_srpm_cache(monkeypatch):
+    built = []
+
+    def make_srpm(self, _last_version, _last_commit):
+        os.makedirs(self.srpm_builder.rpmdir, exist_ok=True)
+        srpm = os.path.join(self.srpm_builder.rpmdir, "package-1.0-1.src.rpm")
+        write_file(srpm, "srpm %d" % len(built))
+        built.append(srpm)
+        return srpm
+
+    monkeypatch.setattr(CoprProject, "_get_last_build", lambda _self: None)
+    monkeypatch.setattr(CoprProject, "_make_srpm", make_srpm)
+
+    def build(section, date):
+        # merge commits created at a different time get a different hash
+        monkeypatch.setenv("GIT_COMMITTER_DATE", date)
+        copr_builder.utils._command_env.cache_clear()
+        # the SRPM is removed with the clone when the project is deleted
+        project = CoprProject(config[section], MockCoprClient(), srpm_cache=cache, state_db=state_db)
+        return read_file(project.build_srpm())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        origin = os.path.join(tmp, "origin")
+        os.makedirs(origin)
+        git(origin, "init", "-q", "-b", "main")
+        write_file(os.path.join(origin, "package.spec"), "Name: package\nVersion: 1.0\nRelease: 1%{?dist}\n")
+        git(origin, "add", ".")
+        git(origin, "commit", "-q", "-m", "first")
+        git(origin, "checkout", "-q", "-b", "devel")
+        write_file(os.path.join(origin, "devel"), "devel\n")
+        git(origin, "add", ".")
+        git(origin, "commit", "-q", "-m", "devel")
+        git(origin, "checkout", "-q", "main")
+        write_file(os.path.join(origin, "main"), "main\n")
+        git(origin, "add", ".")
+        git(origin, "commit", "-q", "-m", "main")
+
+        config = configparser.ConfigParser()
+        section = {"copr_user": "user", "copr_repo": "repo", "package": "package", "git_url": origin,
+                   "git_branch": "main", "archive_cmd": "true"}
+        config["plain"] = section
+        config["merge"] = dict(section, git_merge_branch="devel")
+        cache = SRPMCache(os.path.join(tmp, "cache"), max_size=2**20)
+        state_db = BuildStateDB(os.path.join(tmp, "builds.db"))
+
+        try:
+            for section in ("plain", "merge"):
+                first = build(section, "2020-01-01T00:00:00")
+                version = state_db.get(section).version
+                assert build(section, "2020-01-02T00:00:00") == first
+                # version of the cached SRPM is the same, release is taken from the spec
+                assert state_db.get(section).version == version
+                assert version.startswith("1.0-2.")
+            assert len(built) == 2
+
+            # new commit in the merged branch needs a new SRPM
+            git(origin, "checkout", "-q", "devel")
+            write_file(os.path.join(origin, "devel"), "devel 2\n")
+            git(origin, "commit", "-q", "-a", "-m", "devel 2")
+            git(origin, "checkout", "-q", "main")
+            build("merge", "2020-01-03T00:00:00")
+            assert len(built) == 3
+
+            # version of SRPMs built from a spec template is not known
+            git(origin, "mv", "package.spec", "package.spec.in")
+            write_file(os.path.join(origin, "package.spec.in"), "Name: package\nVersion: @VERSION@\nRelease: 1\n")
+            git(origin, "commit", "-q", "-a", "-m", "template")
+            build("plain", "2020-01-04T00:00:00")
+            assert len(built) == 4
+            assert state_db.get("plain").version is None
+        finally:
+            monkeypatch.undo()
+            copr_builder.utils._command_env.cache_clear()
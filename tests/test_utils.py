@@ -0,0 +1,56 @@
+import logging
+import time
+
+from copr_builder import utils
+from copr_builder.utils import buffered_log, stream_command
+
+
+def test_stream_command(caplog):
+    lines = []
+    with caplog.at_level(logging.DEBUG, logger="copr.builder"):
+        res = stream_command("echo first; echo second >&2; exit 3", logger=logging.getLogger("copr.builder"),
+                             log_prefix="Test:", on_line=lines.append)
+
+    assert res.returncode == 3
+    assert not res.timed_out
+    assert res.output == "first\nsecond"
+    assert lines == ["first", "second"]
+    assert "Test: first" in caplog.text
+    assert res.max_rss > 0
+
+    res = stream_command(["python3", "-c", "print('\\n'.join(str(i) for i in range(%d)))" % (utils.OUTPUT_LINES * 2)])
+    assert res.returncode == 0
+    assert res.output.split("\n") == [str(i) for i in range(utils.OUTPUT_LINES, utils.OUTPUT_LINES * 2)]
+
+
+def test_stream_command_buffered_log(caplog):
+    logger = logging.getLogger("copr.builder")
+    command = ["python3", "-c", "print('\\n'.join(str(i) for i in range(%d)))" % (utils.OUTPUT_LINES * 2)]
+
+    # only the kept end of the output is held in the log buffer, as one record
+    with caplog.at_level(logging.DEBUG, logger="copr.builder"):
+        with buffered_log(logger):
+            stream_command(command, logger=logger, log_prefix="Test:")
+            assert len(utils._log_buffer.records) == 1
+
+    assert len(caplog.records) == 1
+    expected = [str(i) for i in range(utils.OUTPUT_LINES, utils.OUTPUT_LINES * 2)]
+    assert caplog.records[0].getMessage().split("\n")[1:] == expected
+
+
+def test_stream_command_timeout():
+    start = time.monotonic()
+    # the background process must be killed too, otherwise it keeps the output open
+    res = stream_command("sleep 30 & echo started; sleep 30", timeout=0.5)
+    assert time.monotonic() - start < 10
+
+    assert res.timed_out
+    assert res.returncode < 0
+    assert res.output.startswith("started\n")
+
+    # timeout applies even when the command doesn't keep its output open
+    start = time.monotonic()
+    res = stream_command("exec >/dev/null 2>&1; sleep 30", timeout=1)
+    assert time.monotonic() - start < 10
+    assert res.timed_out
+    assert res.returncode < 0